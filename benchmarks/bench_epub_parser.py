@@ -0,0 +1,88 @@
+"""Compare the BeautifulSoup parser backends on the epub files in test_books/.
+
+For every document item it does what the epub loader does: parse, find the
+paragraphs to translate, insert a copy after each one and serialize the
+chapter back to bytes.
+
+usage: python3 benchmarks/bench_epub_parser.py [--repeat N] [epub ...]
+"""
+
+import argparse
+import time
+import tracemalloc
+import warnings
+import zipfile
+from copy import copy
+from pathlib import Path
+
+from bs4 import BeautifulSoup as bs
+from bs4 import FeatureNotFound
+
+PARSERS = ["html.parser", "lxml", "lxml-xml"]
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def load_documents(epub_path):
+    with zipfile.ZipFile(epub_path) as zf:
+        return [
+            zf.read(name)
+            for name in zf.namelist()
+            if name.endswith((".html", ".xhtml", ".htm"))
+        ]
+
+
+def run_once(documents, parser):
+    nodes = 0
+    for content in documents:
+        soup = bs(content, parser)
+        for p in soup.find_all("p"):
+            p.insert_after(copy(p))
+            nodes += 1
+        soup.encode(encoding="utf-8")
+    return nodes
+
+
+def bench(documents, parser, repeat):
+    run_once(documents, parser)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        nodes = run_once(documents, parser)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    run_once(documents, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, nodes
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("books", nargs="*", help="epub files to benchmark")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    options = arg_parser.parse_args()
+
+    books = options.books or sorted(str(p) for p in TEST_BOOKS.glob("*.epub"))
+    warnings.filterwarnings("ignore")
+
+    print(
+        f"{'book':<32}{'parser':<14}{'time (ms)':>12}{'peak (KiB)':>12}{'speedup':>10}"
+    )
+    for book in books:
+        documents = load_documents(book)
+        baseline = None
+        for parser in PARSERS:
+            try:
+                elapsed, peak, _ = bench(documents, parser, options.repeat)
+            except FeatureNotFound:
+                print(f"{Path(book).name:<32}{parser:<14}{'not installed':>12}")
+                continue
+            baseline = baseline or elapsed
+            print(
+                f"{Path(book).name:<32}{parser:<14}{elapsed * 1000:>12.1f}"
+                f"{peak / 1024:>12.0f}{baseline / elapsed:>9.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
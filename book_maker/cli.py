@@ -1,11 +1,16 @@
 import argparse
 import json
 import os
+import sys
 from os import environ as env
 
 from book_maker.loader import BOOK_LOADER_DICT
+from book_maker.loader.alignment import AlignmentModel, alignment_path, load_alignment
+from book_maker.loader.dry_run import estimate_run, print_estimate
+from book_maker.loader.multilingual import make_multilingual_books
 from book_maker.translator import MODEL_DICT
-from book_maker.utils import LANGUAGES, TO_LANGUAGE_CODE
+from book_maker.translator.memory import MemoryTranslator, TranslationMemory
+from book_maker.utils import LANGUAGES, TO_LANGUAGE_CODE, prompt_config_to_kwargs
 
 
 def parse_prompt_arg(prompt_arg):
@@ -228,9 +233,10 @@ def main():
         type=str,
         choices=sorted(LANGUAGES.keys())
         + sorted([k.title() for k in TO_LANGUAGE_CODE]),
-        default="zh-hans",
+        default=["zh-hans"],
+        nargs="+",
         metavar="LANGUAGE",
-        help="language to translate to, available: {%(choices)s}",
+        help="language to translate to, available: {%(choices)s}. With several languages (epub, txt and md only), the book is parsed once and written once per language, as `*_bilingual_{LANGUAGE}`",
     )
     parser.add_argument(
         "--resume",
@@ -295,6 +301,14 @@ def main():
         default=False,
         help="allow NavigableStrings to be translated",
     )
+    parser.add_argument(
+        "--parser",
+        dest="parser",
+        type=str,
+        default="html.parser",
+        choices=["html.parser", "lxml", "lxml-xml"],
+        help="HTML/XHTML parser backend for epub files, `lxml` and `lxml-xml` are much faster on large books, `lxml-xml` keeps XHTML self-closing tags and namespaces intact (requires lxml)",
+    )
     parser.add_argument(
         "--prompt",
         dest="prompt_arg",
@@ -326,13 +340,21 @@ So you are close to reaching the limit. You have to choose your own value, there
         type=int,
         help="how many lines will be translated by aggregated translation(This options currently only applies to txt files)",
     )
+    parser.add_argument(
+        "--batch-tokens",
+        dest="batch_tokens",
+        type=int,
+        default=0,
+        metavar="TOKENS",
+        help="txt and pdf only: pack whole paragraphs into batches of about TOKENS tokens instead of fixed line (txt) or paragraph (pdf) counts; --batch_size then only caps the lines or paragraphs of a batch. Default: 0 (off)",
+    )
     parser.add_argument(
         "--retranslate",
         dest="retranslate",
-        nargs=4,
+        nargs="+",
         type=str,
-        help="""--retranslate "$translated_filepath" "file_name_in_epub" "start_str" "end_str"(optional)
-        Retranslate from start_str to end_str's tag:
+        help="""--retranslate "$translated_filepath" "file_name_in_epub" "start_str" "end_str"(optional) ["file_name_in_epub" "start_str" "end_str" ...]
+        Retranslate from start_str to end_str's tag, several passages can be given at once, file_name_in_epub can be "" to search every chapter:
         python3 "make_book.py" --book_name "test_books/animal_farm.epub" --retranslate 'test_books/animal_farm_bilingual.epub' 'index_split_002.html' 'in spite of the present book shortage which' 'This kind of thing is not a good symptom. Obviously'
         Retranslate start_str's tag:
         python3 "make_book.py" --book_name "test_books/animal_farm.epub" --retranslate 'test_books/animal_farm_bilingual.epub' 'index_split_002.html' 'in spite of the present book shortage which'
@@ -403,10 +425,85 @@ So you are close to reaching the limit. You have to choose your own value, there
         dest="parallel_workers",
         type=int,
         default=1,
-        help="Number of parallel workers for EPUB chapter processing. Use 2-4 for better performance. Default: 1",
+        help="Number of parallel workers for EPUB chapters, or TXT/MD/PDF batches. Use 2-4 for better performance. Default: 1",
+    )
+    parser.add_argument(
+        "--rpm",
+        dest="requests_per_minute",
+        type=float,
+        default=0,
+        help="with --parallel-workers, the maximum number of translation requests per minute of all the workers together (not for srt). Default: 0 (no limit)",
+    )
+    parser.add_argument(
+        "--process-workers",
+        dest="process_workers",
+        type=int,
+        default=0,
+        help="Number of processes that parse and serialize EPUB chapters when --parallel-workers is used, so the HTML work runs on several cores. For PDF books, the number of processes that extract the text of the pages. Default: 0 (done in the worker threads)",
+    )
+    parser.add_argument(
+        "--split-chapter-tokens",
+        dest="split_chapter_tokens",
+        type=int,
+        default=0,
+        metavar="TOKENS",
+        help="with --parallel-workers, translate EPUB chapters of more than TOKENS tokens in several parts at the same time. Each part keeps its own context. Default: 0 (never split)",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        dest="snapshot_interval",
+        type=float,
+        default=0,
+        metavar="MINUTES",
+        help="save the chapters translated so far to `*_bilingual_temp.epub` every MINUTES minutes (epub only), by default it is only saved on interrupt",
+    )
+
+    parser.add_argument(
+        "--alignment",
+        dest="alignment",
+        type=str,
+        help="with `render`, the alignment sidecar to make the output from. Default: the `*_bilingual.align` file next to the book",
+    )
+    parser.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        help="only print the number of requests, the tokens, the cost and the time the translation would take, with the prices and rate limits of the `dry_run` config, without calling the translator",
+    )
+    parser.add_argument(
+        "--translation-memory",
+        dest="translation_memory",
+        type=str,
+        metavar="PATH",
+        help="keep the translations in a translation memory at PATH, shared by every book translated with it: a paragraph that only differs from a stored one by numbers or placeholders reuses its translation, a similar one is sent with it as an example",
+    )
+    parser.add_argument(
+        "--tm-threshold",
+        dest="tm_threshold",
+        type=float,
+        default=0.8,
+        help="similarity (0-1) from which a paragraph of the translation memory is used for a new one, default 0.8",
+    )
+    parser.add_argument(
+        "--update-from",
+        dest="update_from",
+        nargs=2,
+        metavar=("OLD_BOOK", "OLD_SIDECAR"),
+        help="reuse the translations of a previous edition of the book (epub, txt and md only): its source and the `*_bilingual.align` sidecar of its translation, only inserted or edited paragraphs are sent to the model",
     )
 
-    options = parser.parse_args()
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.add_parser(
+        "render",
+        add_help=False,
+        help="make the output again from the `*_bilingual.align` sidecar of a previous run, without translating anything, e.g. `render --book_name book.epub --single_translate`. Takes the options above, before or after it",
+    )
+    # the options after `render` are left to the subcommand, read them here so
+    # they are declared, and defaulted, only once
+    options, rest = parser.parse_known_args()
+    if rest:
+        options = parser.parse_args(rest, namespace=options)
+    render = options.command == "render"
 
     if not options.book_name:
         print("Error: please provide the path of your book using --book_name <path>")
@@ -423,7 +520,10 @@ So you are close to reaching the limit. You have to choose your own value, there
     translate_model = MODEL_DICT.get(options.model)
     assert translate_model is not None, "unsupported model"
     API_KEY = ""
-    if options.model in [
+    if render or options.dry_run:
+        # nothing is sent to a translator
+        translate_model = AlignmentModel
+    elif options.model in [
         "openai",
         "chatgptapi",
         "gpt4",
@@ -502,12 +602,34 @@ So you are close to reaching the limit. You have to choose your own value, there
             "block_size must be used with `--single_translate` because it disturbs the original format",
         )
 
+    if render and book_type == "pdf":
+        raise Exception("render only supports epub, txt, md and srt files")
+    if options.batch_tokens and book_type not in ("txt", "pdf"):
+        raise Exception("--batch-tokens only supports txt and pdf files")
+    if options.update_from and book_type not in ("epub", "txt", "md"):
+        raise Exception("--update-from only supports epub, txt and md files")
+
     book_loader = BOOK_LOADER_DICT.get(book_type)
     assert book_loader is not None, "unsupported loader"
-    language = options.language
-    if options.language in LANGUAGES:
+    # (tag, language): the tag names the output, the language goes to the prompt
+    languages = [
         # use the value for prompt
-        language = LANGUAGES.get(language, language)
+        (tag, LANGUAGES.get(tag, tag))
+        for tag in dict.fromkeys(options.language)
+    ]
+    if len(languages) > 1 and (
+        book_type not in ("epub", "txt", "md")
+        or render
+        or options.retranslate
+        or options.update_from
+        or options.batch_flag
+        or options.batch_use_flag
+        or options.accumulated_num > 1
+        or options.block_size > 0
+    ):
+        raise Exception(
+            "several languages only support translating epub, txt and md files, without --accumulated_num and --block_size"
+        )
 
     # change api_base for issue #42
     model_api_base = options.api_base
@@ -516,111 +638,223 @@ So you are close to reaching the limit. You have to choose your own value, there
         # ollama default api_base
         model_api_base = "http://localhost:11434/v1"
 
-    e = book_loader(
-        options.book_name,
-        translate_model,
-        API_KEY,
-        options.resume,
-        language=language,
-        model_api_base=model_api_base,
-        is_test=options.test,
-        test_num=options.test_num,
-        prompt_config=parse_prompt_arg(options.prompt_arg),
-        single_translate=options.single_translate,
-        context_flag=options.context_flag,
-        context_paragraph_limit=options.context_paragraph_limit,
-        temperature=options.temperature,
-        source_lang=options.source_lang,
-        parallel_workers=options.parallel_workers,
-    )
-    # other options
-    if options.allow_navigable_strings:
-        e.allow_navigable_strings = True
-    if options.translate_tags:
-        e.translate_tags = options.translate_tags
-    if options.exclude_translate_tags:
-        e.exclude_translate_tags = options.exclude_translate_tags
-    if options.exclude_filelist:
-        e.exclude_filelist = options.exclude_filelist
-    if options.only_filelist:
-        e.only_filelist = options.only_filelist
-    if options.accumulated_num > 1:
-        e.accumulated_num = options.accumulated_num
-    if options.translation_style:
-        e.translation_style = options.translation_style
-    if options.batch_size:
-        e.batch_size = options.batch_size
+    def create_loader(model, language, resume=options.resume):
+        e = book_loader(
+            options.book_name,
+            model,
+            API_KEY,
+            resume,
+            language=language,
+            model_api_base=model_api_base,
+            is_test=options.test,
+            test_num=options.test_num,
+            prompt_config=parse_prompt_arg(options.prompt_arg),
+            single_translate=options.single_translate,
+            context_flag=options.context_flag,
+            context_paragraph_limit=options.context_paragraph_limit,
+            temperature=options.temperature,
+            source_lang=options.source_lang,
+            parallel_workers=options.parallel_workers,
+        )
+        # other options
+        if options.allow_navigable_strings:
+            e.allow_navigable_strings = True
+        if book_type == "epub" and options.parser != "html.parser":
+            e.set_parser(options.parser)
+        if book_type == "epub" and options.process_workers:
+            e.set_process_workers(options.process_workers)
+        if book_type == "pdf" and options.process_workers:
+            e.process_workers = max(0, options.process_workers)
+        if book_type != "srt" and options.requests_per_minute:
+            e.requests_per_minute = options.requests_per_minute
+        if book_type == "epub" and options.split_chapter_tokens:
+            e.split_chapter_tokens = options.split_chapter_tokens
+        if book_type == "epub" and options.snapshot_interval:
+            e.snapshot_interval = options.snapshot_interval
+        if options.translate_tags:
+            e.translate_tags = options.translate_tags
+        if options.exclude_translate_tags:
+            e.exclude_translate_tags = options.exclude_translate_tags
+        if options.exclude_filelist:
+            e.exclude_filelist = options.exclude_filelist
+        if options.only_filelist:
+            e.only_filelist = options.only_filelist
+        if options.accumulated_num > 1:
+            e.accumulated_num = options.accumulated_num
+        if options.translation_style:
+            e.translation_style = options.translation_style
+        if options.batch_size:
+            e.batch_size = options.batch_size
+        if options.batch_tokens > 0:
+            e.batch_tokens = options.batch_tokens
+            # --batch_size is only a cap of the lines of a batch then
+            e.batch_size = options.batch_size or sys.maxsize
+        if options.block_size > 0:
+            e.block_size = options.block_size
+        return e
+
+    # several languages resume from a journal per language
+    e = create_loader(
+        translate_model, languages[0][1], resume=options.resume and len(languages) == 1
+    )
     if options.retranslate:
-        e.retranslate = options.retranslate
-    if options.deployment_id:
-        # only work for ChatGPT api for now
-        # later maybe support others
-        assert options.model in [
-            "chatgptapi",
-            "gpt4",
-            "gpt4omini",
-            "gpt4o",
-            "gpt5mini",
-            "o1",
-            "o1preview",
-            "o1mini",
-            "o3mini",
-        ], "only support chatgptapi for deployment_id"
-        if not options.api_base:
-            raise ValueError("`api_base` must be provided when using `deployment_id`")
-        e.translate_model.set_deployment_id(options.deployment_id)
-    if options.model in ("openai", "groq"):
-        # Currently only supports `openai` when you also have --model_list set
-        if options.model_list:
-            e.translate_model.set_model_list(options.model_list.split(","))
-        else:
-            raise ValueError(
-                "When using `openai` model, you must also provide `--model_list`. For default model sets use `--model chatgptapi` or `--model gpt4` or `--model gpt4omini` or `--model gpt5mini`",
+        complete_book_name, *passages = options.retranslate
+        if len(passages) % 3 == 2:
+            # the end_str of the last passage is optional
+            passages.append("")
+        if not passages or len(passages) % 3:
+            print(
+                "Error: --retranslate takes the translated book, then file_name_in_epub, start_str and end_str for each passage"
             )
-    # TODO refactor, quick fix for gpt4 model
-    if options.model == "chatgptapi":
-        if options.ollama_model:
-            e.translate_model.set_gpt35_models(ollama_model=options.ollama_model)
-        else:
-            e.translate_model.set_gpt35_models()
-    if options.model == "gpt4":
-        e.translate_model.set_gpt4_models()
-    if options.model == "gpt4omini":
-        e.translate_model.set_gpt4omini_models()
-    if options.model == "gpt4o":
-        e.translate_model.set_gpt4o_models()
-    if options.model == "gpt5mini":
-        e.translate_model.set_gpt5mini_models()
-    if options.model == "o1preview":
-        e.translate_model.set_o1preview_models()
-    if options.model == "o1":
-        e.translate_model.set_o1_models()
-    if options.model == "o1mini":
-        e.translate_model.set_o1mini_models()
-    if options.model == "o3mini":
-        e.translate_model.set_o3mini_models()
-    if options.model.startswith("claude-"):
-        e.translate_model.set_claude_model(options.model)
-    if options.model.startswith("qwen-"):
-        e.translate_model.set_qwen_model(options.model)
-    if options.block_size > 0:
-        e.block_size = options.block_size
+            exit(1)
+        e.retranslate = [complete_book_name, *passages]
+    if render:
+        name, _ = os.path.splitext(options.book_name)
+        e.use_alignment(
+            load_alignment(
+                options.alignment or alignment_path(f"{name}_bilingual.{book_type}")
+            )
+        )
+        e.make_bilingual_book()
+        return
+    if options.update_from:
+        old_book, old_sidecar = options.update_from
+        e.update_from(old_book, load_alignment(old_sidecar))
+    if options.dry_run:
+        prompt = (parse_prompt_arg(options.prompt_arg) or {}).get("user") or getattr(
+            MODEL_DICT.get(options.model), "DEFAULT_PROMPT", ""
+        )
+        print_estimate(
+            estimate_run(
+                e.plan_requests(),
+                options.model,
+                [language for _, language in languages],
+                workers=options.parallel_workers,
+                requests_per_minute=options.requests_per_minute,
+                prompt=prompt,
+            ),
+            workers=options.parallel_workers,
+        )
+        return
+
+    def configure_translator(translator):
+        # the options that are set on the translator after it is made
+        if options.deployment_id:
+            # only work for ChatGPT api for now
+            # later maybe support others
+            assert options.model in [
+                "chatgptapi",
+                "gpt4",
+                "gpt4omini",
+                "gpt4o",
+                "gpt5mini",
+                "o1",
+                "o1preview",
+                "o1mini",
+                "o3mini",
+            ], "only support chatgptapi for deployment_id"
+            if not options.api_base:
+                raise ValueError(
+                    "`api_base` must be provided when using `deployment_id`"
+                )
+            translator.set_deployment_id(options.deployment_id)
+        if options.model in ("openai", "groq"):
+            # Currently only supports `openai` when you also have --model_list set
+            if options.model_list:
+                translator.set_model_list(options.model_list.split(","))
+            else:
+                raise ValueError(
+                    "When using `openai` model, you must also provide `--model_list`. For default model sets use `--model chatgptapi` or `--model gpt4` or `--model gpt4omini` or `--model gpt5mini`",
+                )
+        # TODO refactor, quick fix for gpt4 model
+        if options.model == "chatgptapi":
+            if options.ollama_model:
+                translator.set_gpt35_models(ollama_model=options.ollama_model)
+            else:
+                translator.set_gpt35_models()
+        if options.model == "gpt4":
+            translator.set_gpt4_models()
+        if options.model == "gpt4omini":
+            translator.set_gpt4omini_models()
+        if options.model == "gpt4o":
+            translator.set_gpt4o_models()
+        if options.model == "gpt5mini":
+            translator.set_gpt5mini_models()
+        if options.model == "o1preview":
+            translator.set_o1preview_models()
+        if options.model == "o1":
+            translator.set_o1_models()
+        if options.model == "o1mini":
+            translator.set_o1mini_models()
+        if options.model == "o3mini":
+            translator.set_o3mini_models()
+        if options.model.startswith("claude-"):
+            translator.set_claude_model(options.model)
+        if options.model.startswith("qwen-"):
+            translator.set_qwen_model(options.model)
+
+        if options.model in ("gemini", "geminipro"):
+            translator.set_interval(options.interval)
+        if options.model == "gemini":
+            if options.model_list:
+                translator.set_model_list(options.model_list.split(","))
+            else:
+                translator.set_geminiflash_models()
+        if options.model == "geminipro":
+            translator.set_geminipro_models()
+        return translator
+
+    configure_translator(e.translate_model)
     if options.batch_flag:
         e.batch_flag = options.batch_flag
     if options.batch_use_flag:
         e.batch_use_flag = options.batch_use_flag
 
-    if options.model in ("gemini", "geminipro"):
-        e.translate_model.set_interval(options.interval)
-    if options.model == "gemini":
-        if options.model_list:
-            e.translate_model.set_model_list(options.model_list.split(","))
+    memory = None
+    if options.translation_memory:
+        memory = TranslationMemory(options.translation_memory, options.tm_threshold)
+        e.translate_model = MemoryTranslator(e.translate_model, memory)
+
+    def create_translator(language):
+        # translators work out their target from `language` when they are made
+        context = {}
+        if book_type == "epub":
+            context = {
+                "context_flag": options.context_flag,
+                "context_paragraph_limit": options.context_paragraph_limit,
+            }
+        translator = configure_translator(
+            translate_model(
+                API_KEY,
+                language,
+                api_base=model_api_base,
+                temperature=options.temperature,
+                source_lang=options.source_lang,
+                **context,
+                **prompt_config_to_kwargs(parse_prompt_arg(options.prompt_arg)),
+            )
+        )
+        if memory is not None:
+            translator = MemoryTranslator(translator, memory)
+        return translator
+
+    try:
+        if len(languages) > 1:
+            make_multilingual_books(
+                e,
+                languages,
+                # the outputs are written from the translations of each language
+                lambda language: create_loader(AlignmentModel, language, resume=False),
+                create_translator,
+                workers=options.parallel_workers,
+                requests_per_minute=options.requests_per_minute,
+                resume=options.resume,
+            )
         else:
-            e.translate_model.set_geminiflash_models()
-    if options.model == "geminipro":
-        e.translate_model.set_geminipro_models()
-
-    e.make_bilingual_book()
+            e.make_bilingual_book()
+    finally:
+        if memory is not None:
+            memory.close()
 
 
 if __name__ == "__main__":
@@ -5,4 +5,47 @@ config = {
             "batch_context_update_interval": 50,
         }
     },
+    # used by --dry-run to estimate a run, set them to the prices and the
+    # limits of your account
+    "dry_run": {
+        # per --model: USD per million input and output tokens, requests and
+        # tokens per minute, 0 when unknown or unlimited
+        "models": {
+            "chatgptapi": {
+                "input_price": 0.5,
+                "output_price": 1.5,
+                "rpm": 3500,
+                "tpm": 160000,
+            },
+            "gpt4omini": {
+                "input_price": 0.15,
+                "output_price": 0.6,
+                "rpm": 500,
+                "tpm": 200000,
+            },
+            "gpt4o": {
+                "input_price": 2.5,
+                "output_price": 10.0,
+                "rpm": 500,
+                "tpm": 30000,
+            },
+            "gpt5mini": {
+                "input_price": 0.25,
+                "output_price": 2.0,
+                "rpm": 500,
+                "tpm": 200000,
+            },
+        },
+        # output tokens per input token, by target language in lower case
+        "output_ratio": {
+            "default": 1.0,
+            "simplified chinese": 1.2,
+            "traditional chinese": 1.3,
+            "japanese": 1.4,
+            "korean": 1.4,
+        },
+        # seconds before the first token of a response, then tokens per second
+        "latency": 1.0,
+        "output_tokens_per_second": 50,
+    },
 }
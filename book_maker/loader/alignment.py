@@ -0,0 +1,100 @@
+import difflib
+import os
+
+from .journal import ProgressJournal, text_hash
+
+
+def alignment_path(output_name):
+    """Alignment sidecar of an output file, next to it."""
+    name, _ = os.path.splitext(output_name)
+    return f"{name}.align"
+
+
+def save_alignment(output_name, translations):
+    """Write the ``{segment key: translation}`` pairs an output was made from.
+
+    The sidecar uses the record format of the resume journal, one record per
+    segment. Its keys end with the hash of the source text of the segment.
+    """
+    ProgressJournal(alignment_path(output_name)).compact(translations)
+
+
+def load_alignment(path):
+    try:
+        return ProgressJournal(path).load()
+    except FileNotFoundError as e:
+        raise Exception(
+            f"can not find the alignment sidecar {path}, translate the book first"
+        ) from e
+    except ValueError as e:
+        raise Exception(f"{path} is not an alignment sidecar") from e
+
+
+def match_segments(old_segments, new_segments, old_translations):
+    """Find the translations of a previous edition that still apply.
+
+    Args:
+        old_segments, new_segments: ``(key, source hash)`` of the segments of
+            both editions, in reading order.
+        old_translations: ``{key: translation}`` of the previous edition, the
+            pairs of its alignment sidecar.
+
+    Returns ``{new key: translation}``. A diff over the source hashes pairs the
+    unchanged runs of segments; a segment outside them whose source is
+    unchanged somewhere else in the book, e.g. a moved paragraph, is reused too.
+    Inserted and edited segments are left out, they have to be translated.
+    """
+    matcher = difflib.SequenceMatcher(
+        None,
+        [digest for _, digest in old_segments],
+        [digest for _, digest in new_segments],
+        autojunk=False,
+    )
+    reused = {}
+    unmatched = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            unmatched.extend(new_segments[j1:j2])
+            continue
+        for (old_key, _), (new_key, _) in zip(old_segments[i1:i2], new_segments[j1:j2]):
+            if old_key in old_translations:
+                reused[new_key] = old_translations[old_key]
+    by_hash = {
+        key.rsplit(":", 1)[-1]: translation
+        for key, translation in old_translations.items()
+    }
+    for new_key, digest in unmatched:
+        if digest in by_hash:
+            reused[new_key] = by_hash[digest]
+    return reused
+
+
+class AlignmentModel:
+    """Translator that answers from an alignment sidecar, without any API call.
+
+    `render` builds the outputs with it. A text is looked up by the hash of its
+    source; a text the sidecar has no translation for is returned as it is.
+    """
+
+    def __init__(
+        self, key, language, context_flag=False, context_paragraph_limit=0, **kwargs
+    ):
+        self.context_flag = False
+        self.context_paragraph_limit = context_paragraph_limit
+        self.translations = {}
+        self.missing = 0
+
+    def load(self, translations):
+        self.translations = {
+            key.rsplit(":", 1)[-1]: text for key, text in translations.items()
+        }
+
+    def translate(self, text, *args, **kwargs):
+        translation = self.translations.get(text_hash(text))
+        if translation is None:
+            self.missing += 1
+            return text
+        return translation
+
+    def translate_list(self, plist):
+        return [self.translate(p.text) for p in plist]
@@ -25,3 +25,20 @@ class BaseBookLoader(ABC):
     @abstractmethod
     def _save_progress(self):
         pass
+
+    def use_alignment(self, translations):
+        """Make the output from an alignment sidecar instead of translating it.
+
+        Args:
+            translations: the ``{segment key: translation}`` pairs of the
+                sidecar, the translator must be an `AlignmentModel`.
+        """
+        self.translate_model.load(translations)
+
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        raise Exception(f"{type(self).__name__} can not plan its segments")
+
+    def plan_requests(self):
+        """Texts of the requests a run would send, see `--dry-run`."""
+        return [text for _, text in self.plan_segments()]
@@ -0,0 +1,148 @@
+import string
+from copy import copy
+
+from bs4 import BeautifulSoup as bs
+from bs4 import Tag
+from bs4.element import Comment, NavigableString, XMLProcessingInstruction
+
+from .helper import insert_trans, is_text_link
+from .journal import paragraph_key
+
+# The functions below only take and return plain values (bytes, str, dict), so
+# the CPU heavy part of a chapter, parsing and serializing it, can run in a
+# ProcessPoolExecutor while the main process sends the translation requests.
+# `options` is the dict built by `EPUBBookLoader._chapter_options`.
+
+
+def is_special_text(text):
+    return (
+        text.isdigit()
+        or text.isspace()
+        or is_text_link(text)
+        or all(char in string.punctuation for char in text)
+    )
+
+
+def has_nest_child(element, trans_taglist):
+    if isinstance(element, Tag):
+        for child in element.children:
+            if child.name in trans_taglist:
+                return True
+            if has_nest_child(child, trans_taglist):
+                return True
+    return False
+
+
+def filter_nest_list(p_list, trans_taglist):
+    return [p for p in p_list if not has_nest_child(p, trans_taglist)]
+
+
+def extract_paragraph(p, exclude_translate_tags):
+    for p_exclude in exclude_translate_tags.split(","):
+        # for issue #280
+        if type(p) is NavigableString:
+            continue
+        for pt in p.find_all(p_exclude):
+            pt.extract()
+    return p
+
+
+def find_paragraphs(soup, options):
+    trans_taglist = options["translate_tags"].split(",")
+    p_list = filter_nest_list(soup.findAll(trans_taglist), trans_taglist)
+    if options["allow_navigable_strings"]:
+        p_list.extend(soup.findAll(text=True))
+    return p_list
+
+
+def encode_chapter(soup):
+    """Bytes of a parsed chapter.
+
+    The HTML parser of lxml reads the ``<?xml ...?>`` declaration as a comment,
+    it is written back as a declaration.
+    """
+    first = soup.contents[0] if soup.contents else None
+    if isinstance(first, Comment) and first.startswith("?xml") and first.endswith("?"):
+        first.replace_with(XMLProcessingInstruction(first[1:-1]))
+    return soup.encode(encoding="utf-8")
+
+
+def extract_segments(file_name, content, options):
+    """Return the ``(key, text)`` pairs to translate in a chapter.
+
+    None means the chapter has nothing that could be translated and is kept as
+    it is.
+    """
+    p_list = find_paragraphs(bs(content, options["parser"]), options)
+    if not p_list:
+        return None
+    segments = []
+    for ordinal, p in enumerate(p_list):
+        if not p.text or is_special_text(p.text):
+            continue
+        text = extract_paragraph(copy(p), options["exclude_translate_tags"]).text
+        segments.append((paragraph_key(file_name, ordinal, p.text), text))
+    return segments
+
+
+def apply_translations(file_name, content, options, translations):
+    """Insert ``{key: translation}`` into a chapter.
+
+    Returns the new bytes of the chapter and the spans of its paragraphs, see
+    `paragraph_spans`.
+    """
+    soup = bs(content, options["parser"])
+    p_list = find_paragraphs(soup, options)
+    keys = [paragraph_key(file_name, i, p.text) for i, p in enumerate(p_list)]
+    for p, key in zip(p_list, keys):
+        if key not in translations:
+            continue
+        if isinstance(p, NavigableString):
+            p.insert_after(NavigableString(translations[key]))
+            if options["single_translate"]:
+                p.extract()
+        else:
+            insert_trans(
+                p,
+                translations[key],
+                options["translation_style"],
+                options["single_translate"],
+            )
+    content = encode_chapter(soup)
+    return content, paragraph_spans(content, p_list, keys, translations, options)
+
+
+def render_paragraph(p, text, options):
+    """Bytes a paragraph and its translation `text` are written as in a chapter."""
+    holder = Tag(name="div")
+    p = copy(p)
+    holder.append(p)
+    if isinstance(p, NavigableString):
+        p.insert_after(NavigableString(text))
+        if options["single_translate"]:
+            p.extract()
+    else:
+        insert_trans(p, text, options["translation_style"], options["single_translate"])
+    return holder.decode_contents().encode("utf-8")
+
+
+def paragraph_spans(content, p_list, keys, translations, options):
+    """Byte spans of the translated paragraphs in `content`, the written chapter.
+
+    Returns ``[(key, start, end)]`` in document order. A span covers the
+    paragraph and its translation as they are in `content`; the paragraphs
+    that can't be found there, e.g. with other translated strings nested in
+    them, are left out.
+    """
+    spans = []
+    position = 0
+    for p, key in zip(p_list, keys):
+        if key not in translations:
+            continue
+        rendered = render_paragraph(p, translations[key], options)
+        start = content.find(rendered, position)
+        if start < 0:
+            continue
+        position = start + len(rendered)
+        spans.append((key, start, position))
+    return spans
@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+from book_maker.config import config
+
+from .scheduling import count_tokens, makespan
+
+DRY_RUN_CONFIG = config["dry_run"]
+
+Estimate = namedtuple(
+    "Estimate",
+    [
+        "requests",
+        "input_tokens",
+        "output_tokens",
+        "cost",
+        "makespan",
+        "bound",
+        "languages",
+    ],
+)
+
+
+def estimate_run(
+    requests, model, languages, workers=1, requests_per_minute=0, prompt=""
+):
+    """Estimate what translating `requests` costs, without sending anything.
+
+    Args:
+        requests: the texts a run sends, see `plan_requests` of the loaders.
+        model: the `--model` of the run, its prices and rate limits are read
+            from the ``dry_run`` config.
+        languages: the target languages, each one is a request per text.
+        workers: parallel workers of the run.
+        requests_per_minute: `--rpm`, overrides the limit of the config.
+        prompt: the prompt template, sent with every text.
+
+    The output of a request is estimated from its input and the output ratio
+    of the language. The makespan is the longest of the time the workers
+    need for the requests, given the latency of the config, and the time
+    the requests and tokens per minute limits allow.
+    """
+    limits = DRY_RUN_CONFIG["models"].get(model, {})
+    ratios = DRY_RUN_CONFIG["output_ratio"]
+    text_tokens = count_tokens(list(requests))
+    prompt_tokens = count_tokens([prompt])[0] if prompt else 0
+
+    per_language = {}
+    durations = []
+    for language in languages:
+        ratio = ratios.get(language.lower(), ratios["default"])
+        outputs = [tokens * ratio for tokens in text_tokens]
+        per_language[language] = (
+            sum(text_tokens) + prompt_tokens * len(text_tokens),
+            int(sum(outputs)),
+        )
+        durations.extend(
+            DRY_RUN_CONFIG["latency"]
+            + output / DRY_RUN_CONFIG["output_tokens_per_second"]
+            for output in outputs
+        )
+
+    request_count = len(text_tokens) * len(languages)
+    input_tokens = sum(tokens for tokens, _ in per_language.values())
+    output_tokens = sum(tokens for _, tokens in per_language.values())
+    cost = None
+    if "input_price" in limits:
+        cost = (
+            input_tokens * limits["input_price"]
+            + output_tokens * limits["output_price"]
+        ) / 1_000_000
+
+    bounds = {"workers": makespan(durations, workers) if durations else 0.0}
+    rpm = requests_per_minute or limits.get("rpm", 0)
+    if rpm:
+        bounds["requests per minute"] = request_count / rpm * 60
+    if limits.get("tpm"):
+        bounds["tokens per minute"] = (
+            (input_tokens + output_tokens) / limits["tpm"] * 60
+        )
+    bound = max(bounds, key=bounds.get)
+    return Estimate(
+        request_count,
+        input_tokens,
+        output_tokens,
+        cost,
+        bounds[bound],
+        bound,
+        per_language,
+    )
+
+
+def print_estimate(estimate, workers=1):
+    print("📋 Dry run, nothing was sent to the translator")
+    print(f"   requests:      {estimate.requests}")
+    print(f"   input tokens:  {estimate.input_tokens}")
+    print(f"   output tokens: {estimate.output_tokens} (estimated)")
+    if len(estimate.languages) > 1:
+        for language, (input_tokens, output_tokens) in estimate.languages.items():
+            print(f"     {language}: {input_tokens} in, {output_tokens} out")
+    if estimate.cost is None:
+        print("   cost:          unknown, add the prices of the model to the config")
+    else:
+        print(f"   cost:          ${estimate.cost:.2f}")
+    minutes, seconds = divmod(int(estimate.makespan), 60)
+    hours, minutes = divmod(minutes, 60)
+    print(
+        f"   makespan:      {hours}h{minutes:02d}m{seconds:02d}s with {workers} "
+        f"workers, limited by the {estimate.bound}"
+    )
@@ -1,25 +1,58 @@
 import os
 import pickle
-import string
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from copy import copy
+from itertools import groupby
+from datetime import datetime, timezone
 from pathlib import Path
 import traceback
+import uuid
+import zipfile
 from threading import Lock
 
 from bs4 import BeautifulSoup as bs
-from bs4 import Tag
+from bs4 import FeatureNotFound
 from bs4.element import NavigableString
 from ebooklib import ITEM_DOCUMENT, epub
 from rich import print
 from tqdm import tqdm
 
+from book_maker.translator.pool import RateLimiter, TranslatorPool
 from book_maker.utils import num_tokens_from_text, prompt_config_to_kwargs
 
+from .alignment import match_segments, save_alignment
 from .base_loader import BaseBookLoader
-from .helper import EPUBBookLoaderHelper, is_text_link, not_trans
+from .epub_writer import (
+    ZIP_DATE_TIME,
+    StreamingEpubWriter,
+    read_epub_lazily,
+    replace_entries,
+)
+from .chapter_worker import (
+    apply_translations,
+    encode_chapter,
+    extract_paragraph,
+    extract_segments,
+    filter_nest_list,
+    find_paragraphs,
+    has_nest_child,
+    is_special_text,
+    paragraph_spans,
+    render_paragraph,
+)
+from .helper import EPUBBookLoaderHelper, not_trans
+from .journal import ChapterCheckpoints, ProgressJournal, paragraph_key, text_hash
+from .paragraph_index import ParagraphIndex, index_path, key_ordinal, span_text
+from .scheduling import (
+    ReorderBuffer,
+    chapter_cost,
+    lpt_order,
+    makespan,
+    split_segments,
+)
 
 
 class EPUBBookLoader(BaseBookLoader):
@@ -58,6 +91,10 @@ class EPUBBookLoader(BaseBookLoader):
         self.translate_tags = "p"
         self.exclude_translate_tags = "sup"
         self.allow_navigable_strings = False
+        self.parser = "html.parser"
+        # minutes between temp book snapshots, 0 only saves one on interrupt
+        self.snapshot_interval = 0
+        self._last_snapshot = time.monotonic()
         self.accumulated_num = 1
         self.translation_style = ""
         self.context_flag = context_flag
@@ -76,8 +113,20 @@ class EPUBBookLoader(BaseBookLoader):
         self.batch_flag = False
         self.parallel_workers = 1
         self.enable_parallel = False
+        self.process_workers = 0
+        self._process_pool = None
+        # chapters with more tokens are translated in parts, 0 never splits
+        self.split_chapter_tokens = 0
+        # requests per minute of all the parallel workers together, 0 is unlimited
+        self.requests_per_minute = 0
+        self._translator_pool = None
+        # where the paragraphs are in the output, for --retranslate
+        self.paragraph_index = ParagraphIndex()
+        # made from an alignment sidecar by `render`, nothing is translated
+        self.rendering = False
+        # appended to `*_bilingual` in the output names, e.g. one per language
+        self.output_suffix = ""
         self._progress_lock = Lock()
-        self._translation_index = 0
         self.set_parallel_workers(parallel_workers)
 
         # monkey patch for # 173
@@ -106,7 +155,8 @@ class EPUBBookLoader(BaseBookLoader):
         epub.EpubReader._check_deprecated = _check_deprecated
 
         try:
-            self.origin_book = epub.read_epub(self.epub_name)
+            # images, fonts and styles stay in the zip until they are copied to the output
+            self.origin_reader = read_epub_lazily(self.epub_name)
         except Exception:
             # tricky monkey patch for #71 if you don't know why please check the issue and ignore this
             # when upstream change will TODO fix this
@@ -119,25 +169,32 @@ class EPUBBookLoader(BaseBookLoader):
                 obj.book.set_direction(spine.get("page-progression-direction", None))
 
             epub.EpubReader._load_spine = _load_spine
-            self.origin_book = epub.read_epub(self.epub_name)
+            self.origin_reader = read_epub_lazily(self.epub_name)
+        self.origin_book = self.origin_reader.book
 
-        self.p_to_save = []
+        # resume key -> translation, see `paragraph_key`
+        self.p_to_save = {}
+        self._positional_state = None
         self.resume = resume
         self.bin_path = f"{Path(epub_name).parent}/.{Path(epub_name).stem}.temp.bin"
+        self.journal = ProgressJournal(self.bin_path)
+        self.checkpoints = ChapterCheckpoints(
+            f"{Path(epub_name).parent}/.{Path(epub_name).stem}.chapters"
+        )
         if self.resume:
             self.load_state()
 
-    @staticmethod
-    def _is_special_text(text):
-        return (
-            text.isdigit()
-            or text.isspace()
-            or is_text_link(text)
-            or all(char in string.punctuation for char in text)
-        )
+    _is_special_text = staticmethod(is_special_text)
 
     def _make_new_book(self, book):
         new_book = epub.EpubBook()
+        # derive the identifier from the source instead of a random one, so
+        # translating the same book twice gives the same file
+        identifiers = book.get_metadata("DC", "identifier")
+        seed = identifiers[0][0] if identifiers else book.title
+        new_book.set_identifier(
+            str(uuid.uuid5(uuid.NAMESPACE_URL, f"bilingual_book_maker:{seed}"))
+        )
         allowed_ns = set(epub.NAMESPACES.keys()) | set(epub.NAMESPACES.values())
 
         for namespace, metas in book.metadata.items():
@@ -210,20 +267,11 @@ class EPUBBookLoader(BaseBookLoader):
         return fixed_toc
 
     def _extract_paragraph(self, p):
-        for p_exclude in self.exclude_translate_tags.split(","):
-            # for issue #280
-            if type(p) is NavigableString:
-                continue
-            for pt in p.find_all(p_exclude):
-                pt.extract()
-        return p
-
-    def _process_paragraph(self, p, new_p, index, p_to_save_len, thread_safe=False):
-        if self.resume and index < p_to_save_len:
-            p.string = self.p_to_save[index]
-            new_p.string = self.p_to_save[
-                index
-            ]  # Fix: also update new_p to cached translation
+        return extract_paragraph(p, self.exclude_translate_tags)
+
+    def _process_paragraph(self, p, new_p, index, key, thread_safe=False):
+        if key in self.p_to_save:
+            new_p.string = self.p_to_save[key]
         else:
             t_text = ""
             if self.batch_flag:
@@ -238,36 +286,28 @@ class EPUBBookLoader(BaseBookLoader):
                 )
             if type(p) is NavigableString:
                 new_p = t_text
-                self.p_to_save.append(new_p)
+                self._record_translation(key, new_p)
             else:
                 new_p.string = t_text
-                self.p_to_save.append(new_p.text)
+                self._record_translation(key, new_p.text)
 
         self.helper.insert_trans(
             p, new_p.string, self.translation_style, self.single_translate
         )
         index += 1
-
-        if thread_safe:
-            with self._progress_lock:
-                if index % 20 == 0:
-                    self._save_progress()
-        else:
-            if index % 20 == 0:
-                self._save_progress()
         return index
 
-    def _process_combined_paragraph(
-        self, p_block, index, p_to_save_len, thread_safe=False
-    ):
+    def _process_combined_paragraph(self, p_block, index, keys, thread_safe=False):
         text = []
+        pending = []
 
-        for p in p_block:
-            if self.resume and index < p_to_save_len:
-                p.string = self.p_to_save[index]
+        for p, key in zip(p_block, keys):
+            if key in self.p_to_save:
+                p.string = self.p_to_save[key]
             else:
                 p_text = p.text.rstrip()
                 text.append(p_text)
+                pending.append((p, key))
 
             if self.is_test and index >= self.test_num:
                 break
@@ -282,10 +322,11 @@ class EPUBBookLoader(BaseBookLoader):
             for i in range(text_len):
                 t = translated_text[i]
 
-                if i >= len(p_block):
-                    p = p_block[-1]
+                if i >= len(pending):
+                    p = pending[-1][0]
                 else:
-                    p = p_block[i]
+                    p, key = pending[i]
+                    self._record_translation(key, t)
 
                 if type(p) is NavigableString:
                     p = t
@@ -296,19 +337,29 @@ class EPUBBookLoader(BaseBookLoader):
                     p, p.string, self.translation_style, self.single_translate
                 )
 
-        if thread_safe:
-            with self._progress_lock:
-                self._save_progress()
-        else:
-            self._save_progress()
+        self._save_progress()
         return index
 
-    def translate_paragraphs_acc(self, p_list, send_num):
+    def translate_paragraphs_acc(self, p_list, send_num, keys):
         count = 0
         wait_p_list = []
+        p_keys = {id(p): key for p, key in zip(p_list, keys)}
+        self.helper.on_translated = lambda p, text: self._record_translation(
+            p_keys[id(p)], text
+        )
         for i in range(len(p_list)):
             p = p_list[i]
             print(f"translating {i}/{len(p_list)}")
+            if keys[i] in self.p_to_save:
+                self.helper.insert_trans(
+                    p,
+                    self.p_to_save[keys[i]],
+                    self.translation_style,
+                    self.single_translate,
+                )
+                if i == len(p_list) - 1:
+                    self.helper.deal_old(wait_p_list, self.single_translate)
+                continue
             temp_p = copy(p)
 
             for p_exclude in self.exclude_translate_tags.split(","):
@@ -353,18 +404,130 @@ class EPUBBookLoader(BaseBookLoader):
 
         for item in book.get_items_of_type(ITEM_DOCUMENT):
             content = item.get_content()
-            soup = bs(content, "html.parser")
+            soup = bs(content, self.parser)
             if search_string in soup.get_text():
                 matching_items.append(item)
 
         return matching_items
 
-    def retranslate_book(self, index, p_to_save_len, pbar, trans_taglist, retranslate):
+    def retranslate_book(self, index, pbar, trans_taglist, retranslate):
+        """Translate passages of a finished book again.
+
+        `retranslate` is the finished book followed by one ``file_name, start,
+        end`` triple per passage. With the paragraph index written next to the
+        book, the passages are found from it and only their chapters are read
+        and rewritten; the others take a pass over the whole book each.
+        """
         complete_book_name = retranslate[0]
-        fixname = retranslate[1]
-        fixstart = retranslate[2]
-        fixend = retranslate[3]
+        passages = [
+            tuple(retranslate[i : i + 3]) for i in range(1, len(retranslate), 3)
+        ]
+        paragraph_index = ParagraphIndex.load(index_path(complete_book_name))
+        if paragraph_index is not None:
+            passages = self._retranslate_indexed(
+                complete_book_name, paragraph_index, passages
+            )
+        for fixname, fixstart, fixend in passages:
+            fixname = self._retranslate_passage(
+                index,
+                pbar,
+                trans_taglist,
+                complete_book_name,
+                fixname,
+                fixstart,
+                fixend,
+            )
+            if paragraph_index is not None and fixname:
+                # the chapter was rewritten without the index
+                paragraph_index.chapters.pop(fixname, None)
+                paragraph_index.save(index_path(complete_book_name))
+
+    def _retranslate_indexed(self, book_name, paragraph_index, passages):
+        """Retranslate the passages found in the index, return the other ones."""
+        options = self._chapter_options()
+        found = {}
+        contents = {}
+        missing = []
+        with zipfile.ZipFile(book_name) as zf:
+            arcnames = {}
+            for arcname in zf.namelist():
+                arcnames.setdefault(arcname.split("/", 1)[-1], arcname)
+                arcnames.setdefault(arcname, arcname)
+            for fixname, fixstart, fixend in passages:
+                keys = []
+                for file_name in [fixname] if fixname else paragraph_index.chapters:
+                    if file_name not in paragraph_index or file_name not in arcnames:
+                        continue
+                    content = contents.get(file_name) or zf.read(arcnames[file_name])
+                    keys = self._find_passage(
+                        content,
+                        paragraph_index.spans(file_name),
+                        fixstart,
+                        fixend or fixstart,
+                    )
+                    if keys:
+                        contents[file_name] = content
+                        found.setdefault(file_name, set()).update(keys)
+                        break
+                if not keys:
+                    missing.append((fixname, fixstart, fixend))
+
+        replaced = {}
+        for file_name, keys in found.items():
+            item = self.get_item(self.origin_book, file_name)
+            p_list = find_paragraphs(bs(item.content, self.parser), options)
+            spans = {
+                key: (start, end)
+                for key, start, end in paragraph_index.spans(file_name)
+            }
+            content = contents[file_name]
+            pieces = []
+            position = 0
+            lengths = {}
+            for key in sorted(keys, key=lambda key: spans[key][0]):
+                ordinal = key_ordinal(key)
+                if ordinal >= len(p_list) or key != paragraph_key(
+                    file_name, ordinal, p_list[ordinal].text
+                ):
+                    raise Exception(
+                        f"{file_name} of {book_name} was not translated from {self.epub_name}"
+                    )
+                p = p_list[ordinal]
+                t_text = self.translate_model.translate(
+                    self._extract_paragraph(copy(p)).text
+                )
+                rendered = render_paragraph(p, t_text or "", options)
+                start, end = spans[key]
+                pieces += [content[position:start], rendered]
+                position = end
+                lengths[key] = len(rendered)
+            pieces.append(content[position:])
+            replaced[arcnames[file_name]] = b"".join(pieces)
+            paragraph_index.shift(file_name, lengths)
+            print(f"retranslated {len(keys)} paragraphs of {file_name}")
+
+        if replaced:
+            replace_entries(book_name, replaced)
+            paragraph_index.save(index_path(book_name))
+        return missing
+
+    @staticmethod
+    def _find_passage(content, spans, fixstart, fixend):
+        """Keys of the paragraphs from the one with `fixstart` to the one with `fixend`."""
+        keys = []
+        for key, start, end in spans:
+            text = span_text(content[start:end])
+            if not keys and fixstart not in text:
+                continue
+            keys.append(key)
+            if fixend in text:
+                break
+        return keys
 
+    def _retranslate_passage(
+        self, index, pbar, trans_taglist, complete_book_name, fixname, fixstart, fixend
+    ):
+        """Retranslate a passage by rewriting the whole book, return its chapter."""
         if fixend == "":
             fixend = fixstart
 
@@ -382,16 +545,16 @@ class EPUBBookLoader(BaseBookLoader):
 
         complete_item = self.get_item(complete_book, fixname)
         if complete_item is None:
-            return
+            return None
 
         ori_item = self.get_item(self.origin_book, fixname)
         if ori_item is None:
-            return
+            return None
 
         content_complete = complete_item.content
         content_ori = ori_item.content
-        soup_complete = bs(content_complete, "html.parser")
-        soup_ori = bs(content_ori, "html.parser")
+        soup_complete = bs(content_complete, self.parser)
+        soup_ori = bs(content_ori, self.parser)
 
         p_list_complete = soup_complete.findAll(trans_taglist)
         p_list_ori = soup_ori.findAll(trans_taglist)
@@ -439,12 +602,11 @@ class EPUBBookLoader(BaseBookLoader):
             if item.file_name != fixname:
                 new_book.add_item(item)
         if soup_complete:
-            complete_item.content = soup_complete.encode()
+            complete_item.content = encode_chapter(soup_complete)
 
         index = self.process_item(
             complete_item,
             index,
-            p_to_save_len,
             pbar,
             new_book,
             trans_taglist,
@@ -452,25 +614,18 @@ class EPUBBookLoader(BaseBookLoader):
             fixend,
         )
         epub.write_epub(f"{name_fix}", new_book, {})
+        return fixname
 
     def has_nest_child(self, element, trans_taglist):
-        if isinstance(element, Tag):
-            for child in element.children:
-                if child.name in trans_taglist:
-                    return True
-                if self.has_nest_child(child, trans_taglist):
-                    return True
-        return False
+        return has_nest_child(element, trans_taglist)
 
     def filter_nest_list(self, p_list, trans_taglist):
-        filtered_list = [p for p in p_list if not self.has_nest_child(p, trans_taglist)]
-        return filtered_list
+        return filter_nest_list(p_list, trans_taglist)
 
     def process_item(
         self,
         item,
         index,
-        p_to_save_len,
         pbar,
         new_book,
         trans_taglist,
@@ -491,7 +646,7 @@ class EPUBBookLoader(BaseBookLoader):
             os.makedirs("log")
 
         content = item.content
-        soup = bs(content, "html.parser")
+        soup = bs(content, self.parser)
         p_list = soup.findAll(trans_taglist)
 
         p_list = self.filter_nest_list(p_list, trans_taglist)
@@ -515,6 +670,13 @@ class EPUBBookLoader(BaseBookLoader):
         if self.allow_navigable_strings:
             p_list.extend(soup.findAll(text=True))
 
+        if not p_list:
+            # nothing to translate, keep the original bytes instead of re-serializing
+            self._finish_chapter(item.file_name, content, content)
+            new_book.add_item(item)
+            return index
+        keys = self._paragraph_keys(item, p_list)
+
         send_num = self.accumulated_num
         if send_num > 1:
             with open("log/buglog.txt", "a") as f:
@@ -522,12 +684,13 @@ class EPUBBookLoader(BaseBookLoader):
 
             print("------------------------------------------------------")
             print(f"dealing {item.file_name} ...")
-            self.translate_paragraphs_acc(p_list, send_num)
+            self.translate_paragraphs_acc(p_list, send_num, keys)
         else:
             is_test_done = self.is_test and index > self.test_num
             p_block = []
+            block_keys = []
             block_len = 0
-            for p in p_list:
+            for p, key in zip(p_list, keys):
                 if is_test_done:
                     break
                 if not p.text or self._is_special_text(p.text):
@@ -540,16 +703,18 @@ class EPUBBookLoader(BaseBookLoader):
                     block_len += p_len
                     if block_len > self.block_size:
                         index = self._process_combined_paragraph(
-                            p_block, index, p_to_save_len, thread_safe=False
+                            p_block, index, block_keys, thread_safe=False
                         )
                         p_block = [p]
+                        block_keys = [key]
                         block_len = p_len
                         print()
                     else:
                         p_block.append(p)
+                        block_keys.append(key)
                 else:
                     index = self._process_paragraph(
-                        p, new_p, index, p_to_save_len, thread_safe=False
+                        p, new_p, index, key, thread_safe=False
                     )
                     print()
 
@@ -560,11 +725,17 @@ class EPUBBookLoader(BaseBookLoader):
                     break
             if self.single_translate and self.block_size > 0 and len(p_block) > 0:
                 index = self._process_combined_paragraph(
-                    p_block, index, p_to_save_len, thread_safe=False
+                    p_block, index, block_keys, thread_safe=False
                 )
 
         if soup:
-            item.content = soup.encode(encoding="utf-8")
+            item.content = encode_chapter(soup)
+        self._finish_chapter(
+            item.file_name,
+            content,
+            item.content,
+            self._paragraph_spans(p_list, keys, item.content),
+        )
         new_book.add_item(item)
 
         return index
@@ -584,16 +755,38 @@ class EPUBBookLoader(BaseBookLoader):
                 f"⚠️  Warning: {workers} workers is quite high. Consider using 2-8 workers for optimal performance."
             )
 
-    def _get_next_translation_index(self):
-        """Thread-safe method to get next translation index."""
-        with self._progress_lock:
-            index = self._translation_index
-            self._translation_index += 1
-            return index
+    def set_process_workers(self, workers):
+        """Parse and serialize chapters in worker processes in parallel mode.
+
+        The threads of `set_parallel_workers` keep sending the translation
+        requests, `workers` processes do the BeautifulSoup work around them, so
+        it is no longer serialized by the GIL. Not used with accumulated_num > 1.
+
+        Args:
+            workers (int): Number of worker processes, 0 keeps everything in
+                the threads.
+        """
+        self.process_workers = max(0, workers)
+
+    def set_parser(self, parser):
+        """Set the BeautifulSoup tree builder used for document items.
+
+        Args:
+            parser (str): ``html.parser`` (default, pure Python), ``lxml`` for
+                fast lenient HTML parsing, or ``lxml-xml`` which keeps XHTML
+                self-closing tags, namespaces and the XML declaration intact.
+        """
+        try:
+            bs("", parser)
+        except FeatureNotFound as e:
+            raise Exception(
+                f"parser {parser!r} is not available, please `pip install lxml`"
+            ) from e
+        self.parser = parser
 
     def _process_chapter_parallel(self, chapter_data):
         """Process a single chapter in parallel mode with proper accumulated_num handling."""
-        item, trans_taglist, p_to_save_len = chapter_data
+        item, trans_taglist = chapter_data
         chapter_result = {
             "item": item,
             "processed_content": None,
@@ -607,13 +800,33 @@ class EPUBBookLoader(BaseBookLoader):
             thread_translator = self._create_chapter_translator()
 
             content = item.content
-            soup = bs(content, "html.parser")
+            checkpoint = self._load_checkpoint(item)
+            if checkpoint is not None:
+                chapter_result["processed_content"] = checkpoint
+                chapter_result["success"] = True
+                return chapter_result
+
+            if self._process_pool is not None:
+                chapter_result["processed_content"] = self._process_chapter_offloaded(
+                    item
+                )
+                chapter_result["success"] = True
+                return chapter_result
+
+            soup = bs(content, self.parser)
             p_list = soup.findAll(trans_taglist)
             p_list = self.filter_nest_list(p_list, trans_taglist)
 
             if self.allow_navigable_strings:
                 p_list.extend(soup.findAll(text=True))
 
+            if not p_list:
+                # Nothing to translate, the original bytes are kept as they are
+                self._finish_chapter(item.file_name, content, content)
+                chapter_result["success"] = True
+                return chapter_result
+            keys = self._paragraph_keys(item, p_list)
+
             # Initialize chapter-specific context lists
             chapter_context_list = []
             chapter_translated_list = []
@@ -624,6 +837,7 @@ class EPUBBookLoader(BaseBookLoader):
                 # Use accumulated translation logic for this chapter
                 self._translate_paragraphs_acc_parallel(
                     p_list,
+                    keys,
                     send_num,
                     thread_translator,
                     chapter_context_list,
@@ -631,15 +845,14 @@ class EPUBBookLoader(BaseBookLoader):
                 )
             else:
                 # Process paragraphs individually for this chapter
-                for p in p_list:
+                for p, key in zip(p_list, keys):
                     if not p.text or self._is_special_text(p.text):
                         continue
 
                     new_p = self._extract_paragraph(copy(p))
-                    index = self._get_next_translation_index()
 
-                    if self.resume and index < p_to_save_len:
-                        t_text = self.p_to_save[index]
+                    if key in self.p_to_save:
+                        t_text = self.p_to_save[key]
                     else:
                         # Use chapter-specific context for translation
                         t_text = self._translate_with_chapter_context(
@@ -649,8 +862,7 @@ class EPUBBookLoader(BaseBookLoader):
                             chapter_translated_list,
                         )
                         t_text = "" if t_text is None else t_text
-                        with self._progress_lock:
-                            self.p_to_save.append(t_text)
+                        self._record_translation(key, t_text)
 
                     if isinstance(p, NavigableString):
                         translated_node = NavigableString(t_text)
@@ -662,12 +874,15 @@ class EPUBBookLoader(BaseBookLoader):
                             p, t_text, self.translation_style, self.single_translate
                         )
 
-                    with self._progress_lock:
-                        if index % 20 == 0:
-                            self._save_progress()
-
             if soup:
-                chapter_result["processed_content"] = soup.encode(encoding="utf-8")
+                chapter_result["processed_content"] = encode_chapter(soup)
+                processed_content = chapter_result["processed_content"]
+                self._finish_chapter(
+                    item.file_name,
+                    content,
+                    processed_content,
+                    self._paragraph_spans(p_list, keys, processed_content),
+                )
             chapter_result["success"] = True
 
         except Exception as e:
@@ -676,10 +891,151 @@ class EPUBBookLoader(BaseBookLoader):
 
         return chapter_result
 
+    def _process_chapter_offloaded(self, item):
+        """Translate a chapter whose parsing runs in the process pool.
+
+        Only the chapter bytes, the options and the ``{key: text}`` maps cross
+        the process boundary, the requests are sent from this thread.
+        """
+        content = item.content
+        segments = self._run_chapter_stage(
+            extract_segments, item.file_name, content, self._chapter_options()
+        )
+        if segments is None:
+            # Nothing to translate, the original bytes are kept as they are
+            self._finish_chapter(item.file_name, content, content)
+            return None
+        return self._apply_segment_translations(
+            item, self._translate_segments(segments)
+        )
+
+    def _translate_segments(self, segments):
+        """Translate ``(key, text)`` segments of a chapter, in order, with context."""
+        translator = self._create_chapter_translator()
+        chapter_context_list = []
+        chapter_translated_list = []
+        translations = {}
+        for key, text in segments:
+            if key in self.p_to_save:
+                t_text = self.p_to_save[key]
+            else:
+                t_text = self._translate_with_chapter_context(
+                    translator, text, chapter_context_list, chapter_translated_list
+                )
+                t_text = "" if t_text is None else t_text
+                self._record_translation(key, t_text)
+            translations[key] = t_text
+        return translations
+
+    def _apply_segment_translations(self, item, translations):
+        content = item.content
+        processed_content, spans = self._run_chapter_stage(
+            apply_translations,
+            item.file_name,
+            content,
+            self._chapter_options(),
+            translations,
+        )
+        self._finish_chapter(item.file_name, content, processed_content, spans)
+        return processed_content
+
+    def _run_chapter_stage(self, fn, *args):
+        # the CPU heavy chapter work goes to the process pool when there is one
+        if self._process_pool is None:
+            return fn(*args)
+        return self._process_pool.submit(fn, *args).result()
+
+    def _source_mtime(self):
+        """Newest entry date of the source zip, used as the modification date.
+
+        It depends only on the source file, not on the time of the run.
+        """
+        with zipfile.ZipFile(self.epub_name) as zf:
+            date_time = max(info.date_time for info in zf.infolist())
+        try:
+            return datetime(*date_time, tzinfo=timezone.utc)
+        except ValueError:
+            # zero DOS dates, e.g. (1980, 0, 0, ...), are not valid dates
+            return datetime(*ZIP_DATE_TIME, tzinfo=timezone.utc)
+
+    def _document_items(self, book=None):
+        """Document items in reading order, the ones missing from the spine last."""
+        book = book or self.origin_book
+        spine = {idref: i for i, (idref, _) in enumerate(book.spine)}
+        items = list(book.get_items_of_type(ITEM_DOCUMENT))
+        return sorted(items, key=lambda item: spine.get(item.id, len(spine)))
+
+    def _plan_chapter_tasks(self, document_items):
+        """Cut the parallel work into ``(item, segments, cost)`` tasks.
+
+        `segments` is None for a whole chapter, or the part of an oversized
+        chapter the task translates. The cost is an estimate in tokens.
+        """
+        tasks = []
+        split = {}
+        for item in document_items:
+            if self.resume and self.checkpoints.has(item.file_name, item.content):
+                tasks.append((item, None, 0))
+                continue
+            cost = chapter_cost(item.content)
+            if (
+                self.split_chapter_tokens > 0
+                and self.accumulated_num == 1
+                and cost > self.split_chapter_tokens
+            ):
+                segments = self._run_chapter_stage(
+                    extract_segments,
+                    item.file_name,
+                    item.content,
+                    self._chapter_options(),
+                )
+                parts = split_segments(segments or [], self.split_chapter_tokens)
+                if len(parts) > 1:
+                    split[item.file_name] = {"parts": len(parts), "translations": {}}
+                    tasks.extend((item, part, part_cost) for part, part_cost in parts)
+                    continue
+            tasks.append((item, None, cost))
+        return tasks, split
+
+    @staticmethod
+    def _timed(fn, *args):
+        start = time.monotonic()
+        result = fn(*args)
+        return result, time.monotonic() - start
+
+    @staticmethod
+    def _report_makespan(costs, order, durations, elapsed, workers):
+        seconds = sum(durations)
+        if not seconds or not sum(costs):
+            return
+        seconds_per_token = seconds / sum(costs)
+        predicted = makespan(costs, workers, order) * seconds_per_token
+        spine = makespan(costs, workers) * seconds_per_token
+        print(
+            f"⏱️  Makespan: predicted {predicted:.1f}s in LPT order "
+            f"({spine:.1f}s in spine order), actual {elapsed:.1f}s"
+        )
+
+    def _chapter_options(self):
+        # what the chapter_worker functions need to find and insert paragraphs
+        return {
+            "translate_tags": self.translate_tags,
+            "exclude_translate_tags": self.exclude_translate_tags,
+            "allow_navigable_strings": self.allow_navigable_strings,
+            "translation_style": self.translation_style,
+            "single_translate": self.single_translate,
+            "parser": self.parser,
+        }
+
     def _create_chapter_translator(self):
-        """Create a translator instance for a specific chapter with independent context."""
-        # Return the main translator - we'll handle context at the chapter level
-        return self.translate_model
+        """Return the translator of the calling worker.
+
+        Each worker thread gets its own copy of `translate_model`, so no state
+        of a translator is shared between chapters translated at the same time.
+        """
+        if self._translator_pool is None:
+            return self.translate_model
+        return self._translator_pool.get()
 
     def _translate_with_chapter_context(
         self, translator, text, chapter_context_list, chapter_translated_list
@@ -714,6 +1070,7 @@ class EPUBBookLoader(BaseBookLoader):
     def _translate_paragraphs_acc_parallel(
         self,
         p_list,
+        keys,
         send_num,
         translator,
         chapter_context_list,
@@ -725,6 +1082,7 @@ class EPUBBookLoader(BaseBookLoader):
 
         count = 0
         wait_p_list = []
+        p_keys = {id(p): key for p, key in zip(p_list, keys)}
 
         # Create chapter-specific helper instance with context-aware translation
         class ChapterHelper:
@@ -772,9 +1130,11 @@ class EPUBBookLoader(BaseBookLoader):
                             p = wait_p_list[i]
                             from .helper import shorter_result_link
 
+                            text = shorter_result_link(result_txt_list[i])
+                            self.parent_loader._record_translation(p_keys[id(p)], text)
                             self.parent_loader.helper.insert_trans(
                                 p,
-                                shorter_result_link(result_txt_list[i]),
+                                text,
                                 self.parent_loader.translation_style,
                                 single_translate,
                             )
@@ -789,6 +1149,7 @@ class EPUBBookLoader(BaseBookLoader):
             def deal_new(self, p, wait_p_list, single_translate):
                 self.deal_old(wait_p_list, single_translate)
                 translation = self.translate_with_context(p.text)
+                self.parent_loader._record_translation(p_keys[id(p)], translation)
                 self.parent_loader.helper.insert_trans(
                     p,
                     translation,
@@ -802,6 +1163,16 @@ class EPUBBookLoader(BaseBookLoader):
 
         for i in range(len(p_list)):
             p = p_list[i]
+            if keys[i] in self.p_to_save:
+                self.helper.insert_trans(
+                    p,
+                    self.p_to_save[keys[i]],
+                    self.translation_style,
+                    self.single_translate,
+                )
+                if i == len(p_list) - 1:
+                    chapter_helper.deal_old(wait_p_list, self.single_translate)
+                continue
             temp_p = copy(p)
 
             for p_exclude in self.exclude_translate_tags.split(","):
@@ -858,6 +1229,11 @@ class EPUBBookLoader(BaseBookLoader):
             self.context_flag,
         )
         self.batch_init_then_wait()
+        self._resolve_positional_state()
+        self.checkpoints.salt = self._checkpoint_salt()
+        self._last_snapshot = time.monotonic()
+        if not self.resume and not self.rendering:
+            self.checkpoints.clear()
         new_book = self._make_new_book(self.origin_book)
         all_items = list(self.origin_book.get_items())
         trans_taglist = self.translate_tags.split(",")
@@ -871,8 +1247,11 @@ class EPUBBookLoader(BaseBookLoader):
                         self.only_filelist
                         and i.file_name not in self.only_filelist.split(",")
                     )
+                    or (self.resume and self.checkpoints.has(i.file_name, i.content))
+                    # the passages to retranslate are counted as they are found
+                    or self.retranslate
                 )
-                else len(bs(i.content, "html.parser").findAll(trans_taglist))
+                else len(bs(i.content, self.parser).findAll(trans_taglist))
             )
             for i in all_items
         )
@@ -886,27 +1265,39 @@ class EPUBBookLoader(BaseBookLoader):
                         self.only_filelist
                         and i.file_name not in self.only_filelist.split(",")
                     )
+                    or (self.resume and self.checkpoints.has(i.file_name, i.content))
+                    or self.retranslate
                 )
-                else len(bs(i.content, "html.parser").findAll(text=True))
+                else len(bs(i.content, self.parser).findAll(text=True))
             )
             for i in all_items
         )
         pbar = tqdm(total=self.test_num) if self.is_test else tqdm(total=all_p_length)
         print()
         index = 0
-        p_to_save_len = len(self.p_to_save)
+        name, _ = os.path.splitext(self.epub_name)
+        out_book = None
         try:
             if self.retranslate:
-                self.retranslate_book(
-                    index, p_to_save_len, pbar, trans_taglist, self.retranslate
-                )
+                self.retranslate_book(index, pbar, trans_taglist, self.retranslate)
                 exit(0)
+            if self.batch_flag:
+                # batch mode only queues the requests, the book is written by --batch-use
+                out_book = new_book
+            else:
+                # chapters are streamed into the output as soon as they are done
+                out_book = StreamingEpubWriter(
+                    f"{name}_bilingual{self.output_suffix}.epub",
+                    new_book,
+                    {"mtime": self._source_mtime()},
+                    source=self.origin_reader,
+                ).open()
             # Add the things that don't need to be translated first, so that you can see the img after the interruption
             for item in self.origin_book.get_items():
                 if item.get_type() != ITEM_DOCUMENT:
-                    new_book.add_item(item)
+                    out_book.add_item(item)
 
-            document_items = list(self.origin_book.get_items_of_type(ITEM_DOCUMENT))
+            document_items = self._document_items()
 
             if self.enable_parallel and len(document_items) > 1:
                 # Optimize worker count: no point having more workers than chapters
@@ -939,35 +1330,103 @@ class EPUBBookLoader(BaseBookLoader):
                     total=len(document_items), desc="Chapters", unit="ch"
                 )
 
-                chapter_data_list = [
-                    (item, trans_taglist, p_to_save_len) for item in document_items
-                ]
+                chapter_data_list = [(item, trans_taglist) for item in document_items]
+
+                if self.process_workers > 0 and self.accumulated_num == 1:
+                    print(f"🧮 Parsing chapters in {self.process_workers} processes")
+                    self._process_pool = ProcessPoolExecutor(
+                        max_workers=self.process_workers
+                    )
+                elif self.process_workers > 0:
+                    print("⚠️  Process workers are not used with accumulated_num > 1")
 
-                with ThreadPoolExecutor(max_workers=effective_workers) as executor:
-                    future_to_item = {
-                        executor.submit(
-                            self._process_chapter_parallel, chapter_data
-                        ): chapter_data[0]
-                        for chapter_data in chapter_data_list
+                self._translator_pool = TranslatorPool(
+                    self.translate_model,
+                    RateLimiter.per_minute(self.requests_per_minute),
+                )
+                with (
+                    self._process_pool or nullcontext(),
+                    ThreadPoolExecutor(max_workers=effective_workers) as executor,
+                ):
+                    tasks, split = self._plan_chapter_tasks(document_items)
+                    costs = [cost for _, _, cost in tasks]
+                    # the most expensive tasks first, so no big chapter runs alone at the end
+                    order = lpt_order(costs)
+                    if split:
+                        print(
+                            f"✂️  Split {len(split)} chapters over {self.split_chapter_tokens} tokens into parts"
+                        )
+                    started = time.monotonic()
+                    future_to_task = {}
+                    for i in order:
+                        item, segments, _ = tasks[i]
+                        if segments is None:
+                            future = executor.submit(
+                                self._timed,
+                                self._process_chapter_parallel,
+                                (item, trans_taglist),
+                            )
+                        else:
+                            future = executor.submit(
+                                self._timed, self._translate_segments, segments
+                            )
+                        future_to_task[future] = i
+                    durations = [0.0] * len(tasks)
+                    position = {
+                        item.file_name: i for i, item in enumerate(document_items)
                     }
 
-                    for future in as_completed(future_to_item):
-                        item = future_to_item[future]
+                    def release(item):
+                        out_book.add_item(item)
+                        chapter_pbar.update(1)
+                        chapter_pbar.set_postfix_str(
+                            f"Latest: {item.file_name[:20]}..."
+                        )
+                        self._snapshot_if_due(out_book)
+
+                    # chapters finish in any order, they go into the book in
+                    # reading order so the output is the same as a sequential run
+                    reorder = ReorderBuffer(release)
+
+                    for future in as_completed(future_to_task):
+                        i = future_to_task[future]
+                        item, segments, _ = tasks[i]
                         try:
-                            result = future.result()
-                            if result["success"] and result["processed_content"]:
+                            result, durations[i] = future.result()
+                            if segments is not None:
+                                chapter = split[item.file_name]
+                                chapter["translations"].update(result)
+                                chapter["parts"] -= 1
+                                if chapter["parts"]:
+                                    continue
+                                item.content = self._apply_segment_translations(
+                                    item, chapter["translations"]
+                                )
+                            elif result["success"] and result["processed_content"]:
                                 item.content = result["processed_content"]
-                            new_book.add_item(item)
-                            chapter_pbar.update(1)
-                            chapter_pbar.set_postfix_str(
-                                f"Latest: {item.file_name[:20]}..."
-                            )
+                            reorder.put(position[item.file_name], item)
 
                         except Exception as e:
                             print(f"❌ Error processing {item.file_name}: {e}")
-                            new_book.add_item(item)
-                            chapter_pbar.update(1)
+                            chapter = split.get(item.file_name)
+                            if chapter is not None:
+                                if chapter["parts"] < 0:
+                                    # already written untranslated
+                                    continue
+                                # the other parts of the chapter are not waited for
+                                chapter["parts"] = -1
+                            reorder.put(position[item.file_name], item)
+
+                    self._report_makespan(
+                        costs,
+                        order,
+                        durations,
+                        time.monotonic() - started,
+                        effective_workers,
+                    )
 
+                self._process_pool = None
+                self._translator_pool = None
                 chapter_pbar.close()
                 print(f"✅ Completed all {len(document_items)} chapters")
             else:
@@ -976,86 +1435,230 @@ class EPUBBookLoader(BaseBookLoader):
                     print(f"📄 Single chapter detected - using sequential processing")
 
                 for item in document_items:
+                    checkpoint = self._load_checkpoint(item)
+                    if checkpoint is not None:
+                        item.content = checkpoint
+                        out_book.add_item(item)
+                        continue
                     index = self.process_item(
-                        item, index, p_to_save_len, pbar, new_book, trans_taglist
+                        item, index, pbar, out_book, trans_taglist
                     )
+                    self._snapshot_if_due(out_book)
 
-                if self.accumulated_num > 1:
-                    name, _ = os.path.splitext(self.epub_name)
-                    epub.write_epub(f"{name}_bilingual.epub", new_book, {})
-            name, _ = os.path.splitext(self.epub_name)
             if self.batch_flag:
                 self.translate_model.batch()
             else:
-                epub.write_epub(f"{name}_bilingual.epub", new_book, {})
+                out_book.close()
+                self.paragraph_index.save(
+                    index_path(f"{name}_bilingual{self.output_suffix}.epub")
+                )
+                save_alignment(
+                    f"{name}_bilingual{self.output_suffix}.epub", self.p_to_save
+                )
+            self.journal.close()
             if self.accumulated_num == 1:
                 pbar.close()
         except KeyboardInterrupt as e:
             print(e)
-            if self.accumulated_num == 1:
-                print("you can resume it next time")
-                self._save_progress()
-                self._save_temp_book()
+            print("you can resume it next time")
+            self._save_progress()
+            self._save_temp_book(out_book)
+            self._close_output(out_book)
             sys.exit(0)
         except Exception:
             traceback.print_exc()
+            self._close_output(out_book)
             sys.exit(0)
 
+    def _close_output(self, out_book):
+        """Finish a streamed output after an interruption so it stays a readable book."""
+        if isinstance(out_book, StreamingEpubWriter):
+            out_book.close(remaining=self.origin_book.get_items())
+        self.journal.close()
+
     def load_state(self):
         try:
-            with open(self.bin_path, "rb") as f:
-                self.p_to_save = pickle.load(f)
-        except Exception:
-            raise Exception("can not load resume file")
+            try:
+                entries = self.journal.load()
+            except ValueError:
+                # resume file of an older version, a pickled list of translations
+                with open(self.bin_path, "rb") as f:
+                    entries = {str(i): t for i, t in enumerate(pickle.load(f))}
+                self.journal.compact(entries)
+        except Exception as e:
+            raise Exception("can not load resume file") from e
+        if entries and all(key.isdigit() for key in entries):
+            # saved by position, the keys are resolved once the book options are set
+            self._positional_state = [
+                entries[str(i)] for i in range(len(entries)) if str(i) in entries
+            ]
+        else:
+            self.p_to_save = entries
 
-    def _save_temp_book(self):
-        # TODO refactor this logic
-        origin_book_temp = epub.read_epub(self.epub_name)
-        new_temp_book = self._make_new_book(origin_book_temp)
-        p_to_save_len = len(self.p_to_save)
+    def _resolve_positional_state(self):
+        """Key a resume file that was saved by position, like older versions did."""
+        translations = self._positional_state
+        if not translations:
+            return
         trans_taglist = self.translate_tags.split(",")
         index = 0
+        for item in self.origin_book.get_items_of_type(ITEM_DOCUMENT):
+            if self.only_filelist != "":
+                if item.file_name not in self.only_filelist.split(","):
+                    continue
+            elif item.file_name in self.exclude_filelist.split(","):
+                continue
+            soup = bs(item.content, self.parser)
+            p_list = self.filter_nest_list(soup.findAll(trans_taglist), trans_taglist)
+            if self.allow_navigable_strings:
+                p_list.extend(soup.findAll(text=True))
+            for p, key in zip(p_list, self._paragraph_keys(item, p_list)):
+                if index >= len(translations):
+                    break
+                if not p.text or self._is_special_text(p.text):
+                    continue
+                self.p_to_save[key] = translations[index]
+                index += 1
+        self._positional_state = None
+        self.journal.compact(self.p_to_save)
+
+    def _checkpoint_salt(self):
+        # options that change the output of a chapter
+        return repr(sorted(self._chapter_options().items()))
+
+    def _load_checkpoint(self, item):
+        """Return the output of `item` saved by an earlier run, or None.
+
+        The paragraph spans saved with it go back into the paragraph index.
+        """
+        if not self.resume:
+            return None
+        content = self.checkpoints.get(item.file_name, item.content)
+        if content is not None:
+            spans = self.checkpoints.get_spans(item.file_name, item.content)
+            if spans is not None:
+                self.paragraph_index.add(item.file_name, spans)
+        return content
+
+    def _finish_chapter(self, file_name, source, content, spans=()):
+        """Index a written chapter and checkpoint it with its spans."""
+        self.paragraph_index.add(file_name, spans)
+        # test and batch runs do not produce a finished chapter
+        if self.is_test or self.batch_flag or self.retranslate or self.rendering:
+            return
+        self.checkpoints.put(file_name, source, content, spans)
+
+    def _paragraph_spans(self, p_list, keys, content):
+        return paragraph_spans(
+            content, p_list, keys, self.p_to_save, self._chapter_options()
+        )
+
+    def _paragraph_keys(self, item, p_list):
+        return [paragraph_key(item.file_name, i, p.text) for i, p in enumerate(p_list)]
+
+    def use_alignment(self, translations):
+        super().use_alignment(translations)
+        self.p_to_save = dict(translations)
+        # the resume journal and the checkpoints of the book are left alone
+        self.rendering = True
+
+    def update_from(self, old_source, old_translations):
+        """Reuse the translations of a previous edition of the book.
+
+        Args:
+            old_source: the epub the previous translation was made from.
+            old_translations: the ``{key: translation}`` pairs of the alignment
+                sidecar of that translation.
+
+        The paragraphs of both editions are paired with `match_segments`, the
+        reused translations are recorded like translations of this run, so only
+        inserted and edited paragraphs are sent to the model.
+        """
+        old_book = read_epub_lazily(old_source).book
+        reused = match_segments(
+            self._book_segments(old_book),
+            self._book_segments(self.origin_book),
+            old_translations,
+        )
+        for key, text in reused.items():
+            if key not in self.p_to_save:
+                self._record_translation(key, text)
+        print(f"♻️  Reusing {len(reused)} translations of {old_source}")
+
+    def _book_segments(self, book):
+        """``(key, source hash)`` of the paragraphs of `book`, in reading order."""
+        return [(key, key.rsplit(":", 1)[-1]) for key, _ in self._book_paragraphs(book)]
+
+    def _book_paragraphs(self, book):
+        options = self._chapter_options()
+        paragraphs = []
+        for item in self._document_items(book):
+            if self.only_filelist != "":
+                if item.file_name not in self.only_filelist.split(","):
+                    continue
+            elif item.file_name in self.exclude_filelist.split(","):
+                continue
+            paragraphs.extend(
+                extract_segments(item.file_name, item.content, options) or []
+            )
+        return paragraphs
+
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        return [
+            (key, text)
+            for key, text in self._book_paragraphs(self.origin_book)
+            if key not in self.p_to_save
+        ]
+
+    def plan_requests(self):
+        segments = self.plan_segments()
+        if self.accumulated_num > 1:
+            budget = self.accumulated_num
+            segments = [(key, text) for key, text in segments if not not_trans(text)]
+        elif self.single_translate and self.block_size > 0:
+            budget = self.block_size
+        else:
+            return [text for _, text in segments]
+        # paragraphs are sent together up to the budget, chapter by chapter
+        requests = []
+        for _, chapter in groupby(segments, key=lambda s: s[0].rsplit(":", 2)[0]):
+            for part, _ in split_segments(list(chapter), budget):
+                requests.append("\n".join(text for _, text in part))
+        return requests
+
+    def _record_translation(self, key, text):
+        if self.rendering:
+            return
+        self.p_to_save[key] = text
+        self.journal.append(key, text)
+
+    def _save_temp_book(self, out_book):
+        """Write `*_bilingual_temp.epub` from the chapters finished so far."""
+        if not isinstance(out_book, StreamingEpubWriter) or out_book.out is None:
+            return
+        name, _ = os.path.splitext(self.epub_name)
+        remaining = [
+            item for item in self.origin_book.get_items() if not out_book.is_added(item)
+        ]
         try:
-            for item in origin_book_temp.get_items():
-                if item.get_type() == ITEM_DOCUMENT:
-                    content = item.content
-                    soup = bs(content, "html.parser")
-                    p_list = soup.findAll(trans_taglist)
-                    if self.allow_navigable_strings:
-                        p_list.extend(soup.findAll(text=True))
-                    for p in p_list:
-                        if not p.text or self._is_special_text(p.text):
-                            continue
-                        # TODO banch of p to translate then combine
-                        # PR welcome here
-                        if index < p_to_save_len:
-                            new_p = copy(p)
-                            if type(p) is NavigableString:
-                                new_p = self.p_to_save[index]
-                            else:
-                                new_p.string = self.p_to_save[index]
-                            self.helper.insert_trans(
-                                p,
-                                new_p.string,
-                                self.translation_style,
-                                self.single_translate,
-                            )
-                            index += 1
-                        else:
-                            break
-                    # for save temp book
-                    if soup:
-                        item.content = soup.encode()
-                new_temp_book.add_item(item)
-            name, _ = os.path.splitext(self.epub_name)
-            epub.write_epub(f"{name}_bilingual_temp.epub", new_temp_book, {})
+            out_book.snapshot(
+                f"{name}_bilingual{self.output_suffix}_temp.epub", remaining
+            )
         except Exception as e:
             # TODO handle it
             print(e)
+        self._last_snapshot = time.monotonic()
+
+    def _snapshot_if_due(self, out_book):
+        if (
+            self.snapshot_interval > 0
+            and time.monotonic() - self._last_snapshot >= self.snapshot_interval * 60
+        ):
+            self._save_temp_book(out_book)
 
     def _save_progress(self):
         try:
-            with open(self.bin_path, "wb") as f:
-                pickle.dump(self.p_to_save, f)
-        except Exception:
-            raise Exception("can not save resume file")
+            self.journal.sync()
+        except Exception as e:
+            raise Exception("can not save resume file") from e
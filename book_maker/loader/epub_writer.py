@@ -0,0 +1,313 @@
+import os
+import posixpath
+import struct
+import zipfile
+from copy import copy
+from threading import Lock
+
+from ebooklib import epub
+from ebooklib.utils import get_pages
+from lxml import etree
+
+# items that are never translated, they are copied from the source zip as they are
+PASSTHROUGH_EXTENSIONS = {
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".webp",
+    ".tif",
+    ".tiff",
+    ".svg",
+    ".css",
+    ".js",
+    ".otf",
+    ".ttf",
+    ".woff",
+    ".woff2",
+    ".mp3",
+    ".m4a",
+    ".ogg",
+    ".mp4",
+    ".mov",
+    ".avi",
+    ".webm",
+}
+# already compressed formats, deflating them again only costs time
+STORED_EXTENSIONS = PASSTHROUGH_EXTENSIONS - {".svg", ".css", ".js", ".otf", ".ttf"}
+# timestamp of the entries written by the writer, so the same input gives the same bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class _ReproducibleZipFile(zipfile.ZipFile):
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if isinstance(zinfo_or_arcname, str):
+            zinfo_or_arcname = zipfile.ZipInfo(zinfo_or_arcname, ZIP_DATE_TIME)
+            zinfo_or_arcname.compress_type = self.compression
+            zinfo_or_arcname.external_attr = 0o600 << 16
+            if compresslevel is None:
+                compresslevel = self.compresslevel
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+
+def copy_raw_entry(out, src_fp, src_info, arcname):
+    """Copy the zip entry `src_info` read from `src_fp` to `arcname` of `out` as it is."""
+    # the data starts after the local header, whose extra field may differ
+    # from the one in the central directory
+    src_fp.seek(src_info.header_offset)
+    header = struct.unpack(
+        zipfile.structFileHeader, src_fp.read(zipfile.sizeFileHeader)
+    )
+    src_fp.seek(
+        header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH],
+        1,
+    )
+
+    info = zipfile.ZipInfo(arcname, src_info.date_time)
+    info.compress_type = src_info.compress_type
+    info.CRC = src_info.CRC
+    info.compress_size = src_info.compress_size
+    info.file_size = src_info.file_size
+    info.external_attr = src_info.external_attr
+    # sizes go into the local header, no data descriptor follows the data
+    info.flag_bits = src_info.flag_bits & ~zipfile._MASK_USE_DATA_DESCRIPTOR
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+
+    with out._lock:
+        out._writecheck(info)
+        out._didModify = True
+        info.header_offset = out.fp.tell()
+        out.fp.write(info.FileHeader(zip64))
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = src_fp.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise EOFError(f"unexpected end of {src_info.filename}")
+            out.fp.write(chunk)
+            remaining -= len(chunk)
+        out.filelist.append(info)
+        out.NameToInfo[info.filename] = info
+        out.start_dir = out.fp.tell()
+
+
+def replace_entries(name, contents):
+    """Rewrite the zip `name` with new bytes for the entries in `contents`.
+
+    `contents` maps entry names to their new bytes; every other entry is copied
+    as it is, without being decompressed.
+    """
+    tmp_name = f"{name}.tmp"
+    with (
+        zipfile.ZipFile(name) as source,
+        open(name, "rb") as src_fp,
+        _ReproducibleZipFile(tmp_name, "w", zipfile.ZIP_DEFLATED) as out,
+    ):
+        for info in source.infolist():
+            if info.filename not in contents:
+                copy_raw_entry(out, src_fp, info, info.filename)
+                continue
+            new_info = zipfile.ZipInfo(info.filename, info.date_time)
+            new_info.compress_type = info.compress_type
+            new_info.external_attr = info.external_attr
+            out.writestr(new_info, contents[info.filename])
+    os.replace(tmp_name, name)
+
+
+class LazyEpubReader(epub.EpubReader):
+    """EpubReader that leaves the payload of non-document items in the zip.
+
+    Images, fonts, stylesheets and media are registered in the book with empty
+    content. `StreamingEpubWriter` copies them into the output straight from the
+    source zip, so only the documents that get translated are held in memory.
+    """
+
+    def __init__(self, epub_file_name, options=None):
+        super().__init__(epub_file_name, options)
+        self.deferred = set()
+
+    def read_file(self, name):
+        name = posixpath.normpath(name)
+        if posixpath.splitext(name)[1].lower() in PASSTHROUGH_EXTENSIONS:
+            self.deferred.add(name)
+            return b""
+        return super().read_file(name)
+
+    def deferred_name(self, item):
+        """Return the zip entry of `item` if its bytes were left in the source."""
+        name = posixpath.normpath(posixpath.join(self.opf_dir, item.file_name))
+        return name if name in self.deferred else None
+
+
+def read_epub_lazily(name, options=None):
+    reader = LazyEpubReader(name, options)
+    reader.load()
+    reader.process()
+    return reader
+
+
+class StreamingEpubWriter(epub.EpubWriter):
+    """Write the bilingual epub while the translation is still running.
+
+    The output zip is opened up front and every item is written the moment it
+    is added, so translated chapters go to disk as soon as they are done instead
+    of piling up in memory until the end of the run. The OPF, NCX and nav
+    documents describe the whole book, they are written by `close()`.
+
+    `add_item` has the same signature as `epub.EpubBook.add_item`, so the writer
+    can be passed wherever the loader expects the new book.
+
+    When `source` is the `LazyEpubReader` the items come from, items it did not
+    load are copied as raw compressed streams, without inflating them.
+    """
+
+    def __init__(self, name, book, options=None, source=None):
+        super().__init__(name, book, options)
+        self.source = source
+        self._source_zip = None
+        self.out = None
+        self._added = set()
+        self._pages = []
+        self._lock = Lock()
+        # drop the bytes of written items, a snapshot must leave them alone
+        self.release_content = True
+
+    def open(self):
+        self.out = _ReproducibleZipFile(
+            self.file_name,
+            "w",
+            zipfile.ZIP_DEFLATED,
+            compresslevel=self.options["compresslevel"],
+        )
+        self.out.writestr(
+            "mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED
+        )
+        self._write_container()
+        return self
+
+    def _arcname(self, item):
+        if item.manifest:
+            return f"{self.book.FOLDER_NAME}/{item.file_name}"
+        return item.file_name
+
+    def is_added(self, item):
+        return self._arcname(item) in self._added
+
+    def add_item(self, item):
+        arcname = self._arcname(item)
+        with self._lock:
+            if arcname in self._added:
+                return item
+            self.book.add_item(item)
+            self._added.add(arcname)
+            if isinstance(item, (epub.EpubNcx, epub.EpubNav)):
+                # generated from the toc when the book is closed
+                return item
+            deferred_name = self.source and self.source.deferred_name(item)
+            if deferred_name and not item.content:
+                if self._source_zip is None:
+                    self._source_zip = zipfile.ZipFile(self.source.file_name)
+                src_info = self._source_zip.getinfo(deferred_name)
+                self._copy_raw(self._source_zip.fp, src_info, arcname)
+                return item
+            if isinstance(item, epub.EpubHtml) and b"epub:type" in item.content:
+                self._pages.extend(get_pages(item))
+            if posixpath.splitext(item.file_name)[1].lower() in STORED_EXTENSIONS:
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+            self.out.writestr(arcname, item.content, compress_type=compress_type)
+            if self.release_content:
+                # the bytes are in the zip now, no need to keep them in memory
+                item.content = b""
+        return item
+
+    def _copy_raw(self, src_fp, src_info, arcname):
+        copy_raw_entry(self.out, src_fp, src_info, arcname)
+
+    def _get_nav(self, item):
+        # ebooklib builds the page list by parsing every document again, but their
+        # bytes are gone by now, so use the pages recorded in add_item instead
+        options = self.options
+        self.options = dict(options, epub3_pages=False)
+        try:
+            nav = super()._get_nav(item)
+        finally:
+            self.options = options
+        if not (options.get("epub3_pages") and self._pages):
+            return nav
+
+        nav_xml = etree.fromstring(
+            nav, etree.XMLParser(remove_blank_text=True)
+        ).getroottree()
+        root = nav_xml.getroot()
+        body = root.find("{%s}body" % epub.NAMESPACES["XHTML"])
+        pagelist_nav = etree.SubElement(
+            body,
+            "nav",
+            {
+                "{%s}type" % epub.NAMESPACES["EPUB"]: "page-list",
+                "id": "pages",
+                "hidden": "hidden",
+            },
+        )
+        etree.SubElement(pagelist_nav, "h2").text = options.get("pages_title", "Pages")
+        pages_ol = etree.SubElement(pagelist_nav, "ol")
+        nav_dir_name = posixpath.dirname(item.file_name)
+        for filename, pageref, label in self._pages:
+            li_item = etree.SubElement(pages_ol, "li")
+            href = posixpath.relpath(f"{filename}#{pageref}", nav_dir_name)
+            etree.SubElement(li_item, "a", {"href": href}).text = label
+        return etree.tostring(
+            nav_xml, pretty_print=True, encoding="utf-8", xml_declaration=True
+        )
+
+    def snapshot(self, name, remaining=()):
+        """Write the book as it is now to `name`, e.g. a temp book on interrupt.
+
+        Items already in the output are copied from it as raw compressed
+        streams and `remaining` items are added as they are, so nothing is
+        parsed or compressed again. The snapshot replaces `name` only once it is
+        complete, the previous one stays readable until then.
+        """
+        tmp_name = f"{name}.tmp"
+        with self._lock:
+            self.out.fp.flush()
+            book = copy(self.book)
+            book.items = list(self.book.items)
+            snapshot = StreamingEpubWriter(tmp_name, book, self.options, self.source)
+            snapshot.release_content = False
+            snapshot._pages = list(self._pages)
+            snapshot.open()
+            with open(self.file_name, "rb") as fp:
+                for info in self.out.infolist():
+                    if info.filename not in snapshot.out.NameToInfo:
+                        snapshot._copy_raw(fp, info, info.filename)
+            snapshot._added = set(self._added)
+        snapshot.close(remaining)
+        os.replace(tmp_name, name)
+
+    def close(self, remaining=()):
+        """Finish the book.
+
+        Args:
+            remaining: items of the source book that should be in the output
+                but have not been added yet, e.g. untranslated chapters when the
+                run is interrupted. They are written as they are so the result
+                is always a complete, readable book.
+        """
+        if self.out is None:
+            return
+        for item in remaining:
+            self.add_item(item)
+
+        self._write_opf()
+        for item in self.book.get_items():
+            if isinstance(item, epub.EpubNcx):
+                self.out.writestr(self._arcname(item), self._get_ncx())
+            elif isinstance(item, epub.EpubNav):
+                self.out.writestr(self._arcname(item), self._get_nav(item))
+        self.out.close()
+        self.out = None
+        if self._source_zip is not None:
+            self._source_zip.close()
+            self._source_zip = None
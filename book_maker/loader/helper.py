@@ -15,22 +15,11 @@ class EPUBBookLoaderHelper:
         self.accumulated_num = accumulated_num
         self.translation_style = translation_style
         self.context_flag = context_flag
+        # called with (p, translation) for every paragraph deal_new/deal_old translate
+        self.on_translated = None
 
     def insert_trans(self, p, text, translation_style="", single_translate=False):
-        if text is None:
-            text = ""
-        if (
-            p.string is not None
-            and p.string.replace(" ", "").strip() == text.replace(" ", "").strip()
-        ):
-            return
-        new_p = copy(p)
-        new_p.string = text
-        if translation_style != "":
-            new_p["style"] = translation_style
-        p.insert_after(new_p)
-        if single_translate:
-            p.extract()
+        insert_trans(p, text, translation_style, single_translate)
 
     @backoff.on_exception(
         backoff.expo,
@@ -44,12 +33,12 @@ class EPUBBookLoaderHelper:
 
     def deal_new(self, p, wait_p_list, single_translate=False):
         self.deal_old(wait_p_list, single_translate, self.context_flag)
-        self.insert_trans(
-            p,
-            shorter_result_link(self.translate_with_backoff(p.text, self.context_flag)),
-            self.translation_style,
-            single_translate,
+        text = shorter_result_link(
+            self.translate_with_backoff(p.text, self.context_flag)
         )
+        if self.on_translated:
+            self.on_translated(p, text)
+        self.insert_trans(p, text, self.translation_style, single_translate)
 
     def deal_old(self, wait_p_list, single_translate=False, context_flag=False):
         if not wait_p_list:
@@ -60,16 +49,31 @@ class EPUBBookLoaderHelper:
         for i in range(len(wait_p_list)):
             if i < len(result_txt_list):
                 p = wait_p_list[i]
-                self.insert_trans(
-                    p,
-                    shorter_result_link(result_txt_list[i]),
-                    self.translation_style,
-                    single_translate,
-                )
+                text = shorter_result_link(result_txt_list[i])
+                if self.on_translated:
+                    self.on_translated(p, text)
+                self.insert_trans(p, text, self.translation_style, single_translate)
 
         wait_p_list.clear()
 
 
+def insert_trans(p, text, translation_style="", single_translate=False):
+    if text is None:
+        text = ""
+    if (
+        p.string is not None
+        and p.string.replace(" ", "").strip() == text.replace(" ", "").strip()
+    ):
+        return
+    new_p = copy(p)
+    new_p.string = text
+    if translation_style != "":
+        new_p["style"] = translation_style
+    p.insert_after(new_p)
+    if single_translate:
+        p.extract()
+
+
 url_pattern = r"(http[s]?://|www\.)+(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
 
 
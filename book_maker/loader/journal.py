@@ -0,0 +1,358 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from threading import Lock
+
+MAGIC = b"BBMJ\x01\n"
+# key length, value length
+RECORD_HEADER = struct.Struct("<II")
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def paragraph_key(file_name, ordinal, text):
+    """Resume key of a paragraph: the file it is in, its position and its text.
+
+    The key does not depend on the order paragraphs are translated in, so a
+    saved translation is found again whatever the worker count or batching.
+    """
+    return f"{file_name}:{ordinal}:{text_hash(text)}"
+
+
+def segment_key(ordinal, text):
+    """Key of a segment of a single file book, like a batch of lines of a txt."""
+    return f"{ordinal}:{text_hash(text)}"
+
+
+class ProgressJournal:
+    """Append-only store for translated segments, used to resume a run.
+
+    Every translation is appended as one length-prefixed ``(key, text)``
+    record, so a checkpoint costs the same no matter how far the book is.
+    Records are flushed and fsync'ed every `sync_every` appends; a crash loses
+    at most that unsynced tail. Replaying the file keeps the last record of each
+    key, and once the file holds `compact_ratio` times more records than keys it
+    is rewritten with only the live ones.
+    """
+
+    def __init__(self, path, sync_every=20, compact_ratio=2, compact_min=1000):
+        self.path = path
+        self.sync_every = sync_every
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self._fp = None
+        self._lock = Lock()
+        self._keys = set()
+        self._records = 0
+        self._unsynced = 0
+        # a new run starts from an empty file, load() keeps the existing one
+        self._truncate = True
+
+    def load(self):
+        """Replay the journal and return its entries as a ``{key: text}`` dict."""
+        with self._lock:
+            entries, good_size = self._replay()
+            self._keys = set(entries)
+            self._truncate = False
+            if good_size is not None and good_size < os.path.getsize(self.path):
+                # drop the torn record a crash left behind
+                with open(self.path, "r+b") as f:
+                    f.truncate(good_size)
+            if self._needs_compaction():
+                self._rewrite(entries)
+            return entries
+
+    def _replay(self):
+        entries = {}
+        self._records = 0
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a progress journal")
+            good_size = f.tell()
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                key_len, value_len = RECORD_HEADER.unpack(header)
+                data = f.read(key_len + value_len)
+                if len(data) < key_len + value_len:
+                    break
+                entries[data[:key_len].decode("utf-8")] = data[key_len:].decode("utf-8")
+                self._records += 1
+                good_size = f.tell()
+        return entries, good_size
+
+    def _open(self):
+        if self._fp is None:
+            if self._truncate or not os.path.exists(self.path):
+                self._fp = open(self.path, "wb")
+                self._fp.write(MAGIC)
+                self._records = 0
+                self._keys = set()
+                self._truncate = False
+            else:
+                self._fp = open(self.path, "ab")
+        return self._fp
+
+    def append(self, key, text):
+        key = str(key)
+        raw_key = key.encode("utf-8")
+        value = (text or "").encode("utf-8")
+        with self._lock:
+            fp = self._open()
+            fp.write(RECORD_HEADER.pack(len(raw_key), len(value)) + raw_key + value)
+            self._keys.add(key)
+            self._records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+            if self._needs_compaction():
+                self._sync()
+                self._rewrite(self._replay()[0])
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._fp is None:
+            return
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+
+    def _needs_compaction(self):
+        return (
+            self._records >= self.compact_min
+            and self._records >= self.compact_ratio * len(self._keys)
+        )
+
+    def _rewrite(self, entries):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            for key, text in entries.items():
+                key = key.encode("utf-8")
+                value = text.encode("utf-8")
+                f.write(RECORD_HEADER.pack(len(key), len(value)) + key + value)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._records = len(entries)
+        self._keys = set(entries)
+
+    def compact(self, entries=None):
+        """Rewrite the journal with one record per key.
+
+        Args:
+            entries: ``{key: text}`` to write instead of the replayed file, used
+                to convert a resume file of an older version.
+        """
+        with self._lock:
+            self._sync()
+            self._truncate = False
+            self._rewrite(self._replay()[0] if entries is None else entries)
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+class SegmentStore(ProgressJournal):
+    """Resume file of the single file books, a `ProgressJournal` read lazily.
+
+    Segments are keyed by batch id. `load` memory-maps the file and only walks
+    its record headers to find where each segment is; a translation is decoded
+    when it is looked up. The translations appended by this run are also kept
+    in memory, until a compaction rewrites the file with them.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        # key -> (offset, length) of the text in the mapped file
+        self._offsets = {}
+        self._appended = {}
+        self._file = None
+        self._map = None
+
+    def load(self, legacy_split=None):
+        """Index the store and return it.
+
+        Args:
+            legacy_split: splits the text of a resume file of an older version
+                into its translations; they are converted to records keyed by
+                their position.
+        """
+        with self._lock:
+            try:
+                good_size = self._scan()
+            except ValueError:
+                if legacy_split is None:
+                    raise
+                with open(self.path, encoding="utf-8") as f:
+                    text = f.read()
+                good_size = None
+            self._truncate = False
+        if good_size is None:
+            translations = legacy_split(text) if text else []
+            self.compact({str(i): t for i, t in enumerate(translations)})
+            return self
+        with self._lock:
+            if good_size < os.path.getsize(self.path):
+                # drop the torn record a crash left behind
+                self._unmap()
+                with open(self.path, "r+b") as f:
+                    f.truncate(good_size)
+                self._scan()
+            if self._needs_compaction():
+                self._rewrite(self._replay()[0])
+        return self
+
+    def _scan(self):
+        self._unmap()
+        if os.path.getsize(self.path) < len(MAGIC):
+            raise ValueError(f"{self.path} is not a progress journal")
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._map
+        if data[: len(MAGIC)] != MAGIC:
+            self._unmap()
+            raise ValueError(f"{self.path} is not a progress journal")
+        offsets = {}
+        records = 0
+        position = len(MAGIC)
+        while position + RECORD_HEADER.size <= len(data):
+            key_len, value_len = RECORD_HEADER.unpack_from(data, position)
+            start = position + RECORD_HEADER.size
+            if start + key_len + value_len > len(data):
+                break
+            key = data[start : start + key_len].decode("utf-8")
+            offsets[key] = (start + key_len, value_len)
+            records += 1
+            position = start + key_len + value_len
+        self._offsets = offsets
+        self._keys = set(offsets)
+        self._records = records
+        self._appended = {}
+        return position
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+        self._offsets = {}
+
+    def _rewrite(self, entries):
+        # the file is replaced, map the new one
+        self._unmap()
+        super()._rewrite(entries)
+        self._scan()
+
+    def get(self, key, default=None):
+        key = str(key)
+        with self._lock:
+            if key in self._appended:
+                return self._appended[key]
+            if key in self._offsets:
+                offset, length = self._offsets[key]
+                return self._map[offset : offset + length].decode("utf-8")
+        return default
+
+    def __getitem__(self, key):
+        text = self.get(key)
+        if text is None:
+            raise KeyError(key)
+        return text
+
+    def __contains__(self, key):
+        return str(key) in self._appended or str(key) in self._offsets
+
+    def __len__(self):
+        return len(self._appended.keys() | self._offsets.keys())
+
+    def append(self, key, text):
+        super().append(key, text)
+        with self._lock:
+            self._appended[str(key)] = text or ""
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._appended = {}
+            self._unmap()
+
+
+class ChapterCheckpoints:
+    """Finished chapters of a run, saved as the bytes that went into the output.
+
+    A resumed run writes a checkpointed chapter as it is, without parsing it or
+    walking its paragraphs again; the byte spans of its translated paragraphs,
+    see `ParagraphIndex`, are kept next to it. Checkpoints are keyed by the chapter file name,
+    a hash of its source and `salt`, the options that change the output, so one
+    is only reused for the same input.
+    """
+
+    def __init__(self, path, salt=""):
+        self.path = path
+        self.salt = salt
+
+    def _file(self, file_name, source):
+        digest = hashlib.sha1()
+        for part in (file_name.encode("utf-8"), source, self.salt.encode("utf-8")):
+            digest.update(hashlib.sha1(part).digest())
+        return os.path.join(self.path, f"{digest.hexdigest()}.xhtml")
+
+    def has(self, file_name, source):
+        return os.path.exists(self._file(file_name, source))
+
+    def get(self, file_name, source):
+        """Return the saved output of the chapter, or None."""
+        try:
+            with open(self._file(file_name, source), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_spans(self, file_name, source):
+        """Return the paragraph spans saved with the chapter, or None."""
+        try:
+            with open(self._spans_file(file_name, source), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _spans_file(self, file_name, source):
+        return self._file(file_name, source)[: -len(".xhtml")] + ".spans.json"
+
+    def put(self, file_name, source, content, spans=()):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(file_name, source)
+        # the spans first, a chapter is never there without them
+        for target, data in (
+            (self._spans_file(file_name, source), json.dumps(list(spans)).encode()),
+            (path, content),
+        ):
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # a checkpoint is either complete or missing
+            os.replace(tmp_path, target)
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        os.rmdir(self.path)
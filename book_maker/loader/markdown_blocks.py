@@ -0,0 +1,157 @@
+import re
+from collections import namedtuple
+
+# `leading` is the blank lines before the block, each with its line break
+Block = namedtuple("Block", ["kind", "text", "leading"], defaults=("",))
+
+# blocks whose text is translated, the others are copied to the output as they are
+PROSE_KINDS = frozenset({"heading", "paragraph", "list_item", "blockquote"})
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_ATX_HEADING = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+_SETEXT_UNDERLINE = re.compile(r"^ {0,3}(=+|-+)\s*$")
+_THEMATIC_BREAK = re.compile(r"^ {0,3}([-*_])(\s*\1){2,}\s*$")
+_BLOCKQUOTE = re.compile(r"^ {0,3}>")
+_LIST_ITEM = re.compile(r"^\s*([-+*]|\d{1,9}[.)])(\s|$)")
+_HTML_BLOCK = re.compile(
+    r"^ {0,3}<(!--|\?|![A-Za-z]|/?[A-Za-z][A-Za-z0-9-]*(\s|/?>|$))"
+)
+_LINK_DEFINITION = re.compile(r"^ {0,3}\[[^\]]+\]:\s*\S")
+_TABLE_DELIMITER = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+_INDENTED = re.compile(r"^( {4}|\t)")
+
+
+def tokenize_markdown(lines):
+    """Split the lines of a Markdown document into its blocks.
+
+    A line based subset of CommonMark and GFM: front matter, fenced and
+    indented code, HTML blocks, link reference definitions, tables, thematic
+    breaks, headings, blockquotes, list items and paragraphs. Returns a list of
+    `Block`; the text of a block is its lines as they are and its `leading` the
+    blank lines before it: the blocks, each after the first on a new line,
+    give back the lines of the document.
+    """
+    blocks = []
+    start = 0
+    if lines and lines[0].strip() in ("---", "+++"):
+        closing = ("---", "...") if lines[0].strip() == "---" else ("+++",)
+        for end in range(1, len(lines)):
+            if lines[end].strip() in closing:
+                blocks.append(Block("front_matter", "\n".join(lines[: end + 1])))
+                start = end + 1
+                break
+    leading = []
+    while start < len(lines):
+        if not lines[start].strip():
+            leading.append(lines[start] + "\n")
+            start += 1
+            continue
+        previous = blocks[-1].kind if blocks else None
+        kind, end = _block_at(lines, start, previous)
+        blocks.append(Block(kind, "\n".join(lines[start:end]), "".join(leading)))
+        leading = []
+        start = end
+    return blocks
+
+
+def _interrupts_paragraph(line):
+    if _LIST_ITEM.match(line):
+        # only bullets and lists starting at 1 can interrupt a paragraph
+        marker = _LIST_ITEM.match(line).group(1)
+        return not marker[0].isdigit() or marker[:-1] == "1"
+    return bool(
+        _FENCE.match(line)
+        or _ATX_HEADING.match(line)
+        or _BLOCKQUOTE.match(line)
+        or _THEMATIC_BREAK.match(line)
+        or _HTML_BLOCK.match(line)
+    )
+
+
+def _until_blank(lines, start):
+    end = start + 1
+    while end < len(lines) and lines[end].strip():
+        end += 1
+    return end
+
+
+def _block_at(lines, start, previous):
+    """``(kind, end)`` of the block starting at the non blank line `start`."""
+    line = lines[start]
+
+    fence = _FENCE.match(line)
+    if fence:
+        marker = fence.group(1)
+        closing = re.compile(rf"^ {{0,3}}{re.escape(marker[0])}{{{len(marker)},}}\s*$")
+        for end in range(start + 1, len(lines)):
+            if closing.match(lines[end]):
+                return "code", end + 1
+        return "code", len(lines)
+
+    if _INDENTED.match(line):
+        if previous == "list_item":
+            # a later paragraph of a loose list item
+            return "list_item", _until_blank(lines, start)
+        end = start + 1
+        last = start + 1
+        while end < len(lines) and (
+            not lines[end].strip() or _INDENTED.match(lines[end])
+        ):
+            end += 1
+            if lines[end - 1].strip():
+                last = end
+        return "code", last
+
+    if _HTML_BLOCK.match(line):
+        if line.lstrip().startswith("<!--"):
+            for end in range(start, len(lines)):
+                if "-->" in lines[end]:
+                    return "html", end + 1
+            return "html", len(lines)
+        return "html", _until_blank(lines, start)
+
+    if _THEMATIC_BREAK.match(line):
+        return "thematic_break", start + 1
+
+    if _ATX_HEADING.match(line):
+        return "heading", start + 1
+
+    if _LINK_DEFINITION.match(line):
+        end = start + 1
+        while end < len(lines) and _LINK_DEFINITION.match(lines[end]):
+            end += 1
+        return "link_definition", end
+
+    if (
+        "|" in line
+        and start + 1 < len(lines)
+        and "|" in lines[start + 1]
+        and _TABLE_DELIMITER.match(lines[start + 1])
+    ):
+        end = start + 2
+        while end < len(lines) and lines[end].strip() and "|" in lines[end]:
+            end += 1
+        return "table", end
+
+    if _BLOCKQUOTE.match(line):
+        return "blockquote", _until_blank(lines, start)
+
+    if _LIST_ITEM.match(line):
+        end = start + 1
+        while (
+            end < len(lines)
+            and lines[end].strip()
+            and not _LIST_ITEM.match(lines[end])
+            and not _interrupts_paragraph(lines[end])
+        ):
+            end += 1
+        return "list_item", end
+
+    end = start + 1
+    while end < len(lines) and lines[end].strip():
+        if _SETEXT_UNDERLINE.match(lines[end]):
+            return "heading", end + 1
+        if _interrupts_paragraph(lines[end]):
+            break
+        end += 1
+    return "paragraph", end
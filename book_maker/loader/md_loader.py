@@ -1,9 +1,18 @@
+import re
 import sys
 from pathlib import Path
 
+from book_maker.translator.pool import RateLimiter, TranslatorPool
 from book_maker.utils import prompt_config_to_kwargs
 
+from .alignment import match_segments, save_alignment
 from .base_loader import BaseBookLoader
+from .journal import SegmentStore, segment_key, text_hash
+from .markdown_blocks import PROSE_KINDS, tokenize_markdown
+from .scheduling import map_in_order
+
+# the blank lines and the line break at the end of a document
+_ENDING = re.compile(r"(?:\n[ \t]*)*\n?\Z")
 
 
 class MarkdownBookLoader(BaseBookLoader):
@@ -23,6 +32,7 @@ class MarkdownBookLoader(BaseBookLoader):
         context_paragraph_limit=0,
         temperature=1.0,
         source_lang="auto",
+        parallel_workers=1,
     ) -> None:
         self.md_name = md_name
         self.translate_model = model(
@@ -34,49 +44,120 @@ class MarkdownBookLoader(BaseBookLoader):
             **prompt_config_to_kwargs(prompt_config),
         )
         self.is_test = is_test
-        self.p_to_save = []
+        # {segment key: translation} of this run, written to the alignment sidecar
+        self.translations = {}
+        # appended to `*_bilingual` in the output names, e.g. one per language
+        self.output_suffix = ""
         self.bilingual_result = []
         self.bilingual_temp_result = []
         self.test_num = test_num
         self.batch_size = 10
         self.single_translate = single_translate
-        self.md_paragraphs = []
+        self.parallel_workers = max(1, parallel_workers)
+        # requests per minute of all the parallel workers together, 0 is unlimited
+        self.requests_per_minute = 0
+        # made from an alignment sidecar by `render`, nothing is translated
+        self.rendering = False
+        self.md_blocks = []
 
         try:
             with open(f"{md_name}", encoding="utf-8") as f:
-                self.origin_book = f.read().splitlines()
+                source = f.read()
+                self.origin_book = source.splitlines()
 
         except Exception as e:
             raise Exception("can not load file") from e
+        # what follows the last block, e.g. the final line break
+        self.ending = _ENDING.search(source).group()
 
         self.resume = resume
         self.bin_path = f"{Path(md_name).parent}/.{Path(md_name).stem}.temp.bin"
+        # {batch id: translation} saved by an interrupted run
+        self.p_to_save = SegmentStore(self.bin_path)
         if self.resume:
             self.load_state()
 
-        self.process_markdown_content()
-
-    def process_markdown_content(self):
-        """将原始内容处理成 markdown 段落"""
-        current_paragraph = []
-        for line in self.origin_book:
-            # 如果是空行且当前段落不为空，保存当前段落
-            if not line.strip() and current_paragraph:
-                self.md_paragraphs.append("\n".join(current_paragraph))
-                current_paragraph = []
-            # 如果是标题行，单独作为一个段落
-            elif line.strip().startswith("#"):
-                if current_paragraph:
-                    self.md_paragraphs.append("\n".join(current_paragraph))
-                    current_paragraph = []
-                self.md_paragraphs.append(line)
-            # 其他情况，添加到当前段落
-            else:
-                current_paragraph.append(line)
+        self.md_blocks = self.process_markdown_content(self.origin_book)
+
+    def process_markdown_content(self, lines):
+        """将原始内容切分成 markdown 块，见 `tokenize_markdown`"""
+        return tokenize_markdown(lines)
+
+    def update_from(self, old_source, old_translations):
+        """Reuse the translations of a previous edition, see `match_segments`."""
+        try:
+            with open(old_source, encoding="utf-8") as f:
+                old_blocks = self.process_markdown_content(f.read().splitlines())
+        except Exception as e:
+            raise Exception("can not load file") from e
+        reused = match_segments(
+            self._segments(old_blocks),
+            self._segments(self.md_blocks),
+            old_translations,
+        )
+        self.translations.update(reused)
+        print(f"♻️  Reusing {len(reused)} translations of {old_source}")
+
+    def use_alignment(self, translations):
+        super().use_alignment(translations)
+        # the resume file of the book is left alone
+        self.rendering = True
+
+    def _segments(self, md_blocks):
+        return [
+            (key, text_hash(text))
+            for key, _, text in self._batches(md_blocks)
+            if key is not None
+        ]
+
+    def _batches(self, md_blocks):
+        """``(key, separator, text)`` of the parts of the output, in order.
+
+        Up to `batch_size` prose blocks in a row make a batch to translate, with
+        the blank lines between them as they are in the source. The other
+        blocks, like code, tables or front matter, have a None key and go to
+        the output as they are. `separator` is what comes before the part in
+        the source, the output is the separators and texts put together.
+        """
+        parts = []
+        batch = []
+        ordinal = 0
+
+        def separator(block):
+            return block.leading if block is md_blocks[0] else "\n" + block.leading
+
+        def flush():
+            nonlocal ordinal
+            if batch:
+                batch_text = batch[0].text + "".join(
+                    separator(block) + block.text for block in batch[1:]
+                )
+                parts.append(
+                    (segment_key(ordinal, batch_text), separator(batch[0]), batch_text)
+                )
+                ordinal += 1
+                batch.clear()
 
-        # 处理最后一个段落
-        if current_paragraph:
-            self.md_paragraphs.append("\n".join(current_paragraph))
+        for block in md_blocks:
+            if block.kind not in PROSE_KINDS or self._is_special_text(block.text):
+                flush()
+                parts.append((None, separator(block), block.text))
+                continue
+            batch.append(block)
+            if len(batch) == self.batch_size:
+                flush()
+        flush()
+        return parts
+
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        return [
+            (key, text)
+            for key, _, text in self._batches(self.md_blocks)
+            if key is not None
+            and key not in self.translations
+            and key not in self.p_to_save
+        ]
 
     @staticmethod
     def _is_special_text(text):
@@ -86,47 +167,72 @@ class MarkdownBookLoader(BaseBookLoader):
         pass
 
     def make_bilingual_book(self):
-        index = 0
-        p_to_save_len = len(self.p_to_save)
+        pool = None
+        if self.parallel_workers > 1:
+            pool = TranslatorPool(
+                self.translate_model, RateLimiter.per_minute(self.requests_per_minute)
+            )
 
-        try:
-            sliced_list = [
-                self.md_paragraphs[i : i + self.batch_size]
-                for i in range(0, len(self.md_paragraphs), self.batch_size)
-            ]
-            for paragraphs in sliced_list:
-                batch_text = "\n\n".join(paragraphs)
-                if self._is_special_text(batch_text):
+        def batches():
+            index = 0
+            for key, separator, batch_text in self._batches(self.md_blocks):
+                yield key, separator, batch_text
+                if key is None:
                     continue
-                if not self.resume or index >= p_to_save_len:
-                    try:
-                        max_retries = 3
-                        retry_count = 0
-                        while retry_count < max_retries:
-                            try:
-                                temp = self.translate_model.translate(batch_text)
-                                break
-                            except AttributeError as ae:
-                                print(f"翻译出错: {ae}")
-                                retry_count += 1
-                                if retry_count == max_retries:
-                                    raise Exception("翻译模型初始化失败") from ae
-                    except Exception as e:
-                        print(f"翻译过程中出错: {e}")
-                        raise Exception("翻译过程中出现错误") from e
-
-                    self.p_to_save.append(temp)
-                    if not self.single_translate:
-                        self.bilingual_result.append(batch_text)
-                    self.bilingual_result.append(temp)
                 index += self.batch_size
                 if self.is_test and index > self.test_num:
                     break
 
-            self.save_file(
-                f"{Path(self.md_name).parent}/{Path(self.md_name).stem}_bilingual.md",
-                self.bilingual_result,
-            )
+        def translate(batch):
+            key, separator, batch_text = batch
+            if key is None:
+                return key, separator, batch_text, None
+            # reused: unchanged since the previous edition, see `update_from`
+            temp = self.translations.get(key)
+            if temp is None:
+                temp = self.p_to_save.get(key)
+            if temp is not None:
+                return key, separator, batch_text, temp
+            translator = self.translate_model if pool is None else pool.get()
+            try:
+                max_retries = 3
+                retry_count = 0
+                while retry_count < max_retries:
+                    try:
+                        temp = translator.translate(batch_text)
+                        break
+                    except AttributeError as ae:
+                        print(f"翻译出错: {ae}")
+                        retry_count += 1
+                        if retry_count == max_retries:
+                            raise Exception("翻译模型初始化失败") from ae
+            except Exception as e:
+                print(f"翻译过程中出错: {e}")
+                raise Exception("翻译过程中出现错误") from e
+            # saved as soon as it is done, whatever the order it is written in
+            if not self.rendering:
+                self.p_to_save.append(key, temp)
+            return key, separator, batch_text, temp
+
+        def write(result):
+            key, separator, batch_text, temp = result
+            if key is None:
+                # not prose, copied as it is
+                self.bilingual_result.append(separator + batch_text)
+                return
+            self.translations[key] = temp
+            if self.single_translate:
+                self.bilingual_result.append(separator + temp)
+            else:
+                self.bilingual_result.append(separator + batch_text)
+                self.bilingual_result.append("\n\n" + temp)
+
+        try:
+            map_in_order(translate, batches(), write, self.parallel_workers)
+
+            output_name = f"{Path(self.md_name).parent}/{Path(self.md_name).stem}_bilingual{self.output_suffix}.md"
+            self.save_file(output_name, self.bilingual_result)
+            save_alignment(output_name, self.translations)
 
         except (KeyboardInterrupt, Exception) as e:
             print(f"发生错误: {e}")
@@ -134,45 +240,47 @@ class MarkdownBookLoader(BaseBookLoader):
             self._save_progress()
             self._save_temp_book()
             sys.exit(1)  # 使用非零退出码表示错误
+        finally:
+            self.p_to_save.close()
 
     def _save_temp_book(self):
-        index = 0
-        sliced_list = [
-            self.origin_book[i : i + self.batch_size]
-            for i in range(0, len(self.origin_book), self.batch_size)
-        ]
-
-        for i in range(len(sliced_list)):
-            batch_text = "".join(sliced_list[i])
-            self.bilingual_temp_result.append(batch_text)
-            if self._is_special_text(self.origin_book[i]):
+        for key, separator, batch_text in self._batches(self.md_blocks):
+            self.bilingual_temp_result.append(separator + batch_text)
+            if key is None:
                 continue
-            if index < len(self.p_to_save):
-                self.bilingual_temp_result.append(self.p_to_save[index])
-            index += 1
+            temp = self.translations.get(key)
+            if temp is None:
+                temp = self.p_to_save.get(key)
+            if temp is not None:
+                self.bilingual_temp_result.append("\n\n" + temp)
 
         self.save_file(
-            f"{Path(self.md_name).parent}/{Path(self.md_name).stem}_bilingual_temp.txt",
+            f"{Path(self.md_name).parent}/{Path(self.md_name).stem}_bilingual{self.output_suffix}_temp.txt",
             self.bilingual_temp_result,
         )
 
     def _save_progress(self):
         try:
-            with open(self.bin_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(self.p_to_save))
+            self.p_to_save.sync()
         except Exception as e:
             raise Exception("can not save resume file") from e
 
     def load_state(self):
         try:
-            with open(self.bin_path, encoding="utf-8") as f:
-                self.p_to_save = f.read().splitlines()
+            self.p_to_save.load()
+        except ValueError as e:
+            # the lines of the old text files can't be told apart from the
+            # translations, and the batches of this version are cut differently
+            raise Exception(
+                f"can not load resume file {self.bin_path}: it was written by an older version, delete it to start over"
+            ) from e
         except Exception as e:
             raise Exception("can not load resume file") from e
 
     def save_file(self, book_path, content):
         try:
             with open(book_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(content))
+                # the parts start with the blank lines they have in the source
+                f.write("".join(content) + self.ending)
         except Exception as e:
             raise Exception("can not save file") from e
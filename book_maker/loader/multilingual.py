@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from book_maker.translator.pool import RateLimiter, TranslatorPool
+
+from .journal import ProgressJournal
+
+
+def language_journal_path(bin_path, tag):
+    """Resume journal of one language, next to the one of the book."""
+    return bin_path.replace(".temp.bin", f".{tag}.temp.bin")
+
+
+def make_multilingual_books(
+    loader,
+    languages,
+    create_renderer,
+    create_translator,
+    workers=1,
+    requests_per_minute=0,
+    resume=False,
+):
+    """Translate a book to several languages from a single parse.
+
+    Args:
+        loader: the loader of the book, its segments are translated.
+        languages: ``(tag, language)`` pairs. `language` goes to the prompt and
+            the output of the language is ``*_bilingual_{tag}.<ext>``.
+        create_renderer: returns a new loader of the book whose translator is
+            an `AlignmentModel`, it writes the output of one language.
+        create_translator: returns a new, configured translator to `language`;
+            the workers of the language get clones of it. Translators work
+            out their target when they are made, e.g. the URL of Google or the
+            language code of DeepL, so setting `language` afterwards is not
+            enough.
+        workers: threads shared by all the languages.
+        requests_per_minute: limit of all the requests together, 0 is unlimited.
+        resume: go on from the resume journals of the languages, the book's own
+            resume file is not used.
+
+    The segments to translate are planned once with `loader.plan_segments()`.
+    Their requests are queued interleaved, segment by segment for every
+    language, so all the languages move forward at the same pace. Each output
+    is then written from its translations the way `render` does.
+    """
+    segments = loader.plan_segments()
+    if loader.is_test:
+        segments = segments[: loader.test_num]
+    print(f"📋 {len(segments)} segments to translate to {len(languages)} languages")
+
+    rate_limiter = RateLimiter.per_minute(requests_per_minute)
+    pools = {}
+    journals = {}
+    translations = {}
+    for tag, language in languages:
+        pools[tag] = TranslatorPool(create_translator(language), rate_limiter)
+        journals[tag] = ProgressJournal(language_journal_path(loader.bin_path, tag))
+        translations[tag] = {}
+        if resume:
+            try:
+                translations[tag] = journals[tag].load()
+            except FileNotFoundError:
+                pass
+
+    def translate(tag, key, text):
+        return tag, key, pools[tag].get().translate(text)
+
+    jobs = [
+        (tag, key, text)
+        for key, text in segments
+        for tag, _ in languages
+        if key not in translations[tag]
+    ]
+    pbar = tqdm(total=len(jobs))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(translate, *job) for job in jobs]
+            for future in as_completed(futures):
+                tag, key, text = future.result()
+                translations[tag][key] = text
+                journals[tag].append(key, text)
+                pbar.update(1)
+    finally:
+        pbar.close()
+        for journal in journals.values():
+            journal.close()
+
+    for tag, language in languages:
+        renderer = create_renderer(language)
+        renderer.output_suffix = f"_{tag}"
+        renderer.use_alignment(translations[tag])
+        renderer.make_bilingual_book()
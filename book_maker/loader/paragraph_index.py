@@ -0,0 +1,91 @@
+import html
+import json
+import os
+import re
+from threading import Lock
+
+_TAG_PATTERN = re.compile(rb"<[^>]*>")
+
+
+def index_path(book_name):
+    """Sidecar file of the paragraph index of `book_name`."""
+    name, _ = os.path.splitext(book_name)
+    return f"{name}.index.json"
+
+
+def span_text(markup):
+    """Text of the bytes of a span, without the tags."""
+    return html.unescape(_TAG_PATTERN.sub(b"", markup).decode("utf-8", "ignore"))
+
+
+def key_ordinal(key):
+    """Position of a paragraph in its chapter, from its `paragraph_key`."""
+    return int(key.rsplit(":", 2)[1])
+
+
+class ParagraphIndex:
+    """Where the translated paragraphs are in a written book.
+
+    For every chapter it keeps the ``(key, start, end)`` byte span of each
+    translated paragraph in the chapter file, the key being the one of the
+    resume journal (`paragraph_key`). A passage of the finished book can be
+    found and replaced from it without parsing any other chapter. Chapters a
+    run did not index, e.g. the ones of a checkpoint written by an older
+    version, are missing.
+    """
+
+    VERSION = 1
+
+    def __init__(self, chapters=None):
+        self.chapters = {} if chapters is None else chapters
+        self._lock = Lock()
+
+    def add(self, file_name, spans):
+        with self._lock:
+            self.chapters[file_name] = [list(span) for span in spans]
+
+    def __contains__(self, file_name):
+        return file_name in self.chapters
+
+    def spans(self, file_name):
+        return [tuple(span) for span in self.chapters.get(file_name, [])]
+
+    def shift(self, file_name, replaced):
+        """Update the spans of a chapter after the spans in `replaced` got new bytes.
+
+        Args:
+            replaced: ``{key: new_length}`` of the spans that were rewritten.
+        """
+        delta = 0
+        spans = []
+        for key, start, end in self.chapters[file_name]:
+            length = replaced.get(key, end - start)
+            spans.append([key, start + delta, start + delta + length])
+            delta += length - (end - start)
+        self.chapters[file_name] = spans
+
+    @classmethod
+    def load(cls, path):
+        """Read the index saved at `path`, None if there is none."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            raise Exception(f"can not read the paragraph index {path}") from e
+        if data.get("version") != cls.VERSION:
+            return None
+        return cls(data["chapters"])
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": self.VERSION, "chapters": self.chapters},
+                    f,
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                )
+        os.replace(tmp_path, path)
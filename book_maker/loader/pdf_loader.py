@@ -1,14 +1,124 @@
+import hashlib
+import html
+import json
+import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+from book_maker.translator.pool import RateLimiter, TranslatorPool
 from book_maker.utils import prompt_config_to_kwargs
 
 from .base_loader import BaseBookLoader
+from .epub_writer import StreamingEpubWriter
+from .journal import SegmentStore, segment_key
+from .pdf_paragraphs import page_blocks, reconstruct_paragraphs
+from .scheduling import TOKEN_WINDOW, count_tokens, map_in_order, pack_batches
 
 import fitz
 
 from ebooklib import epub
 
+# pages extracted by a worker process at a time
+_PAGES_PER_TASK = 8
+# documents of the EPUB output, and the pages of one when the PDF has no outline
+_MAX_CHAPTERS = 200
+_PAGES_PER_CHAPTER = 20
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _extract_pages(pdf_name, numbers):
+    """Text of the pages `numbers` of a PDF, run in a worker process."""
+    with fitz.open(pdf_name) as doc:
+        return [json.dumps(page_blocks(doc[number])) for number in numbers]
+
+
+def _html_paragraphs(css_class, text):
+    paragraphs = "".join(
+        "<p>" + html.escape(paragraph.strip()).replace("\n", "<br/>") + "</p>"
+        for paragraph in text.split("\n\n")
+        if paragraph.strip()
+    )
+    return f'<div class="{css_class}">{paragraphs}</div>'
+
+
+class _EpubChapters:
+    """Bilingual EPUB of a PDF, written chapter by chapter as the batches come.
+
+    `chapters` are ``(first page, title)`` pairs in page order. A batch goes to
+    the chapter its first page is in, and a chapter is written to the zip as
+    soon as the batches move past it, so only the current one is in memory.
+    """
+
+    def __init__(self, name, title, language, chapters):
+        self.name = name
+        self.language = language
+        self.chapters = chapters
+        self.book = epub.EpubBook()
+        self.book.set_identifier(title)
+        self.book.set_title(title)
+        self.book.set_language(language)
+        self.writer = StreamingEpubWriter(name, self.book).open()
+        self.written = []
+        self.current = 0
+        self.parts = []
+
+    def add(self, page, original, translation):
+        chapter = self.current
+        while (
+            chapter + 1 < len(self.chapters) and self.chapters[chapter + 1][0] <= page
+        ):
+            chapter += 1
+        if chapter != self.current:
+            self._write_chapter()
+            self.current = chapter
+        if original:
+            self.parts.append(_html_paragraphs("original", original))
+        if translation:
+            self.parts.append(_html_paragraphs("translation", translation))
+
+    def _write_chapter(self):
+        if not self.parts:
+            return
+        title = self.chapters[self.current][1]
+        chapter = epub.EpubHtml(
+            title=title,
+            file_name=f"chapter_{len(self.written):04d}.xhtml",
+            lang=self.language,
+        )
+        chapter.content = f"<h1>{html.escape(title)}</h1>" + "".join(self.parts)
+        # the writer stores the bytes as they are, render the whole document
+        chapter.book = self.book
+        chapter.content = chapter.get_content()
+        self.writer.add_item(chapter)
+        self.written.append(chapter)
+        self.parts = []
+
+    def close(self):
+        self._write_chapter()
+        self.book.toc = tuple(self.written)
+        self.book.spine = ["nav"] + self.written
+        self.writer.add_item(epub.EpubNcx())
+        self.writer.add_item(epub.EpubNav())
+        self.writer.close()
+
+    def abort(self):
+        """Drop the partial book, e.g. when the run is interrupted."""
+        if self.writer.out is not None:
+            self.writer.out.close()
+            self.writer.out = None
+        if os.path.exists(self.name):
+            os.remove(self.name)
+
 
 class PDFBookLoader(BaseBookLoader):
     def __init__(
@@ -42,154 +152,263 @@ class PDFBookLoader(BaseBookLoader):
             **prompt_config_to_kwargs(prompt_config),
         )
         self.is_test = is_test
-        self.p_to_save = []
         self.bilingual_result = []
         self.bilingual_temp_result = []
         self.test_num = test_num
         self.batch_size = 10
+        # pack paragraphs up to this many tokens, `batch_size` is a cap then
+        self.batch_tokens = 0
         self.single_translate = single_translate
         self.parallel_workers = max(1, parallel_workers)
+        # requests per minute of all the parallel workers together, 0 is unlimited
+        self.requests_per_minute = 0
+
+        # processes that extract the text of the pages, 0 extracts it in this one
+        self.process_workers = 0
+        self._origin_book = None
 
         try:
-            doc = fitz.open(self.pdf_name)
-            lines = []
-            for page in doc:
-                text = page.get_text("text")
-                if not text:
-                    continue
-                lines.extend(text.splitlines())
-            self.origin_book = lines
+            # the pages are extracted lazily, as they are translated
+            with fitz.open(self.pdf_name) as doc:
+                self.page_count = doc.page_count
+            self.pdf_hash = _file_hash(self.pdf_name)
         except Exception as e:
             raise Exception("can not load file") from e
+        self.pages_path = f"{Path(pdf_name).parent}/.{Path(pdf_name).stem}.pages.bin"
 
         self.resume = resume
         self.bin_path = f"{Path(pdf_name).parent}/.{Path(pdf_name).stem}.temp.bin"
+        # {batch id: translation} saved by an interrupted run
+        self.p_to_save = SegmentStore(self.bin_path)
         if self.resume:
             self.load_state()
 
     def _make_new_book(self, book):
         pass
 
-    def _try_create_epub(self):
-        """Try to create an EPUB file from translated content.
+    @property
+    def origin_book(self):
+        """All the paragraphs of the book, extracted on first use."""
+        if self._origin_book is None:
+            self._origin_book = [paragraph for _, paragraph in self._paragraphs()]
+        return self._origin_book
 
-        The EPUB is created from the `self.bilingual_result` list which alternates
-        original and translated strings. If EPUB creation fails for any reason,
-        this function will log the error and leave the TXT fallback intact.
-        """
-        if epub is None:
-            # ebooklib not installed; skip EPUB generation
-            return False
+    def _page_key(self, number):
+        return f"{self.pdf_hash}:blocks:{number}"
 
-        if not self.bilingual_result:
-            return False
+    def _pages(self):
+        """Text blocks of the pages in order, from the cache or extracted as needed.
 
-        try:
-            book = epub.EpubBook()
-            title = Path(self.pdf_name).stem
-            # Minimal metadata
+        The cache, `.<book>.pages.bin`, keeps the blocks of every page under the
+        hash of the PDF and the page number, so a restart reads it instead of
+        extracting the pages again. With `process_workers` the missing pages
+        are extracted a few at a time in that many processes, ahead of the
+        translation.
+        """
+        cache = SegmentStore(self.pages_path)
+        if os.path.exists(self.pages_path):
             try:
-                book.set_identifier(title)
-                book.set_title(title)
-                book.set_language(
-                    self.translate_model.language
-                    if hasattr(self.translate_model, "language")
-                    else "en"
-                )
-            except Exception:
-                # be tolerant about metadata API differences
+                cache.load()
+            except ValueError:
                 pass
+        if self._page_key(0) not in cache:
+            # another PDF was there before, start the cache over
+            cache.close()
+            cache = SegmentStore(self.pages_path)
+        try:
+            missing = [
+                number
+                for number in range(self.page_count)
+                if self._page_key(number) not in cache
+            ]
+            extracted = self._extract(missing)
+            for number in range(self.page_count):
+                key = self._page_key(number)
+                blocks = cache.get(key)
+                if blocks is None:
+                    blocks = next(extracted)
+                    cache.append(key, blocks)
+                yield json.loads(blocks)
+        finally:
+            cache.close()
 
-            chapters = []
-            # build chapters from bilingual_result (pairs)
-            for i in range(0, len(self.bilingual_result), 2):
-                orig = self.bilingual_result[i]
-                trans = (
-                    self.bilingual_result[i + 1]
-                    if i + 1 < len(self.bilingual_result)
-                    else ""
-                )
-                # basic html content: original then translated
-                content = ""
-                if orig:
-                    content += (
-                        '<div class="original">'
-                        + "<p>"
-                        + orig.replace("\n", "<br/>")
-                        + "</p></div>"
-                    )
-                if trans:
-                    content += (
-                        '<div class="translation">'
-                        + "<p>"
-                        + trans.replace("\n", "<br/>")
-                        + "</p></div>"
+    def _extract(self, numbers):
+        if not numbers:
+            return
+        if self.process_workers <= 0:
+            with fitz.open(self.pdf_name) as doc:
+                for number in numbers:
+                    yield json.dumps(page_blocks(doc[number]))
+            return
+        chunks = [
+            numbers[i : i + _PAGES_PER_TASK]
+            for i in range(0, len(numbers), _PAGES_PER_TASK)
+        ]
+        executor = ProcessPoolExecutor(max_workers=self.process_workers)
+        try:
+            futures = deque()
+            chunks = iter(chunks)
+            while True:
+                # a few chunks ahead of the translation, not the whole book
+                while len(futures) < 2 * self.process_workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    futures.append(
+                        executor.submit(_extract_pages, self.pdf_name, chunk)
                     )
+                if not futures:
+                    return
+                yield from futures.popleft().result()
+        finally:
+            executor.shutdown(cancel_futures=True)
 
-                chap = epub.EpubHtml(
-                    title=f"part_{i//2}",
-                    file_name=f"index_split_{i//2:03d}.xhtml",
-                    lang=(
-                        book.get_metadata("DC", "language")[0][0]
-                        if book.get_metadata("DC", "language")
-                        else None
-                    ),
-                )
-                chap.content = content
-                book.add_item(chap)
-                chapters.append(chap)
+    def _paragraphs(self):
+        return reconstruct_paragraphs(self._pages())
+
+    def _units(self, paragraphs):
+        """``([(page, paragraph)], tokens)`` of the paragraphs, counted a window at a time."""
+        while window := list(islice(paragraphs, TOKEN_WINDOW)):
+            costs = count_tokens([paragraph for _, paragraph in window])
+            for paragraph, cost in zip(window, costs):
+                yield [paragraph], cost
+
+    def _paged_batches(self):
+        """``(page, key, text)`` of the batches of the book, one at a time.
+
+        A batch is `batch_size` paragraphs, or with `batch_tokens` paragraphs
+        packed up to that many tokens and at most `batch_size` of them. `page`
+        is the page its first paragraph starts on.
+        """
+        paragraphs = self._paragraphs()
+        if self.batch_tokens:
+            batches = pack_batches(
+                self._units(paragraphs), self.batch_tokens, self.batch_size
+            )
+        else:
+            batches = iter(lambda: list(islice(paragraphs, self.batch_size)), [])
+        for ordinal, batch in enumerate(batches):
+            batch_text = "\n\n".join(paragraph for _, paragraph in batch)
+            yield batch[0][0], segment_key(ordinal, batch_text), batch_text
 
-            # table of contents and spine
-            book.toc = tuple(chapters)
-            book.spine = ["nav"] + chapters
+    def _batches(self):
+        return ((key, text) for _, key, text in self._paged_batches())
 
-            # add navigation files
-            book.add_item(epub.EpubNcx())
-            book.add_item(epub.EpubNav())
+    def _chapters(self):
+        """``(first page, title)`` of the chapters of the EPUB output.
 
-            out_path = f"{Path(self.pdf_name).parent}/{Path(self.pdf_name).stem}_bilingual.epub"
-            epub.write_epub(out_path, book)
-            return True
+        The first level of the outline of the PDF when it has one with at most
+        `_MAX_CHAPTERS` entries, otherwise ranges of pages, no more than
+        `_MAX_CHAPTERS` of them.
+        """
+        with fitz.open(self.pdf_name) as doc:
+            outline = doc.get_toc(simple=True)
+        starts = {}
+        for level, title, page in outline:
+            if level == 1 and 1 <= page <= self.page_count:
+                starts.setdefault(page - 1, title.strip() or f"Page {page}")
+        if 1 < len(starts) <= _MAX_CHAPTERS:
+            chapters = sorted(starts.items())
+            if chapters[0][0] > 0:
+                chapters.insert(0, (0, Path(self.pdf_name).stem))
+            return chapters
+        size = max(_PAGES_PER_CHAPTER, -(-self.page_count // _MAX_CHAPTERS))
+        return [
+            (first, f"Pages {first + 1}-{min(first + size, self.page_count)}")
+            for first in range(0, max(self.page_count, 1), size)
+        ]
+
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        return [
+            (key, text) for key, text in self._batches() if key not in self.p_to_save
+        ]
+
+    def _open_epub(self):
+        """`_EpubChapters` writing `*_bilingual.epub`, or None without ebooklib."""
+        if epub is None:
+            # ebooklib not installed; skip EPUB generation
+            return None
+        try:
+            language = getattr(self.translate_model, "language", "en")
+            return _EpubChapters(
+                f"{Path(self.pdf_name).parent}/{Path(self.pdf_name).stem}_bilingual.epub",
+                Path(self.pdf_name).stem,
+                language,
+                self._chapters(),
+            )
         except Exception as e:
             print(f"create epub failed: {e}")
-            return False
+            return None
 
     def make_bilingual_book(self):
-        index = 0
-        p_to_save_len = len(self.p_to_save)
+        pool = None
+        if self.parallel_workers > 1:
+            pool = TranslatorPool(
+                self.translate_model, RateLimiter.per_minute(self.requests_per_minute)
+            )
 
-        try:
-            sliced_list = [
-                self.origin_book[i : i + self.batch_size]
-                for i in range(0, len(self.origin_book), self.batch_size)
-            ]
-            for i in sliced_list:
-                # fix the format thanks https://github.com/tudoujunha
-                batch_text = "\n".join(i)
-                if not batch_text.strip():
-                    continue
-                if not self.resume or index >= p_to_save_len:
-                    try:
-                        temp = self.translate_model.translate(batch_text)
-                    except Exception as e:
-                        print(e)
-                        raise Exception("Something is wrong when translate") from e
-                    self.p_to_save.append(temp)
-                    if not self.single_translate:
-                        self.bilingual_result.append(batch_text)
-                    self.bilingual_result.append(temp)
-                index += self.batch_size
+        def batches():
+            index = 0
+            for page, key, batch_text in self._paged_batches():
+                yield page, key, batch_text
+                # paragraphs, with `batch_tokens` a batch can be the whole book
+                index += batch_text.count("\n\n") + 1
                 if self.is_test and index > self.test_num:
                     break
 
+        def translate(batch):
+            page, key, batch_text = batch
+            temp = self.p_to_save.get(key)
+            if temp is not None:
+                return page, batch_text, temp
+            translator = self.translate_model if pool is None else pool.get()
+            try:
+                temp = translator.translate(batch_text)
+            except Exception as e:
+                print(e)
+                raise Exception("Something is wrong when translate") from e
+            # saved as soon as it is done, whatever the order it is written in
+            self.p_to_save.append(key, temp)
+            return page, batch_text, temp
+
+        builder = self._open_epub()
+
+        def write(result):
+            nonlocal builder
+            page, batch_text, temp = result
+            if not self.single_translate:
+                self.bilingual_result.append(batch_text)
+            self.bilingual_result.append(temp)
+            if builder is not None:
+                try:
+                    builder.add(
+                        page, None if self.single_translate else batch_text, temp
+                    )
+                except Exception as e:
+                    # the TXT output goes on without the EPUB
+                    print(f"create epub failed: {e}")
+                    builder.abort()
+                    builder = None
+
+        items = batches()
+        try:
+            map_in_order(translate, items, write, self.parallel_workers)
+
             txt_out = (
                 f"{Path(self.pdf_name).parent}/{Path(self.pdf_name).stem}_bilingual.txt"
             )
             self.save_file(txt_out, self.bilingual_result)
 
-            # try to create an EPUB alongside the TXT fallback; if EPUB fails we still keep the TXT file
-            epub_ok = self._try_create_epub()
-            if epub_ok:
+            # the EPUB is written alongside the TXT fallback; if it fails we still keep the TXT file
+            if builder is not None:
+                try:
+                    builder.close()
+                except Exception as e:
+                    print(f"create epub failed: {e}")
+                    builder.abort()
+                    builder = None
+            if builder is not None:
                 print(f"created epub: {Path(self.pdf_name).stem}_bilingual.epub")
             else:
                 print(
@@ -199,23 +418,22 @@ class PDFBookLoader(BaseBookLoader):
         except (KeyboardInterrupt, Exception) as e:
             print(e)
             print("you can resume it next time")
+            if builder is not None:
+                builder.abort()
             self._save_progress()
+            # let go of the page cache before the temp book reads it again
+            items.close()
             self._save_temp_book()
             sys.exit(0)
+        finally:
+            self.p_to_save.close()
 
     def _save_temp_book(self):
-        index = 0
-        sliced_list = [
-            self.origin_book[i : i + self.batch_size]
-            for i in range(0, len(self.origin_book), self.batch_size)
-        ]
-
-        for i in range(len(sliced_list)):
-            batch_text = "".join(sliced_list[i])
+        for key, batch_text in self._batches():
             self.bilingual_temp_result.append(batch_text)
-            if index < len(self.p_to_save):
-                self.bilingual_temp_result.append(self.p_to_save[index])
-            index += 1
+            temp = self.p_to_save.get(key)
+            if temp is not None:
+                self.bilingual_temp_result.append(temp)
 
         self.save_file(
             f"{Path(self.pdf_name).parent}/{Path(self.pdf_name).stem}_bilingual_temp.txt",
@@ -224,15 +442,19 @@ class PDFBookLoader(BaseBookLoader):
 
     def _save_progress(self):
         try:
-            with open(self.bin_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(self.p_to_save))
+            self.p_to_save.sync()
         except Exception as e:
             raise Exception("can not save resume file") from e
 
     def load_state(self):
         try:
-            with open(self.bin_path, encoding="utf-8") as f:
-                self.p_to_save = f.read().splitlines()
+            self.p_to_save.load()
+        except ValueError as e:
+            # the lines of the old text files can't be told apart from the
+            # translations, and the batches of this version are cut differently
+            raise Exception(
+                f"can not load resume file {self.bin_path}: it was written by an older version, delete it to start over"
+            ) from e
         except Exception as e:
             raise Exception("can not load resume file") from e
 
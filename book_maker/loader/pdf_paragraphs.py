@@ -0,0 +1,114 @@
+import re
+from collections import Counter, deque
+
+# pages before and after a page that its running headers and footers are looked for in
+_EDGE_WINDOW = 4
+# a header or footer is on at least that many pages of the window
+_EDGE_REPEATS = 3
+# blocks at the top and at the bottom of a page that can be headers or footers
+_EDGE_BLOCKS = 2
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"[.!?:;。！？…\"'”’)\]]\s*$")
+_HYPHENATED = re.compile(r"[A-Za-z]-$")
+
+
+def page_blocks(page):
+    """Text blocks of a PyMuPDF page in reading order, images left out."""
+    return [
+        block[4].strip()
+        for block in page.get_text("blocks", sort=True)
+        if block[6] == 0 and block[4].strip()
+    ]
+
+
+def _edge_shape(text):
+    # page numbers change from page to page, the rest of a header does not
+    return _SPACES.sub(" ", _DIGITS.sub("#", text)).strip().lower()
+
+
+def _edges(blocks):
+    return {
+        _edge_shape(text) for text in blocks[:_EDGE_BLOCKS] + blocks[-_EDGE_BLOCKS:]
+    }
+
+
+def strip_running_edges(pages):
+    """Drop the running headers and footers of `pages`, lists of blocks.
+
+    A block at the top or the bottom of a page is a header or a footer when the
+    same text, page numbers aside, is at the top or the bottom of at least
+    `_EDGE_REPEATS` pages around it. The pages are streamed, with a look ahead
+    of `_EDGE_WINDOW` pages.
+    """
+    window = deque()
+    shapes = Counter()
+    current = 0
+    pages = iter(pages)
+    exhausted = False
+    while True:
+        while not exhausted and len(window) - current <= _EDGE_WINDOW:
+            blocks = next(pages, None)
+            if blocks is None:
+                exhausted = True
+                break
+            window.append(blocks)
+            shapes.update(_edges(blocks))
+        if current >= len(window):
+            return
+        blocks = window[current]
+        edges = set(range(min(_EDGE_BLOCKS, len(blocks))))
+        edges |= set(range(max(0, len(blocks) - _EDGE_BLOCKS), len(blocks)))
+        yield [
+            text
+            for i, text in enumerate(blocks)
+            if i not in edges or shapes[_edge_shape(text)] < _EDGE_REPEATS
+        ]
+        current += 1
+        if current > _EDGE_WINDOW:
+            shapes.subtract(_edges(window.popleft()))
+            current -= 1
+
+
+def _join(first, second):
+    if _HYPHENATED.search(first) and second[:1].islower():
+        # a word broken at the end of the line
+        return first[:-1] + second
+    return f"{first} {second}"
+
+
+def _continues(paragraph, text):
+    return not _SENTENCE_END.search(paragraph) and text[:1].islower()
+
+
+def _unwrap(block):
+    lines = [line.strip() for line in block.splitlines() if line.strip()]
+    text = lines[0]
+    for line in lines[1:]:
+        text = _join(text, line)
+    return text
+
+
+def reconstruct_paragraphs(pages):
+    """Paragraphs of a PDF from the text blocks of its pages, lists of blocks.
+
+    Yields ``(page, paragraph)``, `page` being the number of the page the
+    paragraph starts on. The lines of a block are unwrapped into one, words
+    hyphenated at the end of a line are joined again. A block that starts in
+    lower case after one that does not end a sentence continues it, on the same
+    page or the next one. Running headers and footers are dropped, see
+    `strip_running_edges`.
+    """
+    paragraph = None
+    for number, blocks in enumerate(strip_running_edges(pages)):
+        for block in blocks:
+            text = _unwrap(block)
+            if paragraph is not None and _continues(paragraph[1], text):
+                paragraph = (paragraph[0], _join(paragraph[1], text))
+                continue
+            if paragraph is not None:
+                yield paragraph
+            paragraph = (number, text)
+    if paragraph is not None:
+        yield paragraph
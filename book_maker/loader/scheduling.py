@@ -0,0 +1,158 @@
+import heapq
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tiktoken
+
+from book_maker.utils import num_tokens_from_text
+
+_TAG_PATTERN = re.compile(rb"<[^>]*>")
+_tokenizer_available = True
+# texts whose tokens are counted in one batch when they are streamed
+TOKEN_WINDOW = 256
+
+
+def estimate_tokens(text):
+    """Token count of `text`, or a length based guess if tiktoken can't load."""
+    global _tokenizer_available
+    if _tokenizer_available:
+        try:
+            return num_tokens_from_text(text)
+        except Exception:
+            # the encoding is downloaded on first use, e.g. offline it can't be
+            _tokenizer_available = False
+    return len(text) // 4 + 1
+
+
+def count_tokens(texts):
+    """Token counts of `texts`, encoded in one batch."""
+    global _tokenizer_available
+    if _tokenizer_available:
+        try:
+            encoding = tiktoken.get_encoding("cl100k_base")
+            return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+        except Exception:
+            _tokenizer_available = False
+    return [len(text) // 4 + 1 for text in texts]
+
+
+def chapter_cost(content):
+    """Estimated number of tokens to translate in a chapter, from its raw bytes."""
+    text = _TAG_PATTERN.sub(b" ", content).decode("utf-8", errors="ignore")
+    return estimate_tokens(" ".join(text.split()))
+
+
+def lpt_order(costs):
+    """Indices of `costs`, the most expensive first.
+
+    Handing the longest tasks out first (LPT) keeps a big chapter from being
+    started last while every other worker is already idle.
+    """
+    return sorted(range(len(costs)), key=lambda i: -costs[i])
+
+
+def makespan(costs, workers, order=None):
+    """Cost of the busiest worker when `workers` take tasks in `order`."""
+    loads = [0] * max(1, min(workers, len(costs)))
+    for i in range(len(costs)) if order is None else order:
+        heapq.heappush(loads, heapq.heappop(loads) + costs[i])
+    return max(loads)
+
+
+def split_segments(segments, budget):
+    """Cut ``(key, text)`` segments into consecutive parts of about `budget` tokens.
+
+    Returns a list of ``(segments, cost)`` parts.
+    """
+    parts = []
+    part = []
+    cost = 0
+    for segment in segments:
+        segment_cost = estimate_tokens(segment[1])
+        if part and cost + segment_cost > budget:
+            parts.append((part, cost))
+            part = []
+            cost = 0
+        part.append(segment)
+        cost += segment_cost
+    if part or not parts:
+        parts.append((part, cost))
+    return parts
+
+
+def pack_batches(units, budget, cap):
+    """Pack ``(parts, tokens)`` units, in order, into batches of parts.
+
+    A batch holds at most `budget` tokens and `cap` parts. A unit is never
+    split, one over the budget makes a batch of its own.
+    """
+    batch = []
+    cost = 0
+    for parts, tokens in units:
+        if batch and (cost + tokens > budget or len(batch) + len(parts) > cap):
+            yield batch
+            batch = []
+            cost = 0
+        batch.extend(parts)
+        cost += tokens
+    if batch:
+        yield batch
+
+
+class ReorderBuffer:
+    """Hand out results in their original order while they complete in any order.
+
+    `put(position, value)` keeps the value until every earlier position is in,
+    then calls `release` for it and for every following value that is ready.
+    """
+
+    def __init__(self, release, start=0):
+        self.release = release
+        self._next = start
+        self._pending = {}
+
+    def put(self, position, value):
+        self._pending[position] = value
+        while self._next in self._pending:
+            value = self._pending.pop(self._next)
+            self._next += 1
+            self.release(value)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def map_in_order(fn, items, release, workers=1, window=None):
+    """Call `fn` on each of `items` on `workers` threads, `release` the results in order.
+
+    At most `window` items, twice the workers by default, are taken from
+    `items` ahead of the last released result, so a lazily read input is never
+    read further ahead than that. With one worker everything runs in the
+    calling thread, one item after the other.
+    """
+    if workers <= 1:
+        for item in items:
+            release(fn(item))
+        return
+    window = window or 2 * workers
+    buffer = ReorderBuffer(release)
+    items = enumerate(items)
+    positions = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(positions) + len(buffer) < window:
+                entry = next(items, None)
+                if entry is None:
+                    exhausted = True
+                else:
+                    positions[executor.submit(fn, entry[1])] = entry[0]
+            if not positions:
+                break
+            done, _ = wait(positions, return_when=FIRST_COMPLETED)
+            for future in done:
+                buffer.put(positions.pop(future), future.result())
+    finally:
+        # on an error, the items that did not start yet are dropped
+        executor.shutdown(cancel_futures=True)
@@ -8,7 +8,9 @@ from pathlib import Path
 
 from book_maker.utils import prompt_config_to_kwargs
 
+from .alignment import save_alignment
 from .base_loader import BaseBookLoader
+from .journal import SegmentStore, segment_key
 
 
 class SRTBookLoader(BaseBookLoader):
@@ -28,6 +30,7 @@ class SRTBookLoader(BaseBookLoader):
         context_paragraph_limit=0,
         temperature=1.0,
         source_lang="auto",
+        parallel_workers=1,
     ) -> None:
         self.srt_name = srt_name
         self.translate_model = model(
@@ -44,22 +47,32 @@ class SRTBookLoader(BaseBookLoader):
             ),
         )
         self.is_test = is_test
-        self.p_to_save = []
+        # {segment key: translation} of this run, written to the alignment sidecar
+        self.translations = {}
         self.bilingual_result = []
         self.bilingual_temp_result = []
         self.test_num = test_num
         self.accumulated_num = 1
         self.blocks = []
         self.single_translate = single_translate
+        # made from an alignment sidecar by `render`, nothing is translated
+        self.rendering = False
 
         self.resume = resume
         self.bin_path = f"{Path(srt_name).parent}/.{Path(srt_name).stem}.temp.bin"
+        # {block id: translation} saved by an interrupted run
+        self.p_to_save = SegmentStore(self.bin_path)
         if self.resume:
             self.load_state()
 
     def _make_new_book(self, book):
         pass
 
+    def use_alignment(self, translations):
+        super().use_alignment(translations)
+        # the resume file of the book is left alone
+        self.rendering = True
+
     def _parse_srt(self, srt_text):
         blocks = re.split("\n\s*\n", srt_text)
 
@@ -158,19 +171,30 @@ class SRTBookLoader(BaseBookLoader):
         sliced_list.append((begin_index, len(self.blocks), sliced_text))
         return sliced_list
 
-    def make_bilingual_book(self):
-        if self.accumulated_num > 512:
-            print(f"{self.accumulated_num} is too large, shrink it to 512.")
-            self.accumulated_num = 512
-
+    def _load_blocks(self):
         try:
             with open(f"{self.srt_name}", encoding="utf-8") as f:
                 self.blocks = self._parse_srt(f.read())
         except Exception as e:
             raise Exception("can not load file") from e
 
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        self._load_blocks()
+        return [
+            (segment_key(begin, text), text)
+            for begin, _, text in self._get_sliced_list()
+            if text
+        ]
+
+    def make_bilingual_book(self):
+        if self.accumulated_num > 512:
+            print(f"{self.accumulated_num} is too large, shrink it to 512.")
+            self.accumulated_num = 512
+
+        self._load_blocks()
+
         index = 0
-        p_to_save_len = len(self.p_to_save)
 
         try:
             sliced_list = self._get_sliced_list()
@@ -178,15 +202,14 @@ class SRTBookLoader(BaseBookLoader):
             for sliced in sliced_list:
                 begin, end, text = sliced
 
-                if not self.resume or index + (end - begin) > p_to_save_len:
-                    if index < p_to_save_len:
-                        self.p_to_save = self.p_to_save[:index]
-
+                saved = [self._saved_translation(i) for i in range(begin, end)]
+                if None in saved:
                     try:
                         temp = self.translate_model.translate(text)
                     except Exception as e:
                         print(e)
                         raise Exception("Something is wrong when translate") from e
+                    self.translations[segment_key(begin, text)] = temp
 
                     translated_blocks = self._get_blocks_from(temp)
 
@@ -199,16 +222,20 @@ class SRTBookLoader(BaseBookLoader):
                             print(
                                 f"retry it one by one:  {self.blocks[begin]['number']} - {self.blocks[end - 1]['number']}"
                             )
-                            for block in self.blocks[begin:end]:
+                            for number, block in enumerate(
+                                self.blocks[begin:end], begin
+                            ):
+                                block_text = self._get_block_translate(block)
                                 try:
-                                    temp = self.translate_model.translate(
-                                        self._get_block_translate(block)
-                                    )
+                                    temp = self.translate_model.translate(block_text)
                                 except Exception as e:
                                     print(e)
                                     raise Exception(
                                         "Something is wrong when translate"
                                     ) from e
+                                self.translations[segment_key(number, block_text)] = (
+                                    temp
+                                )
                                 translated_blocks.append(self._get_block_from(temp))
 
                             if not self._check_blocks(
@@ -218,37 +245,38 @@ class SRTBookLoader(BaseBookLoader):
                                     "retry failed, adjust the srt manually."
                                 )
 
+                    saved = []
                     for i, block in enumerate(translated_blocks):
                         text = block.get("text", "")
-                        self.p_to_save.append(text)
-                        if self.single_translate:
-                            self.bilingual_result.append(
-                                f"{self._get_block_except_text(self.blocks[begin + i])}\n{text}"
-                            )
-                        else:
-                            self.bilingual_result.append(
-                                f"{self._get_block_text(self.blocks[begin + i])}\n{text}"
-                            )
+                        saved.append(text)
+                        if not self.rendering:
+                            self.p_to_save.append(self._block_key(begin + i), text)
                 else:
-                    for i, block in enumerate(self.blocks[begin:end]):
-                        text = self.p_to_save[begin + i]
-                        if self.single_translate:
-                            self.bilingual_result.append(
-                                f"{self._get_block_except_text(self.blocks[begin + i])}\n{text}"
-                            )
-                        else:
-                            self.bilingual_result.append(
-                                f"{self._get_block_text(self.blocks[begin + i])}\n{text}"
-                            )
+                    # resumed, the sidecar gets the slice as it was translated
+                    self.translations[segment_key(begin, text)] = "\n\n".join(
+                        f"{self.blocks[begin + i]['number']}\n{block_text}"
+                        for i, block_text in enumerate(saved)
+                    )
+
+                for i, text in enumerate(saved):
+                    if self.single_translate:
+                        self.bilingual_result.append(
+                            f"{self._get_block_except_text(self.blocks[begin + i])}\n{text}"
+                        )
+                    else:
+                        self.bilingual_result.append(
+                            f"{self._get_block_text(self.blocks[begin + i])}\n{text}"
+                        )
 
                 index += end - begin
                 if self.is_test and index > self.test_num:
                     break
 
-            self.save_file(
-                f"{Path(self.srt_name).parent}/{Path(self.srt_name).stem}_bilingual.srt",
-                self.bilingual_result,
+            output_name = (
+                f"{Path(self.srt_name).parent}/{Path(self.srt_name).stem}_bilingual.srt"
             )
+            self.save_file(output_name, self.bilingual_result)
+            save_alignment(output_name, self.translations)
 
         except (KeyboardInterrupt, Exception) as e:
             print(e)
@@ -256,11 +284,21 @@ class SRTBookLoader(BaseBookLoader):
             self._save_progress()
             self._save_temp_book()
             sys.exit(0)
+        finally:
+            self.p_to_save.close()
+
+    def _block_key(self, index):
+        return segment_key(index, self._get_block_translate(self.blocks[index]))
+
+    def _saved_translation(self, index):
+        # resume files of older versions are keyed by position
+        text = self.p_to_save.get(self._block_key(index))
+        return self.p_to_save.get(index) if text is None else text
 
     def _save_temp_book(self):
         for i, block in enumerate(self.blocks):
-            if i < len(self.p_to_save):
-                text = self.p_to_save[i]
+            text = self._saved_translation(i)
+            if text is not None:
                 self.bilingual_temp_result.append(
                     f"{self._get_block_text(block)}\n{text}"
                 )
@@ -274,20 +312,13 @@ class SRTBookLoader(BaseBookLoader):
 
     def _save_progress(self):
         try:
-            with open(self.bin_path, "w", encoding="utf-8") as f:
-                f.write("===".join(self.p_to_save))
+            self.p_to_save.sync()
         except Exception as e:
             raise Exception("can not save resume file") from e
 
     def load_state(self):
         try:
-            with open(self.bin_path, encoding="utf-8") as f:
-                text = f.read()
-                if text:
-                    self.p_to_save = text.split("===")
-                else:
-                    self.p_to_save = []
-
+            self.p_to_save.load(legacy_split=lambda text: text.split("==="))
         except Exception as e:
             raise Exception("can not load resume file") from e
 
@@ -1,9 +1,15 @@
+import os
 import sys
+from itertools import islice
 from pathlib import Path
 
+from book_maker.translator.pool import RateLimiter, TranslatorPool
 from book_maker.utils import prompt_config_to_kwargs
 
+from .alignment import alignment_path, match_segments
 from .base_loader import BaseBookLoader
+from .journal import ProgressJournal, SegmentStore, segment_key, text_hash
+from .scheduling import TOKEN_WINDOW, count_tokens, map_in_order, pack_batches
 
 
 class TXTBookLoader(BaseBookLoader):
@@ -35,26 +41,133 @@ class TXTBookLoader(BaseBookLoader):
             **prompt_config_to_kwargs(prompt_config),
         )
         self.is_test = is_test
-        self.p_to_save = []
-        self.bilingual_result = []
-        self.bilingual_temp_result = []
+        # {segment key: translation} saved by an interrupted run, see `load_state`
+        self.p_to_save = {}
+        # {segment key: translation} to reuse, see `update_from`
+        self.translations = {}
+        # appended to `*_bilingual` in the output names, e.g. one per language
+        self.output_suffix = ""
         self.test_num = test_num
         self.batch_size = 10
+        # pack whole paragraphs up to this many tokens, `batch_size` is a cap then
+        self.batch_tokens = 0
         self.single_translate = single_translate
         self.parallel_workers = max(1, parallel_workers)
+        # requests per minute of all the parallel workers together, 0 is unlimited
+        self.requests_per_minute = 0
+        # made from an alignment sidecar by `render`, nothing is translated
+        self.rendering = False
 
         try:
-            with open(f"{txt_name}", encoding="utf-8") as f:
-                self.origin_book = f.read().splitlines()
-
+            # the lines are read lazily, as they are translated
+            open(txt_name, encoding="utf-8").close()
         except Exception as e:
             raise Exception("can not load file") from e
 
         self.resume = resume
         self.bin_path = f"{Path(txt_name).parent}/.{Path(txt_name).stem}.temp.bin"
+        self.journal = SegmentStore(self.bin_path)
         if self.resume:
             self.load_state()
 
+    @staticmethod
+    def _read_lines(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def update_from(self, old_source, old_translations):
+        """Reuse the translations of a previous edition, see `match_segments`."""
+        try:
+            old_segments = self._segments(self._read_lines(old_source))
+        except Exception as e:
+            raise Exception("can not load file") from e
+        reused = match_segments(
+            old_segments,
+            self._segments(self._read_lines(self.txt_name)),
+            old_translations,
+        )
+        self.translations.update(reused)
+        print(f"♻️  Reusing {len(reused)} translations of {old_source}")
+
+    def _segments(self, lines):
+        return [(key, text_hash(text)) for key, text in self._batches(lines)]
+
+    def _batches(self, lines):
+        """``(key, text)`` of the batches of the book, one at a time.
+
+        A batch is `batch_size` lines, or with `batch_tokens` whole paragraphs
+        packed up to that many tokens and at most `batch_size` lines.
+        """
+        if self.batch_tokens:
+            batches = pack_batches(
+                self._units(lines), self.batch_tokens, self.batch_size
+            )
+        else:
+            lines = iter(lines)
+            batches = iter(lambda: list(islice(lines, self.batch_size)), [])
+        for ordinal, batch in enumerate(batches):
+            # fix the format thanks https://github.com/tudoujunha
+            batch_text = "\n".join(batch)
+            yield segment_key(ordinal, batch_text), batch_text
+
+    def _test_batches(self, batches):
+        """The batches of `--test`, until they hold more than `test_num` lines.
+
+        Lines rather than batches, with `batch_tokens` a batch can be the book.
+        """
+        lines = 0
+        for key, batch_text in batches:
+            yield key, batch_text
+            lines += batch_text.count("\n") + 1
+            if lines > self.test_num:
+                return
+
+    @staticmethod
+    def _paragraphs(lines):
+        """Runs of lines up to the next blank-line paragraph break, blank lines included."""
+        paragraph = []
+        for line in lines:
+            if line.strip() and paragraph and not paragraph[-1].strip():
+                yield paragraph
+                paragraph = []
+            paragraph.append(line)
+        if paragraph:
+            yield paragraph
+
+    def _units(self, lines):
+        """``(lines, tokens)`` of the paragraphs, counted a window at a time.
+
+        A paragraph over the token budget or the line cap is cut into its lines.
+        """
+        paragraphs = self._paragraphs(lines)
+        while window := list(islice(paragraphs, TOKEN_WINDOW)):
+            costs = count_tokens(["\n".join(paragraph) for paragraph in window])
+            for paragraph, cost in zip(window, costs):
+                if len(paragraph) > 1 and (
+                    cost > self.batch_tokens or len(paragraph) > self.batch_size
+                ):
+                    yield from zip(
+                        ([line] for line in paragraph), count_tokens(paragraph)
+                    )
+                else:
+                    yield paragraph, cost
+
+    def plan_segments(self):
+        """``(key, text)`` of everything a run would send to the translator."""
+        return [
+            (key, text)
+            for key, text in self._batches(self._read_lines(self.txt_name))
+            if not self._is_special_text(text)
+            and key not in self.translations
+            and key not in self.p_to_save
+        ]
+
+    def use_alignment(self, translations):
+        super().use_alignment(translations)
+        # the resume journal of the book is left alone
+        self.rendering = True
+
     @staticmethod
     def _is_special_text(text):
         return text.isdigit() or text.isspace() or len(text) == 0
@@ -63,37 +176,64 @@ class TXTBookLoader(BaseBookLoader):
         pass
 
     def make_bilingual_book(self):
-        index = 0
-        p_to_save_len = len(self.p_to_save)
+        """Translate the book batch by batch, in constant memory.
 
-        try:
-            sliced_list = [
-                self.origin_book[i : i + self.batch_size]
-                for i in range(0, len(self.origin_book), self.batch_size)
-            ]
-            for i in sliced_list:
-                # fix the format thanks https://github.com/tudoujunha
-                batch_text = "\n".join(i)
-                if self._is_special_text(batch_text):
-                    continue
-                if not self.resume or index >= p_to_save_len:
+        The output is written to `*_bilingual_temp.txt` as the batches are
+        translated, then renamed to `*_bilingual.txt`; the translations go to
+        the resume journal and the alignment sidecar as they come. With
+        several `parallel_workers`, that many batches are translated at the
+        same time and written in their order.
+        """
+        name = f"{Path(self.txt_name).parent}/{Path(self.txt_name).stem}_bilingual{self.output_suffix}"
+        output_name = f"{name}.txt"
+        alignment = ProgressJournal(alignment_path(output_name))
+        pool = None
+        if self.parallel_workers > 1:
+            pool = TranslatorPool(
+                self.translate_model, RateLimiter.per_minute(self.requests_per_minute)
+            )
+        batches = (
+            (key, batch_text)
+            for key, batch_text in self._batches(self._read_lines(self.txt_name))
+            if not self._is_special_text(batch_text)
+        )
+        if self.is_test:
+            batches = self._test_batches(batches)
+
+        def translate(batch):
+            key, batch_text = batch
+            temp = self.p_to_save.get(key)
+            if temp is None:
+                # reused: unchanged since the previous edition, see `update_from`
+                temp = self.translations.get(key)
+                if temp is None:
+                    translator = self.translate_model if pool is None else pool.get()
                     try:
-                        temp = self.translate_model.translate(batch_text)
+                        temp = translator.translate(batch_text)
                     except Exception as e:
                         print(e)
                         raise Exception("Something is wrong when translate") from e
-                    self.p_to_save.append(temp)
+                # saved as soon as it is done, whatever the order it is written in
+                if not self.rendering:
+                    self.journal.append(key, temp)
+            return key, batch_text, temp
+
+        try:
+            with open(f"{name}_temp.txt", "w", encoding="utf-8") as out:
+                separator = ""
+
+                def write(result):
+                    nonlocal separator
+                    key, batch_text, temp = result
+                    alignment.append(key, temp)
                     if not self.single_translate:
-                        self.bilingual_result.append(batch_text)
-                    self.bilingual_result.append(temp)
-                index += self.batch_size
-                if self.is_test and index > self.test_num:
-                    break
-
-            self.save_file(
-                f"{Path(self.txt_name).parent}/{Path(self.txt_name).stem}_bilingual.txt",
-                self.bilingual_result,
-            )
+                        out.write(separator + batch_text)
+                        separator = "\n"
+                    out.write(separator + temp)
+                    separator = "\n"
+
+                map_in_order(translate, batches, write, self.parallel_workers)
+            os.replace(f"{name}_temp.txt", output_name)
 
         except (KeyboardInterrupt, Exception) as e:
             print(e)
@@ -101,45 +241,22 @@ class TXTBookLoader(BaseBookLoader):
             self._save_progress()
             self._save_temp_book()
             sys.exit(0)
+        finally:
+            alignment.close()
+            self.journal.close()
 
     def _save_temp_book(self):
-        index = 0
-        sliced_list = [
-            self.origin_book[i : i + self.batch_size]
-            for i in range(0, len(self.origin_book), self.batch_size)
-        ]
-
-        for i in range(len(sliced_list)):
-            batch_text = "".join(sliced_list[i])
-            self.bilingual_temp_result.append(batch_text)
-            if self._is_special_text(self.origin_book[i]):
-                continue
-            if index < len(self.p_to_save):
-                self.bilingual_temp_result.append(self.p_to_save[index])
-            index += 1
-
-        self.save_file(
-            f"{Path(self.txt_name).parent}/{Path(self.txt_name).stem}_bilingual_temp.txt",
-            self.bilingual_temp_result,
-        )
+        # `*_bilingual_temp.txt` is written as the translation goes
+        pass
 
     def _save_progress(self):
         try:
-            with open(self.bin_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(self.p_to_save))
+            self.journal.sync()
         except Exception as e:
             raise Exception("can not save resume file") from e
 
     def load_state(self):
         try:
-            with open(self.bin_path, encoding="utf-8") as f:
-                self.p_to_save = f.read().splitlines()
+            self.p_to_save = self.journal.load()
         except Exception as e:
             raise Exception("can not load resume file") from e
-
-    def save_file(self, book_path, content):
-        try:
-            with open(book_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(content))
-        except Exception as e:
-            raise Exception("can not save file") from e
@@ -1,4 +1,5 @@
 import itertools
+from copy import copy
 from abc import ABC, abstractmethod
 
 
@@ -6,6 +7,9 @@ class Base(ABC):
     def __init__(self, key, language) -> None:
         self.keys = itertools.cycle(key.split(","))
         self.language = language
+        # (source, translation) examples the next request is sent with, e.g. a
+        # close match from the translation memory; ignored by most translators
+        self.examples = []
 
     @abstractmethod
     def rotate_key(self):
@@ -17,3 +21,15 @@ class Base(ABC):
 
     def set_deployment_id(self, deployment_id):
         pass
+
+    def clone(self):
+        """Return a copy of the translator for another worker.
+
+        The copy keeps the configuration and shares the API clients, but starts
+        a conversation of its own, without the context of the previous paragraphs.
+        """
+        translator = copy(self)
+        for name in ("context_list", "context_translated_list", "examples"):
+            if hasattr(self, name):
+                setattr(translator, name, [])
+        return translator
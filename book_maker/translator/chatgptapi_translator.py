@@ -147,6 +147,16 @@ class ChatGPTAPI(Base):
 
     def create_context_messages(self):
         messages = []
+        for source, translation in self.examples:
+            messages.append(
+                {
+                    "role": "user",
+                    "content": self.prompt_template.format(
+                        text=source, language=self.language, crlf="\n"
+                    ),
+                }
+            )
+            messages.append({"role": "assistant", "content": translation})
         if self.context_flag:
             messages.append({"role": "user", "content": "\n".join(self.context_list)})
             messages.append(
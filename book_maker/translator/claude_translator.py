@@ -59,11 +59,23 @@ class Claude(Base):
 
     def create_context_messages(self):
         """Create a message pair containing all context paragraphs"""
+        # a message pair for each example, e.g. from the translation memory
+        examples = []
+        for source, translation in self.examples:
+            examples.append(
+                {
+                    "role": "user",
+                    "content": self.prompt_template.format(
+                        text=source, language=self.language
+                    ),
+                }
+            )
+            examples.append({"role": "assistant", "content": translation})
         if not self.context_flag or not self.context_list:
-            return []
+            return examples
 
         # Create a single message pair for all previous context
-        return [
+        return examples + [
             {
                 "role": "user",
                 "content": self.prompt_template.format(
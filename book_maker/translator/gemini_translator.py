@@ -91,6 +91,13 @@ class Gemini(Base):
         self.convo = model.start_chat()
         # print(model)  # Uncomment to debug and inspect the model details.
 
+    def clone(self):
+        translator = super().clone()
+        if hasattr(self, "convo"):
+            # the chat session keeps the history, each copy needs its own
+            translator.create_convo()
+        return translator
+
     def rotate_model(self):
         self.model = next(self.model_list)
         self.create_convo()
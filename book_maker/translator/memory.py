@@ -0,0 +1,249 @@
+import math
+import re
+import threading
+from collections import namedtuple
+
+from book_maker.loader.journal import ProgressJournal
+from book_maker.translator.pool import clone_translator
+
+# numbers and placeholders, the parts of a segment a translation can carry over
+_TOKEN_PATTERN = re.compile(r"\{[^{}]*\}|%[sd]|<[^<>]+>|\d+(?:[.,]\d+)*")
+_SPACE_PATTERN = re.compile(r"\s+")
+# the candidates of a lookup that are compared with the text, most shared grams first
+_MAX_CANDIDATES = 20
+
+Match = namedtuple("Match", ["similarity", "source", "translation"])
+
+
+def segment_shape(text):
+    """`text` with its numbers and placeholders blanked out, spaces collapsed."""
+    shape = _TOKEN_PATTERN.sub("\0", text)
+    return _SPACE_PATTERN.sub(" ", shape).strip()
+
+
+def ngrams(shape, n=5):
+    # case only matters to exact matches, not to finding the close ones
+    shape = shape.lower()
+    if len(shape) <= n:
+        return {shape}
+    return {shape[i : i + n] for i in range(len(shape) - n + 1)}
+
+
+def carry_over(source, translation, text):
+    """The translation of `text` from the one of `source`, or None.
+
+    `source` and `text` have the same shape; each number or placeholder of
+    `source` is replaced in `translation` by the one at the same place in
+    `text`. None when a changed token can't be found in the translation, or one
+    token of `source` is two different ones in `text`.
+    """
+    old_tokens = _TOKEN_PATTERN.findall(source)
+    new_tokens = _TOKEN_PATTERN.findall(text)
+    if len(old_tokens) != len(new_tokens):
+        return None
+    mapping = {}
+    for old, new in zip(old_tokens, new_tokens):
+        if mapping.setdefault(old, new) != new:
+            return None
+    found = set(_TOKEN_PATTERN.findall(translation))
+    if any(old != new and old not in found for old, new in mapping.items()):
+        return None
+    return _TOKEN_PATTERN.sub(lambda m: mapping.get(m.group(), m.group()), translation)
+
+
+class _NgramIndex:
+    """Inverted index from the character n-grams of the shapes to the segments."""
+
+    def __init__(self):
+        self.sources = []
+        self.translations = []
+        self.sizes = []
+        self.postings = {}
+        # shape -> segment, for the segments that only differ by their tokens;
+        # the case is kept, a heading and the same words in a sentence differ
+        self.shapes = {}
+
+    def add(self, source, translation):
+        shape = segment_shape(source)
+        grams = ngrams(shape)
+        segment = len(self.sources)
+        self.sources.append(source)
+        self.translations.append(translation)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(segment)
+        self.shapes[shape] = segment
+
+    def lookup(self, text, threshold):
+        shape = segment_shape(text)
+        segment = self.shapes.get(shape)
+        if segment is not None:
+            return Match(1.0, self.sources[segment], self.translations[segment])
+        grams = ngrams(shape)
+        # a segment with a Jaccard similarity >= threshold shares at least
+        # ceil(threshold * len(grams)) grams with the text, so it misses at
+        # most `misses` of them: it is in the postings of more than `misses`
+        # of any 2 * misses + 1 grams. Probe the rarest ones.
+        misses = len(grams) - math.ceil(threshold * len(grams))
+        probes = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+        low, high = threshold * len(grams), len(grams) / threshold
+        counts = {}
+        for gram in probes[: 2 * misses + 1]:
+            for segment in self.postings.get(gram, ()):
+                counts[segment] = counts.get(segment, 0) + 1
+        candidates = [
+            segment
+            for segment, count in counts.items()
+            if count > misses and low <= self.sizes[segment] <= high
+        ]
+        candidates = sorted(candidates, key=counts.get, reverse=True)
+        best = None
+        for segment in candidates[:_MAX_CANDIDATES]:
+            other = ngrams(segment_shape(self.sources[segment]))
+            similarity = len(grams & other) / len(grams | other)
+            if similarity >= threshold and (best is None or similarity > best[0]):
+                best = (similarity, segment)
+        if best is None:
+            return None
+        similarity, segment = best
+        return Match(similarity, self.sources[segment], self.translations[segment])
+
+
+class TranslationMemory:
+    """Translations of earlier segments, found again for similar segments.
+
+    Segments are indexed per target language by the lowercased character
+    5-grams of their shape, the text without its numbers and placeholders. A lookup only
+    reads the postings of the rarest 5-grams of the text, so its cost depends
+    on how common the text is rather than on the size of the memory. With a
+    `path` every new translation is appended there, in the record format of
+    the resume journal, and the memory is loaded from it again next time.
+    """
+
+    def __init__(self, path=None, threshold=0.8):
+        self.threshold = threshold
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._journal = None
+        if path is not None:
+            self._journal = ProgressJournal(path)
+            try:
+                entries = self._journal.load()
+            except FileNotFoundError:
+                entries = {}
+            except ValueError as e:
+                raise Exception(f"{path} is not a translation memory") from e
+            for key, translation in entries.items():
+                language, _, source = key.partition("\0")
+                self._index(language).add(source, translation)
+
+    def _index(self, language):
+        if language not in self._indexes:
+            self._indexes[language] = _NgramIndex()
+        return self._indexes[language]
+
+    def __len__(self):
+        return sum(len(index.sources) for index in self._indexes.values())
+
+    def lookup(self, language, text):
+        """The closest stored segment of `text`, a `Match` or None."""
+        with self._lock:
+            index = self._indexes.get(language)
+            if index is None:
+                return None
+            return index.lookup(text, self.threshold)
+
+    def add(self, language, source, translation):
+        if not translation:
+            return
+        with self._lock:
+            self._index(language).add(source, translation)
+            if self._journal is not None:
+                self._journal.append(f"{language}\0{source}", translation)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+
+
+class MemoryTranslator:
+    """Translator that asks a `TranslationMemory` before its own translator.
+
+    A segment that only differs from a stored one by numbers or placeholders
+    gets the stored translation with them replaced, without any request. A
+    segment above the similarity threshold of the memory is sent with the
+    close match as an example, see `Base.examples`. Everything else goes to
+    the wrapped translator as it is.
+    """
+
+    def __init__(self, translator, memory):
+        object.__setattr__(self, "translator", translator)
+        object.__setattr__(self, "memory", memory)
+
+    def __getattr__(self, name):
+        return getattr(self.translator, name)
+
+    def __setattr__(self, name, value):
+        # `translate` is wrapped by `TranslatorPool`, the rest is configuration
+        if name == "translate" or name in self.__dict__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.translator, name, value)
+
+    def clone(self):
+        return MemoryTranslator(clone_translator(self.translator), self.memory)
+
+    def _reuse(self, language, text):
+        """``(translation, match)``, the translation when no request is needed."""
+        match = self.memory.lookup(language, text)
+        if match is not None and segment_shape(match.source) == segment_shape(text):
+            translation = carry_over(match.source, match.translation, text)
+            if translation is not None:
+                return translation, match
+        return None, match
+
+    def _send(self, matches, send):
+        examples = [(m.source, m.translation) for m in matches if m is not None]
+        if examples and hasattr(self.translator, "examples"):
+            self.translator.examples = examples
+        try:
+            return send()
+        finally:
+            if examples and hasattr(self.translator, "examples"):
+                self.translator.examples = []
+
+    def translate(self, text, *args, **kwargs):
+        language = getattr(self.translator, "language", "")
+        translation, match = self._reuse(language, text)
+        if translation is not None:
+            return translation
+        translation = self._send(
+            [match], lambda: self.translator.translate(text, *args, **kwargs)
+        )
+        self.memory.add(language, text, translation)
+        return translation
+
+    def translate_list(self, plist):
+        """`translate` for the paragraphs of `--accumulated_num`, in one request.
+
+        Only the paragraphs the memory can't reuse are sent, with the close
+        matches of all of them as examples.
+        """
+        language = getattr(self.translator, "language", "")
+        translations = []
+        matches = []
+        missing = []
+        for p in plist:
+            translation, match = self._reuse(language, p.text)
+            translations.append(translation)
+            if translation is None:
+                matches.append(match)
+                missing.append(p)
+        if missing:
+            sent = self._send(matches, lambda: self.translator.translate_list(missing))
+            sent = iter(sent)
+            for i, p in enumerate(plist):
+                if translations[i] is None:
+                    translations[i] = next(sent, "")
+                    self.memory.add(language, p.text, translations[i])
+        return translations
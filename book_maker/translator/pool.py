@@ -0,0 +1,116 @@
+import threading
+import time
+from concurrent.futures import Future
+from copy import copy
+
+
+def clone_translator(translator):
+    """A copy of `translator` that shares none of its mutable state."""
+    clone = getattr(translator, "clone", None)
+    return clone() if clone is not None else copy(translator)
+
+
+class RateLimiter:
+    """Spaces out the requests of every translator that shares it.
+
+    `interval` is the minimum number of seconds between the start of two
+    requests, 0 does not limit anything.
+    """
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    @classmethod
+    def per_minute(cls, requests_per_minute):
+        return cls(60 / requests_per_minute if requests_per_minute > 0 else 0)
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class TranslatorPool:
+    """One translator per worker thread, cloned from a configured prototype.
+
+    Translators keep mutable state between calls (the context of the previous
+    paragraphs, the prompt, a chat session), so workers must not share one.
+    Every clone goes through the same `rate_limiter` and reads and fills the
+    same `cache` of translations; the cache is only used by translators that
+    don't send a context, whose result depends on the text alone. A text asked
+    for by several workers at once is sent by the first one, the others wait
+    for its result.
+    """
+
+    def __init__(self, prototype, rate_limiter=None, cache=None):
+        self.prototype = prototype
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.cache = {} if cache is None else cache
+        self.translators = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # key -> Future of the texts being translated, each is sent only once
+        self._pending = {}
+
+    def get(self):
+        """Return the translator of the calling thread, created on first use."""
+        translator = getattr(self._local, "translator", None)
+        if translator is None:
+            translator = self._clone()
+            self._local.translator = translator
+            with self._lock:
+                self.translators.append(translator)
+        return translator
+
+    def _clone(self):
+        translator = clone_translator(self.prototype)
+        translator.translate = self._pooled(translator, translator.translate)
+        return translator
+
+    def _pooled(self, translator, translate):
+        def pooled_translate(text, *args, **kwargs):
+            use_cache = not getattr(translator, "context_flag", False)
+            # the prompt is part of the key, `translate_list` swaps it
+            key = (getattr(translator, "prompt_template", None), text)
+            if not use_cache:
+                self.rate_limiter.wait()
+                return translate(text, *args, **kwargs)
+            with self._lock:
+                if key in self.cache:
+                    return self.cache[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = Future()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                # another worker is translating the same text, wait for it
+                try:
+                    return pending.result()
+                except Exception:
+                    # its request failed, try again with this worker
+                    return pooled_translate(text, *args, **kwargs)
+            try:
+                self.rate_limiter.wait()
+                result = translate(text, *args, **kwargs)
+            except BaseException as e:
+                with self._lock:
+                    del self._pending[key]
+                pending.set_exception(e)
+                raise
+            with self._lock:
+                if result:
+                    self.cache[key] = result
+                del self._pending[key]
+            pending.set_result(result)
+            return result
+
+        return pooled_translate
@@ -0,0 +1,22 @@
+class DummyModel:
+    """Translator of the tests, it marks the text instead of sending it anywhere."""
+
+    def __init__(
+        self,
+        key,
+        language,
+        api_base=None,
+        context_flag=False,
+        context_paragraph_limit=0,
+        temperature=1.0,
+        source_lang="auto",
+        **kwargs,
+    ):
+        self.context_flag = context_flag
+        self.context_paragraph_limit = context_paragraph_limit
+
+    def translate(self, text, *args, **kwargs):
+        return f"<T>{text}"
+
+    def translate_list(self, plist):
+        return [f"<T>{p.text}" for p in plist]
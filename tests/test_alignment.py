@@ -0,0 +1,194 @@
+import shutil
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+from ebooklib import epub
+
+from book_maker import cli
+from book_maker.loader.alignment import AlignmentModel, load_alignment
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.txt_loader import TXTBookLoader
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def _render(loader_class, book_path, **attrs):
+    loader = loader_class(str(book_path), AlignmentModel, "", False, "zh")
+    for name, value in attrs.items():
+        setattr(loader, name, value)
+    sidecar = book_path.with_name(f"{book_path.stem}_bilingual.align")
+    loader.use_alignment(load_alignment(str(sidecar)))
+    loader.make_bilingual_book()
+    return loader
+
+
+def test_render_epub_from_the_sidecar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    output = tmp_path / "animal_farm_bilingual.epub"
+    EPUBBookLoader(str(book_path), DummyModel, "", False, "zh").make_bilingual_book()
+    translated = output.read_bytes()
+    journal = (tmp_path / ".animal_farm.temp.bin").read_bytes()
+
+    loader = _render(EPUBBookLoader, book_path)
+    assert loader.translate_model.missing == 0
+    assert output.read_bytes() == translated
+
+    loader = _render(EPUBBookLoader, book_path, single_translate=True)
+    assert loader.translate_model.missing == 0
+    chapter = epub.read_epub(str(output)).get_item_with_href("index_split_002.html")
+    assert b"&lt;T&gt;" in chapter.content
+    assert b">Any fairminded person" not in chapter.content
+    # the resume state of the book is not touched
+    assert (tmp_path / ".animal_farm.temp.bin").read_bytes() == journal
+
+
+def test_render_txt_from_the_sidecar(tmp_path):
+    book_path = tmp_path / "book.txt"
+    book_path.write_text("first line\nsecond line\n\nthird line\n", encoding="utf-8")
+    output = tmp_path / "book_bilingual.txt"
+    loader = TXTBookLoader(str(book_path), DummyModel, "", False, "zh")
+    loader.batch_size = 2
+    loader.make_bilingual_book()
+    assert output.read_text(encoding="utf-8").count("<T>") == 2
+
+    loader = _render(TXTBookLoader, book_path, batch_size=2, single_translate=True)
+    assert loader.translate_model.missing == 0
+    assert output.read_text(encoding="utf-8") == (
+        "<T>first line\nsecond line\n<T>\nthird line"
+    )
+
+
+@pytest.mark.parametrize(
+    "before, after",
+    [
+        ([], ["--book_name", "{book}", "--single_translate"]),
+        # options before the command are kept, not reset by its defaults
+        (["--single_translate"], ["--book_name", "{book}"]),
+        (["--book_name", "{book}", "--single_translate"], []),
+    ],
+)
+def test_render_subcommand_for_srt(tmp_path, monkeypatch, before, after):
+    book_path = tmp_path / "episode.srt"
+    shutil.copyfile(TEST_BOOKS / "Lex_Fridman_episode_322.srt", book_path)
+    output = tmp_path / "episode_bilingual.srt"
+    loader = cli.BOOK_LOADER_DICT["srt"](str(book_path), DummyModel, "", False, "zh")
+    loader.make_bilingual_book()
+    translated = output.read_text(encoding="utf-8")
+
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            arg.format(book=book_path)
+            for arg in ["bbook_maker", *before, "render", *after]
+        ],
+    )
+    cli.main()
+
+    rendered = output.read_text(encoding="utf-8")
+    assert rendered != translated
+    assert rendered.count("<T>") == translated.count("<T>")
+
+
+class CountingModel(DummyModel):
+    texts = []
+
+    def translate(self, text, *args, **kwargs):
+        CountingModel.texts.append(text)
+        return super().translate(text)
+
+
+def test_update_from_translates_only_the_edited_paragraphs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", old_path)
+    EPUBBookLoader(str(old_path), DummyModel, "", False, "zh").make_bilingual_book()
+
+    # the new edition has one edited paragraph
+    new_path = tmp_path / "animal_farm_v2.epub"
+    with (
+        zipfile.ZipFile(old_path) as src,
+        zipfile.ZipFile(new_path, "w") as dst,
+    ):
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename.endswith("index_split_002.html"):
+                assert b"Any fairminded person" in data
+                data = data.replace(b"Any fairminded person", b"Any fair-minded reader")
+            dst.writestr(info, data)
+
+    CountingModel.texts = []
+    loader = EPUBBookLoader(str(new_path), CountingModel, "", False, "zh")
+    loader.update_from(
+        str(old_path), load_alignment(str(tmp_path / "animal_farm_bilingual.align"))
+    )
+    loader.make_bilingual_book()
+
+    assert len(CountingModel.texts) == 1
+    assert "Any fair-minded reader" in CountingModel.texts[0]
+    chapter = epub.read_epub(str(tmp_path / "animal_farm_v2_bilingual.epub"))
+    content = chapter.get_item_with_href("index_split_002.html").content
+    assert b"&lt;T&gt;Any fair-minded reader" in content
+
+
+def test_update_from_txt(tmp_path):
+    old_path = tmp_path / "book.txt"
+    old_path.write_text("one\ntwo\nthree\nfour\n", encoding="utf-8")
+    loader = TXTBookLoader(str(old_path), DummyModel, "", False, "zh")
+    loader.batch_size = 1
+    loader.make_bilingual_book()
+
+    new_path = tmp_path / "book_v2.txt"
+    new_path.write_text("zero\none\ntwo\nthree!\nfour\n", encoding="utf-8")
+    CountingModel.texts = []
+    loader = TXTBookLoader(str(new_path), CountingModel, "", False, "zh")
+    loader.batch_size = 1
+    loader.update_from(
+        str(old_path), load_alignment(str(tmp_path / "book_bilingual.align"))
+    )
+    loader.make_bilingual_book()
+
+    assert CountingModel.texts == ["zero", "three!"]
+    assert (tmp_path / "book_v2_bilingual.txt").read_text(encoding="utf-8").count(
+        "<T>"
+    ) == 5
+
+
+class FlakyModel(DummyModel):
+    fail = False
+
+    def translate(self, text, *args, **kwargs):
+        if FlakyModel.fail and not text.startswith("1\n"):
+            raise RuntimeError("rate limited")
+        number, _, line = text.partition("\n")
+        return f"{number}\n<T>{line}"
+
+
+def test_render_after_resumed_srt(tmp_path, monkeypatch):
+    book_path = tmp_path / "episode.srt"
+    book_path.write_text(
+        "1\n00:00:01,000 --> 00:00:02,000\nhello\n\n"
+        "2\n00:00:03,000 --> 00:00:04,000\nworld\n",
+        encoding="utf-8",
+    )
+    output = tmp_path / "episode_bilingual.srt"
+    srt_loader = cli.BOOK_LOADER_DICT["srt"]
+    FlakyModel.fail = True
+    with pytest.raises(SystemExit):
+        srt_loader(str(book_path), FlakyModel, "", False, "zh").make_bilingual_book()
+    FlakyModel.fail = False
+    srt_loader(str(book_path), FlakyModel, "", True, "zh").make_bilingual_book()
+    translated = output.read_text(encoding="utf-8")
+
+    # the slice resumed from the first run is in the sidecar too
+    monkeypatch.setattr(
+        sys, "argv", ["bbook_maker", "render", "--book_name", str(book_path)]
+    )
+    cli.main()
+    assert output.read_text(encoding="utf-8") == translated
+    assert translated.count("<T>") == 2
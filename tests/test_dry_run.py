@@ -0,0 +1,64 @@
+import shutil
+import sys
+from pathlib import Path
+
+from book_maker import cli
+from book_maker.loader.dry_run import estimate_run
+from book_maker.loader.epub_loader import EPUBBookLoader
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def test_estimate_is_bound_by_the_slowest_limit():
+    requests = ["one two three"] * 60
+    estimate = estimate_run(requests, "gpt4omini", ["japanese", "french"], workers=4)
+    assert estimate.requests == 120
+    assert estimate.languages["japanese"][1] > estimate.languages["french"][1]
+    assert estimate.cost > 0
+    assert estimate.bound == "workers"
+
+    estimate = estimate_run(requests, "unknown", ["french"], requests_per_minute=6)
+    assert estimate.cost is None
+    assert estimate.bound == "requests per minute"
+    assert estimate.makespan == 600
+
+
+def test_plan_follows_the_skip_options(tmp_path):
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    loader = EPUBBookLoader(str(book_path), DummyModel, "", False, "zh")
+    paragraphs = loader.plan_requests()
+
+    loader.exclude_filelist = "index_split_002.html"
+    assert 0 < len(loader.plan_requests()) < len(paragraphs)
+
+    loader.exclude_filelist = ""
+    loader.accumulated_num = 800
+    grouped = loader.plan_requests()
+    assert len(grouped) < len(paragraphs)
+
+
+def test_dry_run_sends_nothing(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("BBM_OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "bbook_maker",
+            "--book_name",
+            str(book_path),
+            "--model",
+            "gpt4omini",
+            "--dry-run",
+        ],
+    )
+    cli.main()
+
+    out = capsys.readouterr().out
+    assert "requests:" in out and "cost:          $" in out
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["animal_farm.epub"]
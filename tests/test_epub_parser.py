@@ -0,0 +1,79 @@
+import zipfile
+
+import pytest
+from ebooklib import epub
+
+from book_maker.loader.epub_loader import EPUBBookLoader
+from tests.helpers import DummyModel
+
+COVER = (
+    b'<?xml version="1.0" encoding="utf-8"?>\n'
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Cover</title></head>'
+    b'<body><h1>Animal Farm</h1><img src="cover.png" alt=""/></body></html>'
+)
+CHAPTER = (
+    b'<?xml version="1.0" encoding="utf-8"?>\n'
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>I</title></head>'
+    b"<body><p>Mr. Jones, of the Manor Farm,<br/>had locked the hen-houses.</p>"
+    b"<p>As soon as the light in the bedroom went out.</p></body></html>"
+)
+
+
+def _write_book(path):
+    book = epub.EpubBook()
+    book.set_identifier("parser-test")
+    book.set_title("Parser")
+    chapters = []
+    for name, content in (("cover.xhtml", COVER), ("c1.xhtml", CHAPTER)):
+        chapter = epub.EpubHtml(title=name, file_name=name)
+        chapter.content = content
+        book.add_item(chapter)
+        chapters.append(chapter)
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.toc = chapters
+    book.spine = ["nav"] + chapters
+    epub.write_epub(str(path), book)
+
+
+def _translate(tmp_path, parser, **kwargs):
+    book_path = tmp_path / "book.epub"
+    _write_book(book_path)
+    loader = EPUBBookLoader(str(book_path), DummyModel, "", False, "zh", **kwargs)
+    loader.set_parser(parser)
+    loader.make_bilingual_book()
+    return book_path, tmp_path / "book_bilingual.epub"
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "lxml-xml"])
+def test_each_parser_writes_well_formed_chapters(tmp_path, monkeypatch, parser):
+    etree = pytest.importorskip("lxml.etree")
+    monkeypatch.chdir(tmp_path)
+    _, out_path = _translate(tmp_path, parser)
+
+    with zipfile.ZipFile(out_path) as zf:
+        chapter = zf.read("EPUB/c1.xhtml")
+    # the XML declaration stays a declaration, lxml reads it as a comment
+    assert chapter.startswith(b"<?xml ")
+    root = etree.fromstring(chapter)
+    body = root.find("{http://www.w3.org/1999/xhtml}body")
+    texts = ["".join(p.itertext()) for p in body]
+    assert texts == [
+        "Mr. Jones, of the Manor Farm,had locked the hen-houses.",
+        "<T>Mr. Jones, of the Manor Farm,had locked the hen-houses.",
+        "As soon as the light in the bedroom went out.",
+        "<T>As soon as the light in the bedroom went out.",
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "lxml-xml"])
+def test_chapter_without_paragraphs_is_copied_byte_for_byte(
+    tmp_path, monkeypatch, parser, workers
+):
+    pytest.importorskip("lxml")
+    monkeypatch.chdir(tmp_path)
+    book_path, out_path = _translate(tmp_path, parser, parallel_workers=workers)
+
+    with zipfile.ZipFile(book_path) as src, zipfile.ZipFile(out_path) as out:
+        assert out.read("EPUB/cover.xhtml") == src.read("EPUB/cover.xhtml")
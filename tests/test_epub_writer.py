@@ -0,0 +1,183 @@
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+from ebooklib import ITEM_DOCUMENT, epub
+
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.epub_writer import StreamingEpubWriter, read_epub_lazily
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def _make_book():
+    book = epub.EpubBook()
+    book.set_identifier("streaming-test")
+    book.set_title("Streaming")
+    chapters = []
+    for i in range(3):
+        chapter = epub.EpubHtml(title=f"c{i}", file_name=f"c{i}.xhtml")
+        chapter.content = f"<html><body><p>chapter {i}</p></body></html>".encode()
+        chapters.append(chapter)
+    chapters[1].content = (
+        b'<html xmlns:epub="http://www.idpf.org/2007/ops"><body>'
+        b'<span epub:type="pagebreak" id="p1">1</span><p>chapter 1</p></body></html>'
+    )
+    image = epub.EpubImage(uid="img", file_name="img.png", media_type="image/png")
+    image.content = b"\x89PNG fake"
+    book.toc = chapters
+    book.spine = ["nav"] + chapters
+    return book, chapters, image
+
+
+def test_streaming_writer_writes_items_as_they_are_added(tmp_path):
+    book, chapters, image = _make_book()
+    out_path = tmp_path / "out.epub"
+
+    writer = StreamingEpubWriter(str(out_path), book).open()
+    writer.add_item(image)
+    writer.add_item(epub.EpubNcx())
+    writer.add_item(epub.EpubNav())
+    writer.add_item(chapters[0])
+    # written items do not keep their bytes around
+    assert chapters[0].content == b""
+    writer.close(remaining=chapters)
+
+    rebuilt = epub.read_epub(str(out_path))
+    names = sorted(i.file_name for i in rebuilt.get_items_of_type(ITEM_DOCUMENT))
+    assert names == ["c0.xhtml", "c1.xhtml", "c2.xhtml", "nav.xhtml"]
+    assert rebuilt.get_item_with_href("img.png").content == b"\x89PNG fake"
+    with zipfile.ZipFile(out_path) as zf:
+        assert zf.infolist()[0].filename == "mimetype"
+        assert zf.read("EPUB/c2.xhtml") == b"<html><body><p>chapter 2</p></body></html>"
+        # the page list survives even though chapter bytes are released early
+        assert b'href="c1.xhtml#p1"' in zf.read("EPUB/nav.xhtml")
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_epub_loader_streams_bilingual_book(tmp_path, monkeypatch, workers):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+
+    loader = EPUBBookLoader(
+        str(book_path), DummyModel, "", False, "zh", parallel_workers=workers
+    )
+    loader.make_bilingual_book()
+
+    out_path = tmp_path / "animal_farm_bilingual.epub"
+    origin = epub.read_epub(str(book_path))
+    rebuilt = epub.read_epub(str(out_path))
+    assert len(list(rebuilt.get_items())) == len(list(origin.get_items()))
+    chapter = rebuilt.get_item_with_href("index_split_002.html")
+    assert b"&lt;T&gt;" in chapter.content
+
+
+def test_epub_loader_translates_zip_with_zero_dates(tmp_path, monkeypatch):
+    # the entries of lemo.epub are dated (1980, 0, 0, 0, 0, 0)
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "lemo.epub"
+    shutil.copyfile(TEST_BOOKS / "lemo.epub", book_path)
+
+    loader = EPUBBookLoader(str(book_path), DummyModel, "", False, "zh")
+    loader.make_bilingual_book()
+
+    rebuilt = epub.read_epub(str(tmp_path / "lemo_bilingual.epub"))
+    assert any(
+        b"&lt;T&gt;" in item.content
+        for item in rebuilt.get_items_of_type(ITEM_DOCUMENT)
+    )
+
+
+def test_lazy_reader_passes_binary_items_through(tmp_path):
+    source_path = tmp_path / "source.epub"
+    book, chapters, image = _make_book()
+    for item in chapters + [image, epub.EpubNcx(), epub.EpubNav()]:
+        book.add_item(item)
+    epub.write_epub(str(source_path), book)
+
+    reader = read_epub_lazily(str(source_path))
+    lazy_image = reader.book.get_item_with_href("img.png")
+    assert lazy_image.content == b""
+    assert reader.book.get_item_with_href("c0.xhtml").content != b""
+
+    out_path = tmp_path / "out.epub"
+    writer = StreamingEpubWriter(str(out_path), epub.EpubBook(), source=reader)
+    writer.open().close(remaining=reader.book.get_items())
+
+    with zipfile.ZipFile(source_path) as src, zipfile.ZipFile(out_path) as out:
+        assert out.testzip() is None
+        src_info = src.getinfo("EPUB/img.png")
+        out_info = out.getinfo("EPUB/img.png")
+        assert out_info.compress_type == src_info.compress_type
+        assert out_info.compress_size == src_info.compress_size
+        assert out.read("EPUB/img.png") == b"\x89PNG fake"
+
+
+def test_streaming_writer_snapshot_is_a_complete_book(tmp_path):
+    book, chapters, image = _make_book()
+    writer = StreamingEpubWriter(str(tmp_path / "out.epub"), book).open()
+    for item in [image, epub.EpubNcx(), epub.EpubNav(), chapters[0]]:
+        writer.add_item(item)
+
+    snapshot_path = tmp_path / "snapshot.epub"
+    writer.snapshot(str(snapshot_path), remaining=chapters[1:])
+    # the remaining chapters are still there for the real output
+    assert chapters[1].content != b""
+    writer.close(remaining=chapters[1:])
+
+    snapshot = epub.read_epub(str(snapshot_path))
+    names = sorted(i.file_name for i in snapshot.get_items_of_type(ITEM_DOCUMENT))
+    assert names == ["c0.xhtml", "c1.xhtml", "c2.xhtml", "nav.xhtml"]
+    assert snapshot.get_item_with_href("img.png").content == b"\x89PNG fake"
+    assert snapshot.get_item_with_href("c0.xhtml").content == (
+        b"<html><body><p>chapter 0</p></body></html>"
+    )
+    with zipfile.ZipFile(tmp_path / "out.epub") as zf:
+        assert zf.testzip() is None
+
+
+class InterruptedModel(DummyModel):
+    def translate(self, text, *args, **kwargs):
+        if "Manor Farm" in text:
+            raise KeyboardInterrupt
+        return super().translate(text)
+
+
+def test_epub_loader_saves_temp_book_on_interrupt(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+
+    loader = EPUBBookLoader(str(book_path), InterruptedModel, "", False, "zh")
+    with pytest.raises(SystemExit):
+        loader.make_bilingual_book()
+
+    origin = epub.read_epub(str(book_path))
+    temp = epub.read_epub(str(tmp_path / "animal_farm_bilingual_temp.epub"))
+    assert len(list(temp.get_items())) == len(list(origin.get_items()))
+    assert b"&lt;T&gt;" in temp.get_item_with_href("index_split_000.html").content
+
+
+def test_process_workers_produce_the_same_chapters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outputs = []
+    for process_workers in (0, 2):
+        book_path = tmp_path / f"book{process_workers}" / "animal_farm.epub"
+        book_path.parent.mkdir()
+        shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+        loader = EPUBBookLoader(
+            str(book_path), DummyModel, "", False, "zh", parallel_workers=3
+        )
+        loader.allow_navigable_strings = True
+        loader.set_process_workers(process_workers)
+        loader.make_bilingual_book()
+        outputs.append(
+            epub.read_epub(str(book_path.with_name("animal_farm_bilingual.epub")))
+        )
+
+    threaded, offloaded = outputs
+    for item in threaded.get_items_of_type(ITEM_DOCUMENT):
+        assert offloaded.get_item_with_href(item.file_name).content == item.content
@@ -0,0 +1,239 @@
+import pickle
+import shutil
+from pathlib import Path
+
+import pytest
+from ebooklib import ITEM_DOCUMENT, epub
+
+import book_maker.loader.epub_loader
+import book_maker.utils
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.journal import ProgressJournal, SegmentStore
+from book_maker.loader.md_loader import MarkdownBookLoader
+from book_maker.loader.srt_loader import SRTBookLoader
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def test_journal_replays_last_record_of_each_key(tmp_path):
+    path = tmp_path / "progress.bin"
+    journal = ProgressJournal(str(path), sync_every=2)
+    journal.append(0, "zero")
+    journal.append(1, "one")
+    journal.append(1, "uno")
+    journal.close()
+
+    assert ProgressJournal(str(path)).load() == {"0": "zero", "1": "uno"}
+
+
+def test_journal_drops_torn_tail(tmp_path):
+    path = tmp_path / "progress.bin"
+    journal = ProgressJournal(str(path))
+    journal.append(0, "zero")
+    journal.append(1, "one")
+    journal.close()
+    # a crash in the middle of the last record
+    path.write_bytes(path.read_bytes()[:-2])
+
+    journal = ProgressJournal(str(path))
+    assert journal.load() == {"0": "zero"}
+    journal.append(1, "one")
+    journal.close()
+    assert ProgressJournal(str(path)).load() == {"0": "zero", "1": "one"}
+
+
+def test_journal_compacts_rewritten_keys(tmp_path):
+    path = tmp_path / "progress.bin"
+    journal = ProgressJournal(str(path), compact_min=10)
+    for i in range(30):
+        journal.append(i % 3, f"text {i}")
+    journal.close()
+
+    assert path.stat().st_size < 10 * 20
+    assert ProgressJournal(str(path)).load() == {
+        "0": "text 27",
+        "1": "text 28",
+        "2": "text 29",
+    }
+
+
+def test_segment_store_reads_translations_lazily(tmp_path):
+    path = tmp_path / "progress.bin"
+    store = SegmentStore(str(path))
+    store.append("0:a", "two\nlines")
+    store.append("1:b", "a === b")
+    assert store["0:a"] == "two\nlines"
+    store.close()
+    # a crash in the middle of the last record
+    path.write_bytes(path.read_bytes() + b"\x05\x00")
+
+    store = SegmentStore(str(path)).load()
+    assert len(store) == 2
+    assert store.get("1:b") == "a === b"
+    assert "2:c" not in store
+    store.append("2:c", "three")
+    assert store["2:c"] == "three"
+    store.close()
+    assert ProgressJournal(str(path)).load() == {
+        "0:a": "two\nlines",
+        "1:b": "a === b",
+        "2:c": "three",
+    }
+
+
+def test_segment_store_converts_legacy_text_files(tmp_path):
+    path = tmp_path / "progress.bin"
+    path.write_text("first===second", encoding="utf-8")
+    store = SegmentStore(str(path)).load(lambda text: text.split("==="))
+    assert store.get(0) == "first" and store.get(1) == "second"
+    store.close()
+    assert ProgressJournal(str(path)).load() == {"0": "first", "1": "second"}
+
+
+class SubtitleModel(DummyModel):
+    calls = []
+    fail = False
+
+    def translate(self, text, *args, **kwargs):
+        if SubtitleModel.fail and SubtitleModel.calls:
+            raise RuntimeError("rate limited")
+        SubtitleModel.calls.append(text)
+        # translations the old resume files could not split back
+        return f"{text} ===\nsecond line"
+
+
+def test_srt_loader_resumes_multiline_translations(tmp_path):
+    book_path = tmp_path / "episode.srt"
+    book_path.write_text(
+        "1\n00:00:01,000 --> 00:00:02,000\nhello\n\n"
+        "2\n00:00:03,000 --> 00:00:04,000\nworld\n",
+        encoding="utf-8",
+    )
+    SubtitleModel.calls = []
+    SubtitleModel.fail = True
+    with pytest.raises(SystemExit):
+        SRTBookLoader(
+            str(book_path), SubtitleModel, "", False, "zh"
+        ).make_bilingual_book()
+
+    SubtitleModel.calls = []
+    SubtitleModel.fail = False
+    SRTBookLoader(str(book_path), SubtitleModel, "", True, "zh").make_bilingual_book()
+    assert SubtitleModel.calls == ["2\nworld"]
+    output = (tmp_path / "episode_bilingual.srt").read_text(encoding="utf-8")
+    assert "hello\nhello ===\nsecond line" in output
+    assert "world\nworld ===\nsecond line" in output
+
+
+class CountingModel(DummyModel):
+    calls = 0
+
+    def translate(self, text, *args, **kwargs):
+        CountingModel.calls += 1
+        return super().translate(text)
+
+    def translate_list(self, plist):
+        CountingModel.calls += len(plist)
+        return super().translate_list(plist)
+
+
+def _translate(book_path, resume=False, **kwargs):
+    accumulated_num = kwargs.pop("accumulated_num", 1)
+    loader = EPUBBookLoader(str(book_path), CountingModel, "", resume, "zh", **kwargs)
+    loader.accumulated_num = accumulated_num
+    CountingModel.calls = 0
+    loader.make_bilingual_book()
+    output = book_path.with_name(f"{book_path.stem}_bilingual.epub")
+    return epub.read_epub(str(output)), CountingModel.calls
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ({"parallel_workers": 1}, {"parallel_workers": 3}),
+        ({"parallel_workers": 3}, {"parallel_workers": 1}),
+        ({"accumulated_num": 200}, {"parallel_workers": 3, "accumulated_num": 200}),
+        ({"parallel_workers": 3, "accumulated_num": 200}, {"accumulated_num": 200}),
+        ({"accumulated_num": 200}, {"accumulated_num": 50}),
+    ],
+)
+def test_epub_loader_resume_does_not_depend_on_scheduling(
+    tmp_path, monkeypatch, first, second
+):
+    monkeypatch.chdir(tmp_path)
+    # the tiktoken encoding is downloaded on first use, keep the test offline
+    for module in (book_maker.utils, book_maker.loader.epub_loader):
+        monkeypatch.setattr(module, "num_tokens_from_text", lambda t: len(t.split()))
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+
+    _, calls = _translate(book_path, **first)
+    assert calls > 0
+    rebuilt, calls = _translate(book_path, resume=True, **second)
+    assert calls == 0
+    chapter = rebuilt.get_item_with_href("index_split_002.html")
+    assert b"&lt;T&gt;" in chapter.content
+
+
+def test_epub_loader_resumes_from_legacy_pickle(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    bin_path = tmp_path / ".animal_farm.temp.bin"
+    with open(bin_path, "wb") as f:
+        pickle.dump(["first", "second"], f)
+
+    rebuilt, _ = _translate(book_path, resume=True)
+
+    content = b"".join(
+        item.content for item in rebuilt.get_items_of_type(ITEM_DOCUMENT)
+    )
+    assert b">first<" in content and b">second<" in content
+    # the resume file is converted to a keyed journal on the way
+    entries = ProgressJournal(str(bin_path)).load()
+    assert "first" in entries.values()
+    assert not any(key.isdigit() for key in entries)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_epub_loader_resume_reuses_finished_chapters(tmp_path, monkeypatch, workers):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    first, _ = _translate(book_path, parallel_workers=workers)
+
+    parsed = []
+    origin_bs = book_maker.loader.epub_loader.bs
+    monkeypatch.setattr(
+        book_maker.loader.epub_loader,
+        "bs",
+        lambda *args: parsed.append(args) or origin_bs(*args),
+    )
+    resumed, calls = _translate(book_path, resume=True, parallel_workers=workers)
+
+    # every chapter comes from its checkpoint, none is parsed again
+    assert calls == 0
+    assert parsed == []
+    for item in first.get_items_of_type(ITEM_DOCUMENT):
+        assert resumed.get_item_with_href(item.file_name).content == item.content
+
+
+def test_legacy_text_resume_files_are_refused(tmp_path):
+    fitz = pytest.importorskip("fitz")
+    from book_maker.loader.pdf_loader import PDFBookLoader
+
+    (tmp_path / "book.md").write_text("one\n\ntwo\n", encoding="utf-8")
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "one")
+    doc.save(str(tmp_path / "book.pdf"))
+    for loader_class, name in [
+        (MarkdownBookLoader, "book.md"),
+        (PDFBookLoader, "book.pdf"),
+    ]:
+        # translation 1 spans two lines, the positions can't be trusted
+        (tmp_path / ".book.temp.bin").write_text(
+            "first\nsecond\nthird", encoding="utf-8"
+        )
+        with pytest.raises(Exception, match="older version"):
+            loader_class(str(tmp_path / name), DummyModel, "", True, "zh")
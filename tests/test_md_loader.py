@@ -0,0 +1,124 @@
+from book_maker.loader.markdown_blocks import tokenize_markdown
+from book_maker.loader.md_loader import MarkdownBookLoader
+from tests.helpers import DummyModel
+
+DOCUMENT = """---
+title: Setup
+---
+
+# Install
+
+Run the installer,
+then restart.
+
+```sh
+pip install bbook_maker
+
+echo done
+```
+
+| option | default |
+|--------|---------|
+| --test | off     |
+
+- first step
+- second step
+  still the second step
+
+> a quote
+
+<div align="center">
+  <img src="logo.png">
+</div>
+
+    indented code
+
+[docs]: https://example.com/docs
+***
+Usage
+-----
+"""
+
+
+def test_tokenize_markdown_classifies_blocks():
+    blocks = tokenize_markdown(DOCUMENT.splitlines())
+    assert [block.kind for block in blocks] == [
+        "front_matter",
+        "heading",
+        "paragraph",
+        "code",
+        "table",
+        "list_item",
+        "list_item",
+        "blockquote",
+        "html",
+        "code",
+        "link_definition",
+        "thematic_break",
+        "heading",
+    ]
+    assert blocks[3].text == "```sh\npip install bbook_maker\n\necho done\n```"
+    assert blocks[6].text == "- second step\n  still the second step"
+
+
+class RecordingModel(DummyModel):
+    texts = []
+
+    def translate(self, text, *args, **kwargs):
+        RecordingModel.texts.append(text)
+        return super().translate(text)
+
+
+def test_only_prose_is_translated(tmp_path):
+    book_path = tmp_path / "setup.md"
+    book_path.write_text(DOCUMENT, encoding="utf-8")
+    RecordingModel.texts = []
+    loader = MarkdownBookLoader(str(book_path), RecordingModel, "", False, "zh")
+    loader.batch_size = 3
+    loader.make_bilingual_book()
+
+    assert RecordingModel.texts == [
+        "# Install\n\nRun the installer,\nthen restart.",
+        "- first step\n- second step\n  still the second step\n\n> a quote",
+        "Usage\n-----",
+    ]
+    output = (tmp_path / "setup_bilingual.md").read_text(encoding="utf-8")
+    for block in tokenize_markdown(DOCUMENT.splitlines()):
+        assert block.text in output
+    assert output.count("pip install bbook_maker") == 1
+    assert output.startswith("---\ntitle: Setup\n---\n\n# Install")
+
+
+class EchoModel(DummyModel):
+    def translate(self, text, *args, **kwargs):
+        return text
+
+
+def test_blocks_keep_their_blank_lines(tmp_path):
+    book_path = tmp_path / "setup.md"
+    document = "\n" + DOCUMENT.replace("> a quote\n", "> a quote\n\n\n") + "  \n"
+    book_path.write_text(document, encoding="utf-8")
+    blocks = tokenize_markdown(document.splitlines())
+    joined = "\n".join(block.leading + block.text for block in blocks)
+    assert joined == document.rstrip(" \n")
+
+    loader = MarkdownBookLoader(str(book_path), EchoModel, "", False, "zh")
+    loader.single_translate = True
+    loader.make_bilingual_book()
+    output = (tmp_path / "setup_bilingual.md").read_text(encoding="utf-8")
+    assert output == document
+
+
+def test_dry_run_leaves_out_saved_batches(tmp_path):
+    book_path = tmp_path / "setup.md"
+    book_path.write_text(DOCUMENT, encoding="utf-8")
+    loader = MarkdownBookLoader(str(book_path), DummyModel, "", False, "zh")
+    loader.batch_size = 3
+    segments = loader.plan_segments()
+    key, text = segments[0]
+    loader.p_to_save.append(key, f"<T>{text}")
+    loader.p_to_save.close()
+
+    loader = MarkdownBookLoader(str(book_path), DummyModel, "", True, "zh")
+    loader.batch_size = 3
+    assert loader.plan_segments() == segments[1:]
@@ -0,0 +1,96 @@
+import shutil
+import threading
+from pathlib import Path
+
+from ebooklib import epub
+
+from book_maker.loader.alignment import AlignmentModel
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.multilingual import make_multilingual_books
+from book_maker.loader.txt_loader import TXTBookLoader
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+class LanguageModel(DummyModel):
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, key, language, **kwargs):
+        super().__init__(key, language, **kwargs)
+        self.language = language
+        # fixed when the translator is made, like the URL of Google Translate
+        self.target = language
+
+    def translate(self, text, *args, **kwargs):
+        with self.lock:
+            LanguageModel.calls.append((self.target, text))
+        return f"<{self.target}>{text}"
+
+
+def create_translator(language):
+    return LanguageModel("", language)
+
+
+def test_epub_is_parsed_once_and_written_per_language(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    LanguageModel.calls = []
+    loader = EPUBBookLoader(str(book_path), LanguageModel, "", False, "Japanese")
+    renderers = []
+
+    def create_renderer(language):
+        renderer = EPUBBookLoader(str(book_path), AlignmentModel, "", False, language)
+        renderers.append(renderer)
+        return renderer
+
+    make_multilingual_books(
+        loader,
+        [("ja", "Japanese"), ("fr", "French")],
+        create_renderer,
+        create_translator,
+        workers=3,
+    )
+
+    segments = loader.plan_segments()
+    assert len(LanguageModel.calls) == 2 * len(segments)
+    assert {language for language, _ in LanguageModel.calls} == {"Japanese", "French"}
+    assert all(renderer.translate_model.missing == 0 for renderer in renderers)
+    for tag, language in [("ja", "Japanese"), ("fr", "French")]:
+        output = epub.read_epub(str(tmp_path / f"animal_farm_bilingual_{tag}.epub"))
+        content = output.get_item_with_href("index_split_002.html").content
+        assert f"&lt;{language}&gt;".encode() in content
+        assert (tmp_path / f"animal_farm_bilingual_{tag}.align").exists()
+    assert not (tmp_path / "animal_farm_bilingual.epub").exists()
+
+
+def test_resume_translates_only_the_missing_languages(tmp_path):
+    book_path = tmp_path / "book.txt"
+    book_path.write_text("one\ntwo\n\nthree\n", encoding="utf-8")
+
+    def create_loader(model, language):
+        loader = TXTBookLoader(str(book_path), model, "", False, language)
+        loader.batch_size = 1
+        return loader
+
+    def run(languages, resume):
+        make_multilingual_books(
+            create_loader(LanguageModel, "German"),
+            languages,
+            lambda language: create_loader(AlignmentModel, language),
+            create_translator,
+            resume=resume,
+        )
+
+    LanguageModel.calls = []
+    run([("de", "German")], False)
+    assert len(LanguageModel.calls) == 3
+
+    LanguageModel.calls = []
+    run([("de", "German"), ("es", "Spanish")], True)
+    assert [language for language, _ in LanguageModel.calls] == ["Spanish"] * 3
+    assert (tmp_path / "book_bilingual_es.txt").read_text(encoding="utf-8") == (
+        "one\n<Spanish>one\ntwo\n<Spanish>two\nthree\n<Spanish>three"
+    )
@@ -1,30 +1,14 @@
 import os
+import sys
 from pathlib import Path
 
 import pytest
 
 fitz = pytest.importorskip("fitz")
 
+import book_maker.loader.pdf_loader
 from book_maker.loader.pdf_loader import PDFBookLoader
-
-
-class DummyModel:
-    def __init__(
-        self,
-        key,
-        language,
-        api_base=None,
-        temperature=1.0,
-        source_lang="auto",
-        **kwargs,
-    ):
-        pass
-
-    def translate(self, text):
-        return f"<T>{text}"
-
-    def translate_list(self, texts):
-        return [f"<T>{t}" for t in texts]
+from tests.helpers import DummyModel
 
 
 def test_pdf_loader_extracts_and_translates(tmp_path):
@@ -65,3 +49,154 @@ def test_pdf_loader_extracts_and_translates(tmp_path):
         epub_file = tmp_path / "test_bilingual.epub"
         assert epub_file.exists()
         assert epub_file.stat().st_size > 0
+
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+def _make_pdf(path, pages):
+    doc = fitz.open()
+    for number in range(pages):
+        word = WORDS[number % len(WORDS)] + "x" * (number // len(WORDS))
+        page = doc.new_page()
+        page.insert_text((72, 40), "The Little Book")
+        page.insert_text(
+            (72, 200), f"and ends on the {word} page. A sen-\ntence of {word} is cut."
+        )
+        page.insert_text((72, 400), f"The {word} page ends with a paragraph that")
+        page.insert_text((300, 800), str(number + 1))
+    doc.save(str(path))
+
+
+def test_pdf_paragraphs_are_rebuilt_from_blocks(tmp_path, monkeypatch):
+    # one token per word, keep the test offline
+    monkeypatch.setattr(
+        book_maker.loader.pdf_loader,
+        "count_tokens",
+        lambda texts: [len(text.split()) for text in texts],
+    )
+    pdf_path = tmp_path / "book.pdf"
+    _make_pdf(pdf_path, 3)
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+
+    # running headers and page numbers are dropped, paragraphs go on across pages
+    assert loader.origin_book == [
+        "and ends on the alpha page. A sentence of alpha is cut.",
+        "The alpha page ends with a paragraph that and ends on the beta page. "
+        "A sentence of beta is cut.",
+        "The beta page ends with a paragraph that and ends on the gamma page. "
+        "A sentence of gamma is cut.",
+        "The gamma page ends with a paragraph that",
+    ]
+    loader.batch_tokens = 32
+    loader.batch_size = 3
+    batches = [text for _, text in loader.plan_segments()]
+    assert len(batches) == 2
+    assert batches[0].split("\n\n") == loader.origin_book[:2]
+
+    # --test counts paragraphs, not batches
+    loader.batch_size = sys.maxsize
+    loader.is_test = True
+    loader.test_num = 2
+    loader.make_bilingual_book()
+    output = (tmp_path / "book_bilingual.txt").read_text(encoding="utf-8")
+    assert output.count("<T>") == 2
+
+
+def test_pdf_pages_are_extracted_lazily_and_cached(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "book.pdf"
+    _make_pdf(pdf_path, 20)
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 2
+    # nothing is extracted before the first batch is asked for
+    assert not (tmp_path / ".book.pages.bin").exists()
+    expected = [text for _, text in loader._batches()]
+    assert len(expected) == 11
+
+    (tmp_path / ".book.pages.bin").unlink()
+    loader.process_workers = 2
+    assert [text for _, text in loader._batches()] == expected
+
+    def no_extraction(numbers):
+        assert numbers == [], "pages extracted again"
+        return iter(())
+
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 2
+    monkeypatch.setattr(loader, "_extract", no_extraction)
+    assert [text for _, text in loader._batches()] == expected
+
+    # another PDF under the same name is extracted again
+    _make_pdf(pdf_path, 3)
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 2
+    assert len(list(loader._batches())) == 2
+
+
+def _epub_chapters(path):
+    from ebooklib import epub
+
+    book = epub.read_epub(str(path))
+    return [item.title for item in book.toc], [
+        item.file_name
+        for item in book.get_items()
+        if isinstance(item, epub.EpubHtml) and not isinstance(item, epub.EpubNav)
+    ]
+
+
+def test_pdf_epub_is_grouped_into_chapters(tmp_path, monkeypatch):
+    pytest.importorskip("ebooklib")
+    monkeypatch.setattr(book_maker.loader.pdf_loader, "_PAGES_PER_CHAPTER", 2)
+    pdf_path = tmp_path / "book.pdf"
+    _make_pdf(pdf_path, 5)
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 1
+    loader.make_bilingual_book()
+
+    # without an outline, ranges of pages
+    titles, files = _epub_chapters(tmp_path / "book_bilingual.epub")
+    assert titles == ["Pages 1-2", "Pages 3-4", "Pages 5-5"]
+    assert len(files) == 3
+
+    # with one, its first level
+    doc = fitz.open(str(pdf_path))
+    doc.set_toc([[1, "Opening", 1], [2, "Detail", 2], [1, "Middle", 3]])
+    doc.saveIncr()
+    doc.close()
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 1
+    loader.make_bilingual_book()
+    titles, files = _epub_chapters(tmp_path / "book_bilingual.epub")
+    assert titles == ["Opening", "Middle"]
+    assert len(files) == 2
+
+
+def test_dry_run_leaves_out_saved_batches(tmp_path):
+    pdf_path = tmp_path / "book.pdf"
+    _make_pdf(pdf_path, 3)
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=False, language="en"
+    )
+    loader.batch_size = 1
+    segments = loader.plan_segments()
+    key, text = segments[0]
+    loader.p_to_save.append(key, f"<T>{text}")
+    loader.p_to_save.close()
+
+    loader = PDFBookLoader(
+        str(pdf_path), DummyModel, key="", resume=True, language="en"
+    )
+    loader.batch_size = 1
+    assert loader.plan_segments() == segments[1:]
@@ -0,0 +1,118 @@
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+from ebooklib import epub
+
+import book_maker.loader.epub_loader
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.paragraph_index import ParagraphIndex, span_text
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+class RetranslateModel(DummyModel):
+    def translate(self, text, *args, **kwargs):
+        return f"<R>{text}"
+
+
+def _chapters(path):
+    with zipfile.ZipFile(path) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+class InterruptedModel(DummyModel):
+    def translate(self, text, *args, **kwargs):
+        if "The windmill presented" in text:
+            raise KeyboardInterrupt
+        return super().translate(text)
+
+
+def test_indexed_retranslate_rewrites_only_the_passages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    output = tmp_path / "animal_farm_bilingual.epub"
+    EPUBBookLoader(str(book_path), DummyModel, "", False, "zh").make_bilingual_book()
+    before = _chapters(output)
+
+    # no chapter is parsed to find the passages
+    parsed = []
+    origin_bs = book_maker.loader.epub_loader.bs
+    monkeypatch.setattr(
+        book_maker.loader.epub_loader,
+        "bs",
+        lambda content, *args: parsed.append(content) or origin_bs(content, *args),
+    )
+    loader = EPUBBookLoader(str(book_path), RetranslateModel, "", False, "zh")
+    loader.retranslate = [
+        str(output),
+        "index_split_002.html",
+        "intellectual cowardice is the worst enemy",
+        "Any fairminded person",
+        "",
+        "The stupidest questions of all",
+        "",
+    ]
+    with pytest.raises(SystemExit):
+        loader.make_bilingual_book()
+
+    after = _chapters(output)
+    changed = {
+        name.split("/", 1)[-1]: after[name].count(b"&lt;R&gt;")
+        for name in before
+        if before[name] != after[name]
+    }
+    # the first passage is two paragraphs long, the second one paragraph
+    assert changed == {"index_split_002.html": 2, "index_split_005.html": 1}
+    epub.read_epub(str(output))
+    # only the source of the two chapters, to render the new translations
+    assert len(parsed) == 2
+
+    # the index follows the rewritten chapters
+    index = ParagraphIndex.load(str(tmp_path / "animal_farm_bilingual.index.json"))
+    for name in before:
+        file_name = name.split("/", 1)[-1]
+        if file_name not in changed:
+            continue
+        content = after[name]
+        texts = [span_text(content[s:e]) for _, s, e in index.spans(file_name)]
+        assert sum(text.count("<R>") for text in texts) == changed[file_name]
+        assert all("<T>" in text or "<R>" in text for text in texts)
+
+
+def test_retranslate_after_a_resumed_run_uses_the_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    output = tmp_path / "animal_farm_bilingual.epub"
+    # the chapters before the interruption come back from their checkpoints
+    with pytest.raises(SystemExit):
+        EPUBBookLoader(
+            str(book_path), InterruptedModel, "", False, "zh"
+        ).make_bilingual_book()
+    EPUBBookLoader(str(book_path), DummyModel, "", True, "zh").make_bilingual_book()
+
+    index = ParagraphIndex.load(str(tmp_path / "animal_farm_bilingual.index.json"))
+    assert index.spans("index_split_002.html")
+    parsed = []
+    origin_bs = book_maker.loader.epub_loader.bs
+    monkeypatch.setattr(
+        book_maker.loader.epub_loader,
+        "bs",
+        lambda content, *args: parsed.append(content) or origin_bs(content, *args),
+    )
+    loader = EPUBBookLoader(str(book_path), RetranslateModel, "", False, "zh")
+    loader.retranslate = [
+        str(output),
+        "index_split_002.html",
+        "intellectual cowardice is the worst enemy",
+        "Any fairminded person",
+    ]
+    with pytest.raises(SystemExit):
+        loader.make_bilingual_book()
+    assert _chapters(output)["EPUB/index_split_002.html"].count(b"&lt;R&gt;") == 2
+    # only the source of the chapter, not a pass over the whole book
+    assert len(parsed) == 1
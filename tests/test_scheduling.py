@@ -0,0 +1,81 @@
+import shutil
+from pathlib import Path
+
+from ebooklib import ITEM_DOCUMENT, epub
+
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.loader.scheduling import (
+    ReorderBuffer,
+    lpt_order,
+    makespan,
+    split_segments,
+)
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def test_lpt_order_beats_spine_order_when_the_big_chapter_is_last():
+    costs = [1, 1, 1, 1, 4]
+    order = lpt_order(costs)
+    assert order[0] == 4
+    assert makespan(costs, 2) == 6
+    assert makespan(costs, 2, order) == 4
+
+
+def test_split_segments_keeps_order_and_budget():
+    segments = [(str(i), "word " * 10) for i in range(10)]
+    parts = split_segments(segments, 30)
+    assert len(parts) > 1
+    assert [s for part, _ in parts for s in part] == segments
+    assert all(cost <= 30 for _, cost in parts)
+
+
+def test_split_chapters_produce_the_same_book(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outputs = []
+    for split_chapter_tokens in (0, 200):
+        book_path = tmp_path / f"split{split_chapter_tokens}" / "animal_farm.epub"
+        book_path.parent.mkdir()
+        shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+        loader = EPUBBookLoader(
+            str(book_path), DummyModel, "", False, "zh", parallel_workers=4
+        )
+        loader.split_chapter_tokens = split_chapter_tokens
+        loader.make_bilingual_book()
+        outputs.append(
+            epub.read_epub(str(book_path.with_name("animal_farm_bilingual.epub")))
+        )
+
+    whole, split = outputs
+    for item in whole.get_items_of_type(ITEM_DOCUMENT):
+        assert split.get_item_with_href(item.file_name).content == item.content
+
+
+def test_reorder_buffer_releases_in_order():
+    released = []
+    reorder = ReorderBuffer(released.append)
+    reorder.put(2, "c")
+    reorder.put(1, "b")
+    assert released == [] and len(reorder) == 2
+    reorder.put(0, "a")
+    reorder.put(3, "d")
+    assert released == ["a", "b", "c", "d"] and len(reorder) == 0
+
+
+def test_parallel_output_is_byte_identical_to_sequential(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    output_path = tmp_path / "animal_farm_bilingual.epub"
+
+    outputs = []
+    for workers, split_chapter_tokens in [(1, 0), (4, 0), (4, 200), (1, 0)]:
+        loader = EPUBBookLoader(
+            str(book_path), DummyModel, "", False, "zh", parallel_workers=workers
+        )
+        loader.split_chapter_tokens = split_chapter_tokens
+        loader.make_bilingual_book()
+        outputs.append(output_path.read_bytes())
+
+    assert all(output == outputs[0] for output in outputs)
@@ -0,0 +1,141 @@
+import shutil
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.translator.chatgptapi_translator import ChatGPTAPI
+from book_maker.translator.memory import (
+    MemoryTranslator,
+    TranslationMemory,
+    carry_over,
+)
+from book_maker.translator.pool import TranslatorPool
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+class ExampleModel(DummyModel):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.language = "zh"
+        self.examples = []
+        self.requests = []
+
+    def translate(self, text, *args, **kwargs):
+        self.requests.append((text, list(self.examples)))
+        return f"<T>{text}"
+
+    def translate_list(self, plist):
+        self.requests.append(([p.text for p in plist], list(self.examples)))
+        return [f"<T>{p.text}" for p in plist]
+
+
+def test_numbers_and_placeholders_are_carried_over():
+    assert (
+        carry_over(
+            "Chapter 3 has {n} pages", "第3章有{n}页", "Chapter 12 has {m} pages"
+        )
+        == "第12章有{m}页"
+    )
+    # the translation does not contain the number, it can not be updated
+    assert carry_over("Chapter 3", "第三章", "Chapter 4") is None
+
+
+def test_memory_reuses_and_hints(tmp_path):
+    path = str(tmp_path / "memory.tm")
+    model = ExampleModel("", "zh")
+    translator = MemoryTranslator(model, TranslationMemory(path, threshold=0.6))
+
+    first = "In 1984 Winston Smith walked to the Ministry of Truth every morning."
+    assert translator.translate(first) == f"<T>{first}"
+    # only the number differs: no request
+    assert translator.translate(first.replace("1984", "1985")) == (
+        f"<T>{first.replace('1984', '1985')}"
+    )
+    # a name differs: the close match is sent as an example
+    second = first.replace("Winston Smith", "Julia")
+    translator.translate(second)
+    assert len(model.requests) == 2
+    assert model.requests[1] == (second, [(first, f"<T>{first}")])
+    assert model.examples == []
+    # something else entirely
+    translator.translate("The clocks were striking thirteen.")
+    assert model.requests[2][1] == []
+    translator.memory.close()
+
+    # the memory is found again, per target language
+    memory = TranslationMemory(path, threshold=0.6)
+    assert len(memory) == 3
+    assert memory.lookup("zh", second).similarity == 1.0
+    assert memory.lookup("ja", second) is None
+
+
+def test_case_differences_are_sent_with_an_example():
+    model = ExampleModel("", "zh")
+    translator = MemoryTranslator(model, TranslationMemory(threshold=0.8))
+    translator.translate("The Ministry Of Truth")
+    # the same words mid-sentence are not the heading
+    translator.translate("the ministry of truth")
+    assert model.requests[1] == (
+        "the ministry of truth",
+        [("The Ministry Of Truth", "<T>The Ministry Of Truth")],
+    )
+
+
+def test_accumulated_paragraphs_go_through_the_memory():
+    model = ExampleModel("", "zh")
+    translator = MemoryTranslator(model, TranslationMemory(threshold=0.6))
+    soup = BeautifulSoup(
+        "<p>Page 1 of the book</p><p>The clocks were striking thirteen.</p>",
+        "html.parser",
+    )
+    assert translator.translate_list(soup.find_all("p")) == [
+        "<T>Page 1 of the book",
+        "<T>The clocks were striking thirteen.",
+    ]
+
+    soup = BeautifulSoup(
+        "<p>Page 2 of the book</p><p>The clocks were striking fourteen.</p>",
+        "html.parser",
+    )
+    assert translator.translate_list(soup.find_all("p")) == [
+        "<T>Page 2 of the book",
+        "<T>The clocks were striking fourteen.",
+    ]
+    # the page number was carried over, only the other paragraph was sent
+    assert model.requests[1] == (
+        ["The clocks were striking fourteen."],
+        [
+            (
+                "The clocks were striking thirteen.",
+                "<T>The clocks were striking thirteen.",
+            )
+        ],
+    )
+    assert len(translator.memory) == 3
+
+
+def test_examples_are_sent_before_the_text():
+    translator = ChatGPTAPI("key", "zh")
+    translator.examples = [("Hello", "你好")]
+    messages = translator.create_messages("Hi", translator.create_context_messages())
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[2]["content"] == "你好"
+
+
+def test_parallel_workers_share_the_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    memory = TranslationMemory()
+    loader = EPUBBookLoader(
+        str(book_path), DummyModel, "", False, "zh", parallel_workers=3
+    )
+    loader.translate_model = MemoryTranslator(loader.translate_model, memory)
+    loader.make_bilingual_book()
+
+    assert len(memory) > 0
+    clone = TranslatorPool(loader.translate_model).get()
+    assert clone.memory is memory and clone.translator is not loader.translate_model
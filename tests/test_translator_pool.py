@@ -0,0 +1,88 @@
+import shutil
+import threading
+import time
+from copy import copy
+from pathlib import Path
+
+from book_maker.loader.epub_loader import EPUBBookLoader
+from book_maker.translator.chatgptapi_translator import ChatGPTAPI
+from book_maker.translator.pool import RateLimiter, TranslatorPool
+from tests.helpers import DummyModel
+
+TEST_BOOKS = Path(__file__).parent.parent / "test_books"
+
+
+def test_clone_starts_its_own_conversation():
+    translator = ChatGPTAPI("key", "zh", context_flag=True)
+    translator.context_list.append("previous paragraph")
+    clone = translator.clone()
+
+    assert clone.context_list == [] and clone.context_translated_list == []
+    assert clone.openai_client is translator.openai_client
+    clone.prompt_template = "changed {text}"
+    assert translator.prompt_template != clone.prompt_template
+
+
+class ThreadModel(DummyModel):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def clone(self):
+        translator = copy(self)
+        translator.calls = []
+        return translator
+
+    def translate(self, text, *args, **kwargs):
+        self.calls.append((threading.get_ident(), text))
+        return super().translate(text)
+
+
+class SlowThreadModel(ThreadModel):
+    def translate(self, text, *args, **kwargs):
+        # long enough for all the workers to ask for the text at once
+        time.sleep(0.05)
+        return super().translate(text)
+
+
+def test_pool_gives_each_thread_its_own_translator_and_shares_the_cache():
+    pool = TranslatorPool(SlowThreadModel("", "zh"))
+    results = []
+
+    def work():
+        translator = pool.get()
+        assert pool.get() is translator
+        results.append(translator.translate("same text"))
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pool.translators) == 3
+    assert pool.prototype not in pool.translators
+    assert results == ["<T>same text"] * 3
+    # the text was sent once, the other workers waited for it
+    assert sum(len(t.calls) for t in pool.translators) == 1
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(0.05)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.1
+
+
+def test_parallel_workers_never_use_the_shared_translator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book_path = tmp_path / "animal_farm.epub"
+    shutil.copyfile(TEST_BOOKS / "animal_farm.epub", book_path)
+    loader = EPUBBookLoader(
+        str(book_path), ThreadModel, "", False, "zh", parallel_workers=3
+    )
+    loader.make_bilingual_book()
+
+    assert loader.translate_model.calls == []
+    assert (tmp_path / "animal_farm_bilingual.epub").exists()
@@ -0,0 +1,143 @@
+import random
+import sys
+import time
+
+import pytest
+
+import book_maker.loader.txt_loader
+
+from book_maker.loader.journal import ProgressJournal
+from book_maker.loader.md_loader import MarkdownBookLoader
+from book_maker.loader.txt_loader import TXTBookLoader
+from tests.helpers import DummyModel
+
+
+class FailingModel(DummyModel):
+    calls = []
+    fail_at = None
+
+    def translate(self, text, *args, **kwargs):
+        if len(FailingModel.calls) == FailingModel.fail_at:
+            raise RuntimeError("rate limited")
+        FailingModel.calls.append(text)
+        return super().translate(text)
+
+
+def _loader(book_path, resume):
+    loader = TXTBookLoader(str(book_path), FailingModel, "", resume, "zh")
+    loader.batch_size = 2
+    return loader
+
+
+def test_txt_is_written_as_it_is_translated_and_resumed(tmp_path):
+    book_path = tmp_path / "book.txt"
+    lines = [f"line {i}" for i in range(10)]
+    book_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    output = tmp_path / "book_bilingual.txt"
+    temp = tmp_path / "book_bilingual_temp.txt"
+
+    FailingModel.calls = []
+    FailingModel.fail_at = 3
+    with pytest.raises(SystemExit):
+        _loader(book_path, False).make_bilingual_book()
+    # the batches translated before the failure are in the temp book
+    assert temp.read_text(encoding="utf-8") == (
+        "line 0\nline 1\n<T>line 0\nline 1\n"
+        "line 2\nline 3\n<T>line 2\nline 3\n"
+        "line 4\nline 5\n<T>line 4\nline 5"
+    )
+    assert not output.exists()
+
+    FailingModel.calls = []
+    FailingModel.fail_at = None
+    _loader(book_path, True).make_bilingual_book()
+    assert FailingModel.calls == ["line 6\nline 7", "line 8\nline 9"]
+    expected = "\n".join(
+        f"line {i}\nline {i + 1}\n<T>line {i}\nline {i + 1}" for i in range(0, 10, 2)
+    )
+    assert output.read_text(encoding="utf-8") == expected
+    assert not temp.exists()
+
+
+class SlowModel(DummyModel):
+    def translate(self, text, *args, **kwargs):
+        # later batches tend to finish first
+        time.sleep(random.uniform(0, 0.02))
+        return super().translate(text)
+
+
+def test_parallel_batches_are_written_in_order(tmp_path):
+    book_path = tmp_path / "book.txt"
+    book_path.write_text(
+        "\n".join(f"line {i}" for i in range(40)) + "\n", encoding="utf-8"
+    )
+    output = tmp_path / "book_bilingual.txt"
+    loader = TXTBookLoader(str(book_path), DummyModel, "", False, "zh")
+    loader.batch_size = 3
+    loader.make_bilingual_book()
+    sequential = output.read_text(encoding="utf-8")
+    journal = ProgressJournal(str(tmp_path / ".book.temp.bin")).load()
+
+    loader = TXTBookLoader(
+        str(book_path), SlowModel, "", False, "zh", parallel_workers=4
+    )
+    loader.batch_size = 3
+    loader.make_bilingual_book()
+    assert output.read_text(encoding="utf-8") == sequential
+    # batches are saved for resuming as soon as they are translated
+    assert ProgressJournal(str(tmp_path / ".book.temp.bin")).load() == journal
+
+    md_path = tmp_path / "book.md"
+    md_path.write_text(
+        "\n\n".join(f"paragraph {i}" for i in range(40)) + "\n", encoding="utf-8"
+    )
+    results = []
+    for workers in (1, 4):
+        loader = MarkdownBookLoader(
+            str(md_path), SlowModel, "", False, "zh", parallel_workers=workers
+        )
+        loader.batch_size = 2
+        loader.make_bilingual_book()
+        results.append((tmp_path / "book_bilingual.md").read_text(encoding="utf-8"))
+    assert results[0] == results[1]
+
+
+def test_batch_tokens_pack_whole_paragraphs(tmp_path, monkeypatch):
+    # one token per word, keep the test offline
+    monkeypatch.setattr(
+        book_maker.loader.txt_loader,
+        "count_tokens",
+        lambda texts: [len(text.split()) for text in texts],
+    )
+    book_path = tmp_path / "book.txt"
+    paragraphs = ["a b\nc d", "e f g", "h\ni\nj\nk\nl\nm", " ".join("x" * 12)]
+    book_path.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+    loader = TXTBookLoader(str(book_path), DummyModel, "", False, "zh")
+    loader.batch_tokens = 10
+    loader.batch_size = 5
+
+    batches = [text for _, text in loader.plan_segments()]
+    assert batches == [
+        # two paragraphs fit the budget
+        "a b\nc d\n\ne f g\n",
+        # over the line cap, cut at its lines
+        "h\ni\nj\nk\nl",
+        "m\n",
+        # over the budget, a single line is sent as it is
+        " ".join("x" * 12),
+    ]
+
+    loader.make_bilingual_book()
+    output = (tmp_path / "book_bilingual.txt").read_text(encoding="utf-8")
+    assert output.count("<T>") == 4
+    assert output.startswith("a b\nc d\n\ne f g\n\n<T>a b\nc d\n\ne f g\n")
+
+    # --test counts lines, not batches, which have no line cap here
+    loader = TXTBookLoader(
+        str(book_path), DummyModel, "", False, "zh", is_test=True, test_num=6
+    )
+    loader.batch_tokens = 10
+    loader.batch_size = sys.maxsize
+    loader.make_bilingual_book()
+    output = (tmp_path / "book_bilingual.txt").read_text(encoding="utf-8")
+    assert output.count("<T>") == 2